@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Analysis: This module calculates the radial distribution function g(r) during the simulation
+
+Before, we wrote every frame to a .xyz file and used the coordination analysis in Ovito.
+Now we count the pairs at different distances every few sweeps, and only keep the histogram.
+So the memory does not grow with the length of the simulation.
+
+    g(r) = (number of pairs between r and r + dr) / (the same number for an ideal gas)
+
+For the binary system we also get the partial g(r) for every pair of species (AA, AB, BB).
+The distances use the same PBC rule as `get_distance_in_pbc`, and the pairs are found with the cell list.
+
+`get_bonded_clusters` finds the clusters of particles that attract each other (the bond is a negative
+pair energy from `get_pair_energies`, distance ≤ width + diameter with a negative depth), so we can follow
+how big the clusters are during the simulation.
+
+`analyse_clusters` also tells if a cluster "percolates", i.e. if it is connected to its own copy in the
+next box. A percolating cluster goes through the whole (infinite, periodic) system, this is a gel.
+The clusters are found with a "union-find": every particle points to a parent in its cluster, and the
+particle at the top (the root) names the cluster. Every particle also remembers where it is relative
+to its parent, without the PBC. When a bond joins two particles that are already in the same cluster,
+we walk from one to the other through the cluster, and through the bond back again:
+
+    ○───○───○───○───○ ┊ ○        the walk through the cluster and the bond should end where it started,
+    a               b ┊ a'       if it ends one box away (at a', the copy of a), the cluster wraps
+                      ┊          around the box in this direction, so it percolates
+    Figure 1. A cluster that percolates in x
+
+Every bond is looked at once, and the walks to the roots are kept short (every walk makes the path
+shorter for the next one, "path halving", and the smaller cluster always goes under the larger one),
+so this is about as fast as reading the bonds.
+"""
+import numpy as np
+from cell_list import get_pairs
+from pbc import get_pair_squared_distances_in_pbc
+from potentials import get_pair_energies
+from compiled import njit
+
+
+def create_rdf(r_max, bin_number, species):
+    """
+    An empty histogram for g(r) from 0 to r_max, species are the names like ['A', 'B']
+    r_max should not be larger than half of the box, otherwise a pair could be counted twice
+    """
+    species_number = len(species)
+    return {
+        'edges': np.linspace(0, r_max, bin_number + 1),
+        'species': list(species),
+        'counts': np.zeros((species_number, species_number, bin_number), dtype=np.int64),
+        'ideal_pair_density': np.zeros((species_number, species_number)),  # number of pairs / volume, added every frame
+        'frame_number': 0,
+    }
+
+
+def accumulate_rdf(rdf, state):
+    """
+    Add the pairs of the current configuration to the histogram
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> positions = np.random.uniform(0, 10, (2000, 3))
+    >>> state = create_particle_state(positions, np.zeros(2000), [10, 10, 10], ['G'], [1])
+    >>> rdf = create_rdf(4, 8, state['species'])
+    >>> accumulate_rdf(rdf, state)
+    >>> r, g, partial = get_rdf(rdf)
+    >>> bool(np.all(np.abs(g[1:] - 1) < 0.1))  # an ideal gas has g(r) = 1
+    True
+    """
+    positions, types, box = state['positions'], state['types'], state['box']
+    r_max = rdf['edges'][-1]
+    if r_max > np.min(box) / 2:
+        raise ValueError('r_max {} should not be larger than half of the box {}'.format(r_max, np.min(box) / 2))
+    i, j = get_pairs(positions, box, r_max)
+    squared_distances = get_pair_squared_distances_in_pbc(positions, np.stack([i, j], axis=1), box)
+    is_close = squared_distances < r_max ** 2
+    distances = np.sqrt(squared_distances[is_close])
+    type_i, type_j = types[i[is_close]].astype(np.int64), types[j[is_close]].astype(np.int64)
+
+    # AB and BA are the same pair, we always put it under the smaller type first
+    type_low, type_high = np.minimum(type_i, type_j), np.maximum(type_i, type_j)
+    species_number = len(rdf['species'])
+    bin_number = len(rdf['edges']) - 1
+    bins = np.minimum((distances / r_max * bin_number).astype(np.int64), bin_number - 1)
+    flat_index = (type_low * species_number + type_high) * bin_number + bins
+    rdf['counts'] += np.bincount(flat_index, minlength=rdf['counts'].size).reshape(rdf['counts'].shape)
+
+    # the number of pairs we would expect from an ideal gas
+    volume = np.prod(box)
+    numbers = np.bincount(types, minlength=species_number).astype(np.float64)
+    pair_numbers = np.outer(numbers, numbers)
+    pair_numbers[np.diag_indices(species_number)] = numbers * (numbers - 1) / 2
+    rdf['ideal_pair_density'] += pair_numbers / volume
+    rdf['frame_number'] += 1
+
+
+def get_rdf(rdf):
+    """
+    Turn the histogram into g(r)
+    Returns the centres of the bins, the total g(r), and a dictionary of the partial g(r) like {'AB': ...}
+    """
+    edges = rdf['edges']
+    shell_volumes = 4 / 3 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+    centres = (edges[1:] + edges[:-1]) / 2
+    species = rdf['species']
+    partial = {}
+    for a in range(len(species)):
+        for b in range(a, len(species)):
+            ideal = rdf['ideal_pair_density'][a, b] * shell_volumes
+            partial[species[a] + species[b]] = rdf['counts'][a, b] / np.where(ideal > 0, ideal, np.inf)
+    upper = np.triu_indices(len(species))
+    total_ideal = np.sum(rdf['ideal_pair_density'][upper]) * shell_volumes
+    total = np.sum(rdf['counts'][upper], axis=0) / np.where(total_ideal > 0, total_ideal, np.inf)
+    return centres, total, partial
+
+
+def save_rdf(rdf, filename):
+    """save r, g(r) and the partial g(r) (named like g_AB) into a small .npz file"""
+    r, g, partial = get_rdf(rdf)
+    arrays = {'g_' + name: value for name, value in partial.items()}
+    np.savez(filename, r=r, g=g, counts=rdf['counts'], frame_number=rdf['frame_number'], **arrays)
+
+
+def get_bonds(state):
+    """
+    The bonded pairs (i, j), two particles are bonded if their pair energy is negative
+    Returns i, j and the separations from i to j in PBC (the shortest ones, see get_distance_in_pbc)
+    """
+    positions, types, box = state['positions'], state['types'], state['box']
+    i, j = get_pairs(positions, box, float(np.max(state['range_matrix'])))
+    squared_distances = get_pair_squared_distances_in_pbc(positions, np.stack([i, j], axis=1), box)
+    is_bonded = get_pair_energies(state, types[i], types[j], squared_distances) < 0
+    i, j = i[is_bonded], j[is_bonded]
+    separations = positions[j] - positions[i]
+    separations -= box * np.round(separations / box)
+    return i, j, separations
+
+
+@njit(cache=True)
+def find_root(i, parents, offsets, offset):
+    """
+    The root of particle i, offset is set to the position of i minus the position of the root (without PBC)
+    On the way up every particle is moved to its grandparent (path halving)
+    """
+    offset[:] = 0
+    while parents[i] != i:
+        parent = parents[i]
+        offsets[i] += offsets[parent]  # now relative to the grandparent
+        parents[i] = parents[parent]
+        offset += offsets[i]
+        i = parents[i]
+    return i
+
+
+@njit(cache=True)
+def compiled_union_find(particle_number, bond_i, bond_j, separations, box):
+    """
+    Join the bonded particles into clusters (see the top of this file)
+    Returns the root of every particle, and for every root if its cluster wraps around x, y and z
+    """
+    parents = np.arange(particle_number)
+    sizes = np.ones(particle_number, dtype=np.int64)
+    offsets = np.zeros((particle_number, 3))  # the position of a particle minus the position of its parent
+    wraps = np.zeros((particle_number, 3), dtype=np.bool_)
+    offset_i = np.empty(3)
+    offset_j = np.empty(3)
+    for bond in range(bond_i.shape[0]):
+        root_i = find_root(bond_i[bond], parents, offsets, offset_i)
+        root_j = find_root(bond_j[bond], parents, offsets, offset_j)
+        if root_i == root_j:
+            # the walk i -> root -> j -> i should be 0, otherwise it went around the box
+            for k in range(3):
+                if abs(offset_i[k] + separations[bond, k] - offset_j[k]) > box[k] / 2:
+                    wraps[root_i, k] = True
+            continue
+        # root_j - root_i = (j - offset_j) - (i - offset_i), and j - i is the separation
+        if sizes[root_i] >= sizes[root_j]:  # the smaller cluster goes under the larger one
+            parents[root_j] = root_i
+            sizes[root_i] += sizes[root_j]
+            for k in range(3):
+                offsets[root_j, k] = separations[bond, k] + offset_i[k] - offset_j[k]
+                wraps[root_i, k] = wraps[root_i, k] or wraps[root_j, k]
+        else:
+            parents[root_i] = root_j
+            sizes[root_j] += sizes[root_i]
+            for k in range(3):
+                offsets[root_i, k] = offset_j[k] - offset_i[k] - separations[bond, k]
+                wraps[root_j, k] = wraps[root_i, k] or wraps[root_j, k]
+    for i in range(particle_number):
+        parents[i] = find_root(i, parents, offsets, offset_i)
+    return parents, wraps
+
+
+def analyse_clusters(state):
+    """
+    Find the bonded clusters, and how many particles of each species they have, and if they percolate
+    The clusters are numbered 0, 1, 2 ... in the order of their first particle
+    Returns a dictionary with
+        'labels'         -- the cluster of every particle
+        'sizes'          -- the number of particles in every cluster
+        'species_sizes'  -- species_sizes[c, s] is the number of particles of species s in cluster c
+        'percolation'    -- percolation[c] is True for x, y, z if cluster c wraps around the box in that direction
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> positions = [[0.5, 1, 1], [1.55, 1, 1], [2.6, 1, 1], [3.65, 1, 1], [6, 6, 6], [6, 6, 7.05]]
+    >>> state = create_particle_state(positions, [0, 0, 0, 0, 1, 1], [4.2, 8, 8], ['A', 'B'], [1, 1],
+    ...                               depths=[[-1, 0], [0, -1]], widths=[[0.1, 0], [0, 0.1]])
+    >>> clusters = analyse_clusters(state)
+    >>> clusters['labels'].tolist(), clusters['sizes'].tolist(), clusters['species_sizes'].tolist()
+    ([0, 0, 0, 0, 1, 1], [4, 2], [[4, 0], [0, 2]])
+    >>> clusters['percolation'].tolist()  # the A chain goes around the box in x
+    [[True, False, False], [False, False, False]]
+    """
+    positions, types = state['positions'], state['types']
+    particle_number = len(positions)
+    i, j, separations = get_bonds(state)
+    roots, wraps = compiled_union_find(particle_number, i.astype(np.int64), j.astype(np.int64), separations,
+                                       state['box'].astype(np.float64))
+    # number the clusters in the order of their first particle
+    unique_roots, first_particles, labels = np.unique(roots, return_index=True, return_inverse=True)
+    order = np.argsort(first_particles)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    labels = ranks[labels.reshape(-1)]
+    cluster_number = len(unique_roots)
+    species_sizes = np.zeros((cluster_number, len(state['species'])), dtype=np.int64)
+    np.add.at(species_sizes, (labels, types), 1)
+    return {
+        'labels': labels,
+        'sizes': np.bincount(labels, minlength=cluster_number),
+        'species_sizes': species_sizes,
+        'percolation': wraps[unique_roots[order]],
+    }
+
+
+def get_cluster_columns(species):
+    """the names of the numbers from get_cluster_values, for the header of a csv file"""
+    columns = ['cluster_number', 'largest_cluster', 'percolating_cluster']
+    for name in species:
+        columns += ['largest_' + name, 'percolating_' + name]
+    return columns
+
+
+def get_cluster_values(clusters):
+    """
+    A few numbers that describe the clusters of one frame, small enough to save every frame
+        cluster_number, largest_cluster      -- the number of clusters, and the size of the largest one
+        percolating_cluster                  -- the size of the largest percolating cluster, 0 if none percolates
+        largest_<s>, percolating_<s>         -- for every species s, the most particles of s in one cluster,
+                                                and the fraction of s in the percolating clusters
+
+    The stuff below are some testing code, don't worry about it
+    >>> clusters = {'sizes': np.array([4, 2]), 'species_sizes': np.array([[3, 1], [0, 2]]),
+    ...             'percolation': np.array([[True, False, False], [False, False, False]])}
+    >>> get_cluster_values(clusters)
+    [2, 4, 4, 3, 1.0, 2, 0.3333]
+    """
+    sizes, species_sizes = clusters['sizes'], clusters['species_sizes']
+    is_percolating = np.any(clusters['percolation'], axis=1)
+    values = [len(sizes), int(np.max(sizes)), int(np.max(sizes[is_percolating], initial=0))]
+    species_numbers = np.maximum(np.sum(species_sizes, axis=0), 1)
+    percolating_numbers = np.sum(species_sizes[is_percolating], axis=0)
+    for s in range(species_sizes.shape[1]):
+        values += [int(np.max(species_sizes[:, s])), round(float(percolating_numbers[s] / species_numbers[s]), 4)]
+    return values
+
+
+def get_bonded_clusters(state):
+    """
+    Give every particle the number of its cluster, two particles are bonded if their pair energy is negative
+    Returns the cluster numbers (0, 1, 2 ...), see analyse_clusters
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> positions = [[1, 1, 1], [2.05, 1, 1], [3.1, 1, 1], [6, 6, 6]]
+    >>> state = create_particle_state(positions, [0, 0, 0, 0], [8, 8, 8], ['A'], [1], depths=[[-1]], widths=[[0.1]])
+    >>> get_bonded_clusters(state).tolist()
+    [0, 0, 0, 1]
+    >>> get_cluster_sizes(get_bonded_clusters(state)).tolist()
+    [3, 1]
+    """
+    return analyse_clusters(state)['labels']
+
+
+def get_cluster_sizes(labels):
+    """the number of particles in each cluster"""
+    return np.bincount(labels)
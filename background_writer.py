@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Background writer: This module does the slow output (frames, printing) in another thread
+
+Writing a frame means formatting N lines of text and handing them to the disk. On a slow (network)
+disk the sweep loop waits for it, and the CPU does nothing in the meantime. With a background writer
+the sweep loop only puts the work into a queue and carries on, a second thread takes the work out
+of the queue and does it:
+
+    sweep loop:   sweep ─ put ─ sweep ─ put ─ sweep ─ put ─ ...
+                           │             │             │
+    queue:                [ frame 1 ][ frame 2 ][ frame 3 ]   (at most queue_size of them)
+                              │
+    writer thread:            write frame 1 ─ write frame 2 ─ ...
+
+    Figure 1. The sweeps and the output run at the same time
+
+The queue is "bounded": if the disk is so slow that queue_size pieces of work are waiting, the sweep
+loop waits until there is space again ("backpressure"), so the memory can't grow forever.
+The time the sweep loop spent waiting is added up in background['blocked_time'], if it is large the disk
+is too slow even in the background. When the queue is empty, the writer calls the functions in
+background['idle_tasks'] (like flushing the files), so the output is on the disk even if the run crashes later.
+If the work fails in the writer thread, the error is raised again in the sweep loop at the next
+submit, wait_for_writer or stop_background_writer.
+
+    background = start_background_writer(queue_size=8)
+    submit(background, print, "hello")   # print('hello') happens in the writer thread
+    stop_background_writer(background)   # wait until everything is done
+
+With queue_size=0 there is no thread at all, start_background_writer returns None and
+submit(None, ...) does the work at once.
+"""
+import time
+import atexit
+import queue
+import threading
+
+
+def start_background_writer(queue_size=8):
+    """
+    Start the writer thread, None if queue_size is 0
+
+    The stuff below are some testing code, don't worry about it
+    >>> lines = []
+    >>> background = start_background_writer(2)
+    >>> for i in range(5):
+    ...     submit(background, lines.append, i)
+    >>> stop_background_writer(background)
+    >>> lines, background['task_number'], background['blocked_time'] >= 0
+    ([0, 1, 2, 3, 4], 5, True)
+    >>> background = start_background_writer(2)
+    >>> submit(background, int, 'not a number')
+    >>> stop_background_writer(background)
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid literal for int() with base 10: 'not a number'
+    >>> submit(None, lines.append, 5)
+    >>> lines[-1]
+    5
+    """
+    if not queue_size:
+        return None
+    background = {
+        'queue': queue.Queue(maxsize=queue_size),
+        'idle_tasks': [],  # called when the queue is empty
+        'blocked_time': 0.0,  # the seconds the sweep loop waited for space in the queue
+        'task_number': 0,
+        'error': None,
+    }
+    # a daemon thread does not keep python alive, atexit still lets it finish the work if the run crashes
+    background['thread'] = threading.Thread(target=run_tasks, args=(background,), daemon=True)
+    background['thread'].start()
+    background['stop_at_exit'] = lambda: stop_background_writer(background, check_error=False)
+    atexit.register(background['stop_at_exit'])
+    return background
+
+
+def run_tasks(background):
+    """the loop of the writer thread, None in the queue means stop"""
+    work_queue = background['queue']
+    while True:
+        task = work_queue.get()
+        try:
+            if task is None:
+                return
+            if background['error'] is None:  # after an error, the rest of the work is thrown away
+                function, args = task
+                function(*args)
+                if work_queue.empty():
+                    for idle_task in list(background['idle_tasks']):
+                        idle_task()
+        except BaseException as error:
+            background['error'] = error
+        finally:
+            work_queue.task_done()
+
+
+def raise_error(background):
+    """raise the error of the writer thread in the sweep loop (only once)"""
+    error, background['error'] = background['error'], None
+    if error is not None:
+        raise error
+
+
+def submit(background, function, *args):
+    """
+    Call function(*args) in the writer thread, or at once if background is None
+    The arguments should not change afterwards, give a copy of the positions
+    """
+    if background is None:
+        function(*args)
+        return
+    raise_error(background)
+    start = time.perf_counter()
+    background['queue'].put((function, args))
+    background['blocked_time'] += time.perf_counter() - start
+    background['task_number'] += 1
+
+
+def wait_for_writer(background):
+    """wait until all the work in the queue is done"""
+    if background is None:
+        return
+    start = time.perf_counter()
+    background['queue'].join()
+    background['blocked_time'] += time.perf_counter() - start
+    raise_error(background)
+
+
+def stop_background_writer(background, check_error=True):
+    """finish all the work in the queue and stop the thread"""
+    if background is None or not background['thread'].is_alive():
+        return
+    atexit.unregister(background['stop_at_exit'])
+    start = time.perf_counter()
+    background['queue'].put(None)
+    background['thread'].join()
+    background['blocked_time'] += time.perf_counter() - start
+    if check_error:
+        raise_error(background)
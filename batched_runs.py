@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Batched runs: This module runs many small independent boxes (replicas) at the same time
+
+For good statistics we run the 125-particle ideal_gas.py or hard_sphere.py hundreds of times with
+different seeds. One run is a python loop over the particles, and python is slow for every single
+particle. Here all the replicas live in one numpy array
+
+    positions[r, i] = (x, y, z) of particle i in replica r,    positions.shape = (R, N, 3)
+
+and one trial move is done for particle i of every replica in one go:
+
+    replica 0:  ○ ○ ● ○ ○        ● is the particle slot we move now, the same slot in all replicas,
+    replica 1:  ○ ○ ● ○ ○        its trial positions, the PBC wrapping, the overlap test and the
+    replica 2:  ○ ○ ● ○ ○        acceptance are all numpy operations on R particles at once
+
+    Figure 1. One step of a batched sweep
+
+The ideal gas has no interactions, so a whole sweep is just one big addition.
+For hard spheres, the trial position is checked against all the N particles of its replica.
+With N = 125 this is cheaper than a cell list, because numpy does it for all replicas together.
+The moves are the same as the scripts: every particle is moved once per sweep, in order,
+by a gaussian random displacement. The replicas never see each other, so they are independent runs.
+
+    summary = simulate_batch('hard_sphere', hard_sphere.parameters, replica_number=200)
+
+Run this file to compare the replica-sweeps per second with running the scripts one by one
+    python batched_runs.py
+"""
+import os
+import time
+import numpy as np
+from initialization import create_positions, get_particle_number
+from parameter_sweep import seed_random_numbers
+from random_stream import create_random_stream, spawn_seeds
+
+MODELS = ['ideal_gas', 'hard_sphere']
+
+
+def create_batch(parameters, replica_number):
+    """
+    The starting positions of all the replicas, (R, N, 3), and the box of the parameters (see initialization.py)
+    With a seed, every replica gets its own seed for the starting positions, like the jobs of parameter_sweep.py
+    """
+    particle_number = get_particle_number(parameters)
+    types = np.zeros(particle_number, dtype=np.int8)
+    seeds = spawn_seeds(parameters['seed'], replica_number) if parameters['seed'] is not None else [None] * replica_number
+    positions = np.empty((replica_number, particle_number, 3))
+    for r, seed in enumerate(seeds):
+        seed_random_numbers(seed)
+        positions[r], box = create_positions(
+            types, [parameters['diameter']], parameters['volume_fraction'], parameters['initial_configuration']
+        )
+    return positions, np.array(box, dtype=np.float64)
+
+
+def ideal_gas_batch_sweep(positions, box, stream):
+    """move every particle of every replica once, there is nothing to reject"""
+    positions += stream['generator'].standard_normal(positions.shape)
+    np.mod(positions, box, out=positions)  # PBC, put everything back into the box
+
+
+def hard_sphere_batch_sweep(positions, box, diameter, stream):
+    """
+    Move particle 0, 1 ... N-1 of all the replicas, the positions are changed in place
+    Returns the number of accepted moves of every replica
+
+    The stuff below are some testing code, don't worry about it
+    >>> positions, box = create_batch({'unit_repeat': 3, 'particle_number': None, 'initial_configuration': 'sc',
+    ...                                'volume_fraction': 0.2, 'diameter': 1, 'seed': 1}, 4)
+    >>> stream = create_random_stream(0)
+    >>> for t in range(20):
+    ...     accept_counts = hard_sphere_batch_sweep(positions, box, 1, stream)
+    >>> accept_counts.shape, bool(np.all(accept_counts > 0))
+    ((4,), True)
+    >>> separations = positions[:, :, np.newaxis] - positions[:, np.newaxis, :]
+    >>> separations -= box * np.round(separations / box)
+    >>> squared_distances = np.sum(separations ** 2, axis=-1) + np.eye(27) * 100
+    >>> bool(np.all(squared_distances > 1))
+    True
+    """
+    replica_number, particle_number = positions.shape[:2]
+    replicas = np.arange(replica_number)
+    displacements = stream['generator'].standard_normal((particle_number, replica_number, 3))
+    accept_counts = np.zeros(replica_number, dtype=np.int64)
+    for i in range(particle_number):
+        trial = np.mod(positions[:, i] + displacements[i], box)
+
+        # the squared distances in PBC between the trial position and every particle of the same replica
+        separations = np.abs(positions - trial[:, np.newaxis, :])
+        separations = np.where(separations > box / 2, box - separations, separations)
+        squared_distances = np.sum(separations ** 2, axis=2)
+        squared_distances[:, i] = np.inf  # a particle does not overlap with itself
+        is_overlap = np.any(squared_distances <= diameter ** 2, axis=1)
+
+        accepted = replicas[~is_overlap]
+        positions[accepted, i] = trial[accepted]
+        accept_counts[accepted] += 1
+    return accept_counts
+
+
+def simulate_batch(model, parameters, replica_number, output_directory='.'):
+    """
+    Run replica_number copies of ideal_gas.py or hard_sphere.py (model) with the parameters of the script
+    The final positions (and the accept ratio of every replica) are saved to batch_<model>.npz
+    Returns a small summary, with the replica-sweeps per second
+
+    The stuff below are some testing code, don't worry about it
+    >>> import tempfile, hard_sphere
+    >>> summary = simulate_batch('hard_sphere', dict(hard_sphere.parameters, total_steps=5, seed=0), 3, tempfile.mkdtemp())
+    >>> summary['replica_number'], summary['particle_number'], 0 < summary['accept_ratio'] < 1
+    (3, 125, True)
+    """
+    if model not in MODELS:
+        raise ValueError('model should be one of {}, not {}'.format(MODELS, model))
+    total_steps = parameters['total_steps']
+    diameter = parameters['diameter']
+    positions, box = create_batch(parameters, replica_number)
+    stream = create_random_stream(parameters['seed'])
+    accept_counts = np.zeros(replica_number, dtype=np.int64)
+
+    start = time.perf_counter()
+    for t in range(total_steps):
+        if model == 'ideal_gas':
+            ideal_gas_batch_sweep(positions, box, stream)
+        else:
+            accept_counts += hard_sphere_batch_sweep(positions, box, diameter, stream)
+    elapsed = time.perf_counter() - start
+
+    particle_number = positions.shape[1]
+    summary = {
+        'replica_number': replica_number,
+        'particle_number': particle_number,
+        'box_size': float(box[0]),
+        'replica_sweeps_per_second': replica_number * total_steps / max(elapsed, 1e-9),
+    }
+    accept_ratios = accept_counts / particle_number / max(total_steps, 1)
+    if model == 'hard_sphere':
+        summary['accept_ratio'] = float(np.mean(accept_ratios))
+    np.savez(os.path.join(output_directory, 'batch_{}.npz'.format(model)), positions=positions, box=box,
+             accept_ratios=accept_ratios)
+    return summary
+
+
+if __name__ == "__main__":
+    import tempfile
+    import contextlib
+    import importlib
+
+    # the same work as a batch, and as the scripts one after another (a few runs are enough to time them)
+    for model in MODELS:
+        parameters = dict(importlib.import_module(model).parameters, total_steps=20, seed=0)
+        with tempfile.TemporaryDirectory() as directory:
+            summary = simulate_batch(model, parameters, 200, directory)
+            simulate = importlib.import_module(model).simulate
+            start = time.perf_counter()
+            for seed in range(5):
+                with contextlib.redirect_stdout(None):
+                    simulate(dict(parameters, seed=seed), directory)
+            script_speed = 5 * parameters['total_steps'] / (time.perf_counter() - start)
+        print('{:<12} batch of 200: {:8.1f} replica-sweeps/s, one by one: {:8.1f} sweeps/s, {:.1f}x faster'.format(
+            model, summary['replica_sweeps_per_second'], script_speed, summary['replica_sweeps_per_second'] / script_speed
+        ))
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: This script measures how fast the binary square well system runs with each backend
+It prints the sweeps per second, and the average energy and accept ratio.
+The backends use different random numbers, but the averages should be close to each other.
+At the end it shows how the 'checkerboard' backend gets faster with more CPU cores.
+
+    python benchmark.py
+
+The suite runs the whole simulate() of every script (ideal gas, hard spheres, attracted and binary)
+with many particle numbers and volume fractions, and always the same seed. For every run it records
+    - sweeps per second and attempted moves per second (without the time to write the frames)
+    - the accept ratio
+    - the peak memory (RSS) of the run
+    - the time to write one frame
+and saves everything to a JSON file. Run it before and after a change, and compare the two files
+
+    python benchmark.py suite benchmark_before.json
+    python benchmark.py suite benchmark_after.json
+    python benchmark.py compare benchmark_before.json benchmark_after.json
+
+Every run is done in a new process, so the peak memory of one run doesn't mix with the others.
+The python loops are slow, so the largest systems only do a few sweeps (see moves_per_run).
+"""
+import os
+import io
+import sys
+import json
+import time
+import platform
+import tempfile
+import importlib
+import contextlib
+import multiprocessing
+import random as random
+import numpy as np
+from cell_list import build_cell_list
+from particle_state import create_particle_state, get_max_interaction_range
+from compiled import HAS_NUMBA
+from sweep_engine import BACKENDS, select_backend, sweep
+from random_stream import create_random_stream
+
+
+def make_binary_state(unit_repeat, volume_fraction, ratio_ab=0.5):
+    """the same starting configuration as hard_sphere_attracted_binary.py, a cubic lattice of A and B"""
+    particle_number = unit_repeat ** 3
+    types = np.array([0 if random.random() <= ratio_ab else 1 for i in range(particle_number)], dtype=np.int8)
+    lattice = np.array(np.meshgrid(*[np.arange(unit_repeat)] * 3, indexing='ij'), dtype=np.float64)
+    rescale = (np.pi / 6 / volume_fraction) ** (1. / 3)
+    box_size = unit_repeat * rescale
+    return create_particle_state(
+        lattice.reshape(3, -1).T * rescale, types, [box_size] * 3, species=['A', 'B'], diameters=[1, 1],
+        depths=[[-5, 5], [5, -5]], widths=[[0.1, 0.5], [0.5, 0.1]]
+    )
+
+
+def run_benchmark(backend, unit_repeat, volume_fraction, sweeps, seed=0):
+    """run some sweeps and return (sweeps per second, energy per particle, accept ratio)"""
+    random.seed(seed)
+    stream = create_random_stream(seed)
+    state = make_binary_state(unit_repeat, volume_fraction)
+    cell_list = build_cell_list(state['positions'], state['box'], get_max_interaction_range(state))
+    backend = select_backend(backend)
+    step = 0.5  # half of the diameter, a move should stay inside a checkerboard domain most of the time
+    sweep(state, cell_list, step, backend, stream=stream)  # the first numba call includes the compiling time
+
+    energy_change, accept_count = 0, 0
+    start = time.perf_counter()
+    for t in range(sweeps):
+        accepted, delta = sweep(state, cell_list, step, backend, stream=stream)
+        energy_change += delta
+        accept_count += accepted
+    duration = time.perf_counter() - start
+    particle_number = len(state['positions'])
+    return sweeps / duration, energy_change / particle_number, accept_count / particle_number / sweeps
+
+
+def run_scaling(unit_repeat, volume_fraction, sweeps, thread_numbers=None):
+    """
+    The sweeps per second of the 'checkerboard' backend with different numbers of CPU cores (threads)
+    Returns a list of (thread number, sweeps per second, speed up compared to 1 thread)
+    """
+    import numba
+
+    if thread_numbers is None:
+        thread_numbers = [2 ** k for k in range(8) if 2 ** k <= numba.config.NUMBA_NUM_THREADS]
+    results = []
+    for thread_number in thread_numbers:
+        numba.set_num_threads(thread_number)
+        speed = run_benchmark('checkerboard', unit_repeat, volume_fraction, sweeps)[0]
+        results.append((thread_number, speed, speed / results[0][1] if results else 1.0))
+    numba.set_num_threads(numba.config.NUMBA_NUM_THREADS)
+    return results
+
+
+MODELS = ['ideal_gas', 'hard_sphere', 'hard_sphere_attracted', 'hard_sphere_attracted_binary']
+
+
+def run_model(model, particle_number, volume_fraction, sweeps, backend=None, seed=0):
+    """
+    Run simulate() of one script in a temporary directory, and time it
+    The first sweep is not counted, numba compiles (or loads) its functions there
+    Returns a dictionary with the results, see the top of this file
+    """
+    module = importlib.import_module(model)
+
+    # time every write_frame call of the script, the time between the frames is the sweep
+    frame_times = []
+    original_write_frame = module.write_frame
+
+    def timed_write_frame(*args, **kwargs):
+        start = time.perf_counter()
+        original_write_frame(*args, **kwargs)
+        frame_times.append((start, time.perf_counter()))
+
+    parameters = dict(module.parameters, particle_number=particle_number, volume_fraction=volume_fraction,
+                      total_steps=sweeps, seed=seed)
+    if 'analysis_interval' in parameters:
+        parameters['analysis_interval'] = 0  # g(r) of a big box is slow, it is not what we measure
+    if 'before_equilibrium' in parameters:
+        parameters['before_equilibrium'] = 0
+    if backend is not None:
+        parameters['backend'] = backend
+    # write the frames in the sweep loop, with a background writer write_frame would only time putting them
+    # into the queue, and the real writing would be counted as sweep time
+    parameters['output_queue_size'] = 0
+
+    module.write_frame = timed_write_frame
+    try:
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            summary = module.simulate(parameters, directory)
+            wall_time = time.perf_counter() - start
+    finally:
+        module.write_frame = original_write_frame
+
+    # from the start of the second frame to the start of the last frame
+    timed_frames = frame_times[1:]
+    timed_sweeps = len(timed_frames) - 1
+    loop_time = timed_frames[-1][0] - timed_frames[0][0]
+    io_time = sum(end - start for start, end in timed_frames[:-1])
+    sweep_time = loop_time - io_time
+    return {
+        'model': model,
+        'backend': backend or 'python',
+        'particle_number': summary['particle_number'],
+        'volume_fraction': volume_fraction,
+        'sweeps': sweeps,
+        'seed': seed,
+        'wall_time': wall_time,
+        'sweeps_per_second': timed_sweeps / sweep_time,
+        'moves_per_second': timed_sweeps * summary['particle_number'] / sweep_time,
+        'accept_ratio': summary.get('accept_ratio', 1.0),  # the ideal gas accepts every move
+        'peak_rss_mb': get_peak_memory(),
+        'io_time_per_frame': io_time / timed_sweeps,
+    }
+
+
+def get_peak_memory():
+    """the largest memory (RSS) this process has used, in MB, or None if we can't tell (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux gives kB, macOS gives bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_model_in_new_process(queue, *args):
+    queue.put(run_model(*args))
+
+
+def run_suite(particle_numbers=(125, 1000, 8000, 100000), volume_fractions=(0.1, 0.3), models=MODELS,
+              moves_per_run=300000, seed=0, filename='benchmark_results.json'):
+    """
+    Run every model with every particle number and volume fraction, the binary script with every backend
+    Every run tries about moves_per_run moves (but at least 3 sweeps)
+    The results are printed and saved to filename, together with the information about the computer
+    """
+    context = multiprocessing.get_context('spawn')  # a fresh process, the memory starts from zero
+    results = []
+    for model in models:
+        backends = [None]
+        if model == 'hard_sphere_attracted_binary':
+            backends = BACKENDS if HAS_NUMBA else ['python']
+        for particle_number in particle_numbers:
+            for volume_fraction in volume_fractions:
+                for backend in backends:
+                    sweeps = max(3, moves_per_run // particle_number)
+                    queue = context.Queue()
+                    process = context.Process(
+                        target=run_model_in_new_process,
+                        args=(queue, model, particle_number, volume_fraction, sweeps, backend, seed)
+                    )
+                    process.start()
+                    result = queue.get()
+                    process.join()
+                    results.append(result)
+                    print('{:<30} {:<12} N = {:<7} φ = {:<5} {:>10.2f} sweeps/s {:>12.0f} moves/s '
+                          'accept {:.2f} memory {:>7.1f} MB frame {:.4f} s'.format(
+                              model, result['backend'], particle_number, volume_fraction,
+                              result['sweeps_per_second'], result['moves_per_second'], result['accept_ratio'],
+                              result['peak_rss_mb'] or 0, result['io_time_per_frame']
+                          ))
+
+    machine = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+    }
+    if HAS_NUMBA:
+        import numba
+        machine['numba'] = numba.__version__
+        machine['numba_threads'] = numba.get_num_threads()
+    with open(filename, 'w') as f:
+        json.dump({'machine': machine, 'results': results}, f, indent=1)
+    return results
+
+
+def compare_results(old_filename, new_filename, tolerance=0.1):
+    """
+    Compare the sweeps per second of two suite files, the runs are matched by model, backend, N and φ
+    A run that is more than tolerance (10%) slower is marked as SLOWER
+    Returns a list of (model, backend, particle number, volume fraction, new speed / old speed)
+    """
+    def load(filename):
+        with open(filename) as f:
+            results = json.load(f)['results']
+        return {(r['model'], r['backend'], r['particle_number'], r['volume_fraction']): r for r in results}
+
+    old, new = load(old_filename), load(new_filename)
+    ratios = []
+    for key in old:
+        if key not in new:
+            continue
+        ratio = new[key]['sweeps_per_second'] / old[key]['sweeps_per_second']
+        ratios.append(key + (ratio,))
+        print('{:<30} {:<12} N = {:<7} φ = {:<5} speed x {:.2f} {}'.format(
+            *key, ratio, 'SLOWER' if ratio < 1 - tolerance else ''
+        ))
+    return ratios
+
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == 'suite':
+    run_suite(filename=sys.argv[2] if len(sys.argv) > 2 else 'benchmark_results.json')
+elif __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == 'compare':
+    compare_results(sys.argv[2], sys.argv[3])
+elif __name__ == "__main__":
+    volume_fraction = 0.1
+    sweeps = 20
+    backends = BACKENDS if HAS_NUMBA else ['python']
+    for unit_repeat in [5, 10, 20]:
+        for backend in backends:
+            speed, energy, accept_ratio = run_benchmark(backend, unit_repeat, volume_fraction, sweeps)
+            print('N = {:<6} backend = {:<12} {:>10.2f} sweeps/s   ΔE per atom {:^8.2f} accept ratio {:^8.2f}'.format(
+                unit_repeat ** 3, backend, speed, energy, accept_ratio
+            ))
+
+    if HAS_NUMBA:
+        for thread_number, speed, speed_up in run_scaling(20, volume_fraction, sweeps):
+            print('N = {:<6} checkerboard with {:>3} threads {:>10.2f} sweeps/s   speed up {:.2f}'.format(
+                20 ** 3, thread_number, speed, speed_up
+            ))
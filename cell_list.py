@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Cell list: This module splits the box into small cubic cells to find neighbours quickly
+Every cell is at least as wide as the interaction range, so a particle can only touch
+particles in its own cell and in the 26 cells around it (27 cells in total).
+Checking these cells instead of all particles makes one sweep cost O(N) instead of O(N²)
+
+The cells are stored as a "linked list" with two arrays
+    head[cell]     -- the first particle inside the cell (-1 if the cell is empty)
+    next[particle] -- the next particle inside the same cell (-1 if it is the last one)
+
+    cell 0: head ─→ 4 ─→ 1 ─→ -1
+    cell 1: head ─→ -1                 (empty)
+    cell 2: head ─→ 0 ─→ 3 ─→ 2 ─→ -1
+
+    Figure 1. Example of a linked list with 3 cells and 5 particles
+
+The compiled sweeps (sweep_engine.py, event_chain.py) use the same arrays, the small compiled
+helpers for them are at the end of this file.
+"""
+import numpy as np
+from compiled import njit
+
+
+def build_cell_list(positions, box, cutoff):
+    """
+    Put every particle into a cell, the cells are not smaller than the cutoff
+
+    The stuff below are some testing code, don't worry about it
+    >>> cells = build_cell_list([[0.5, 0.5, 0.5], [9.5, 9.5, 9.5]], [10, 10, 10], 2)
+    >>> cells['cells_per_side'].tolist()
+    [5, 5, 5]
+    >>> sorted(get_neighbours([0.1, 0.1, 0.1], cells))
+    [0, 1]
+    >>> sorted(get_neighbours([5, 5, 5], cells))
+    []
+    """
+    positions = np.array(positions, dtype=np.float64)
+    box = np.array(box, dtype=np.float64)
+    cells_per_side = np.maximum(np.floor(box / cutoff), 1).astype(np.int64)
+    cell_list = {
+        'box': box,
+        'cutoff': float(cutoff),
+        'cells_per_side': cells_per_side,
+        'cell_size': box / cells_per_side,
+        'head': np.full(np.prod(cells_per_side), -1, dtype=np.int64),
+        'next': np.full(len(positions), -1, dtype=np.int64),
+        'cell_of': np.zeros(len(positions), dtype=np.int64),
+    }
+    for i, position in enumerate(positions):
+        add_particle(cell_list, i, position)
+    return cell_list
+
+
+def resize_cell_list(cell_list, box):
+    """
+    Give the cell list a new box (after a volume move), the cells are still not smaller than the cutoff
+    The particles are not put into the new cells here, use rebuild_cell_list in sweep_engine.py for that
+
+    The stuff below are some testing code, don't worry about it
+    >>> cells = build_cell_list([[0.5, 0.5, 0.5], [9.5, 9.5, 9.5]], [10, 10, 10], 2)
+    >>> resize_cell_list(cells, [7, 7, 7])
+    >>> cells['cells_per_side'].tolist(), cells['head'].shape
+    ([3, 3, 3], (27,))
+    """
+    box = np.array(box, dtype=np.float64)
+    cells_per_side = np.maximum(np.floor(box / cell_list['cutoff']), 1).astype(np.int64)
+    if np.any(cells_per_side != cell_list['cells_per_side']):
+        cell_list['head'] = np.full(np.prod(cells_per_side), -1, dtype=np.int64)
+    cell_list['box'] = box
+    cell_list['cells_per_side'] = cells_per_side
+    cell_list['cell_size'] = box / cells_per_side
+
+
+def get_cell_coordinate(position, cell_list):
+    """the integer (cx, cy, cz) of the cell that contains the position"""
+    coordinate = np.floor(np.array(position) / cell_list['cell_size']).astype(np.int64)
+    return coordinate % cell_list['cells_per_side']  # wrap positions sitting exactly on the box edge
+
+
+def get_cell_index(coordinate, cell_list):
+    """turn (cx, cy, cz) into a single number, we use it to index the head array"""
+    nx, ny, nz = cell_list['cells_per_side']
+    cx, cy, cz = coordinate
+    return (cx * ny + cy) * nz + cz
+
+
+def add_particle(cell_list, i, position):
+    """put particle i to the front of the cell that contains the position"""
+    cell = get_cell_index(get_cell_coordinate(position, cell_list), cell_list)
+    cell_list['cell_of'][i] = cell
+    cell_list['next'][i] = cell_list['head'][cell]
+    cell_list['head'][cell] = i
+
+
+def remove_particle(cell_list, i):
+    """take particle i out from the chain of its cell"""
+    cell = cell_list['cell_of'][i]
+    head, next_ = cell_list['head'], cell_list['next']
+    if head[cell] == i:
+        head[cell] = next_[i]
+    else:
+        j = head[cell]
+        while next_[j] != i:
+            j = next_[j]
+        next_[j] = next_[i]
+    next_[i] = -1
+
+
+def move_particle(cell_list, i, new_position):
+    """
+    Update the cell list after the move of particle i was accepted
+    Nothing happens if the particle stays in the same cell
+    """
+    cell = get_cell_index(get_cell_coordinate(new_position, cell_list), cell_list)
+    if cell != cell_list['cell_of'][i]:
+        remove_particle(cell_list, i)
+        add_particle(cell_list, i, new_position)
+
+
+def get_neighbour_cells(position, cell_list):
+    """
+    the indices of the 27 cells around the position
+    If there are less than 3 cells in one dimension, the same cell would be counted twice
+    So we remove the repeated cells
+    """
+    centre = get_cell_coordinate(position, cell_list)
+    nx, ny, nz = cell_list['cells_per_side']
+    cells = set()
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                coordinate = ((centre[0] + dx) % nx, (centre[1] + dy) % ny, (centre[2] + dz) % nz)
+                cells.add(get_cell_index(coordinate, cell_list))
+    return cells
+
+
+def get_neighbours(position, cell_list):
+    """
+    Get all the particles that might be closer than the cutoff to the position
+    The list may contain far away particles, so we still need to check the distance
+    """
+    head, next_ = cell_list['head'], cell_list['next']
+    neighbours = []
+    for cell in get_neighbour_cells(position, cell_list):
+        j = head[cell]
+        while j != -1:
+            neighbours.append(int(j))
+            j = next_[j]
+    return neighbours
+
+
+def get_pairs(positions, box, cutoff):
+    """
+    Find all pairs (i, j) with i < j that might be closer than the cutoff, in one go with numpy
+    This is useful when we need all the pairs, like the g(r) or the energy of the whole system.
+    Returns two arrays, i and j. The list may contain far away pairs, so check the distance.
+
+    The stuff below are some testing code, don't worry about it
+    >>> i, j = get_pairs([[0.5, 0.5, 0.5], [9.5, 9.5, 9.5], [5, 5, 5]], [10, 10, 10], 2)
+    >>> list(zip(i.tolist(), j.tolist()))
+    [(0, 1)]
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    box = np.asarray(box, dtype=np.float64)
+    cells_per_side = np.maximum(np.floor(box / cutoff), 1).astype(np.int64)
+    coordinates = np.floor(positions / (box / cells_per_side)).astype(np.int64) % cells_per_side
+    cells = (coordinates[:, 0] * cells_per_side[1] + coordinates[:, 1]) * cells_per_side[2] + coordinates[:, 2]
+
+    # sort the particles by their cells, so the particles of one cell are next to each other
+    order = np.argsort(cells, kind='stable')
+    counts = np.bincount(cells, minlength=np.prod(cells_per_side))
+    starts = np.cumsum(counts) - counts
+
+    # with less than 3 cells in one dimension, the left and the right cell are the same cell
+    offsets_1d = [(-1, 0, 1) if n >= 3 else tuple(range(n)) for n in cells_per_side]
+    all_i, all_j = [], []
+    for dx in offsets_1d[0]:
+        for dy in offsets_1d[1]:
+            for dz in offsets_1d[2]:
+                neighbour = (coordinates + [dx, dy, dz]) % cells_per_side
+                if cells_per_side[0] < 3:
+                    neighbour[:, 0] = dx
+                if cells_per_side[1] < 3:
+                    neighbour[:, 1] = dy
+                if cells_per_side[2] < 3:
+                    neighbour[:, 2] = dz
+                neighbour_cells = (neighbour[:, 0] * cells_per_side[1] + neighbour[:, 1]) * cells_per_side[2] + neighbour[:, 2]
+                # particle i is paired with every particle in its neighbour cell
+                pair_counts = counts[neighbour_cells]
+                i = np.repeat(np.arange(len(positions)), pair_counts)
+                first = np.repeat(starts[neighbour_cells] - np.cumsum(pair_counts) + pair_counts, pair_counts)
+                j = order[first + np.arange(len(i))]
+                is_new = i < j  # every pair is counted once
+                all_i.append(i[is_new])
+                all_j.append(j[is_new])
+    return np.concatenate(all_i), np.concatenate(all_j)
+
+
+@njit(cache=True)
+def get_cell_coordinate_1d(value, cell_size, cells):
+    return int(np.floor(value / cell_size)) % cells
+
+
+@njit(cache=True)
+def get_neighbour_coordinate(centre, offset, cells):
+    """offset goes 0, 1, 2 for the cell on the left, the cell itself and the cell on the right"""
+    if cells >= 3:
+        return (centre + offset - 1) % cells
+    return offset  # with less than 3 cells we visit every cell once
+
+
+@njit(cache=True)
+def move_in_cell_list(i, position, head, next_, cell_of, cells_per_side, cell_size):
+    """the same as move_particle, for the compiled sweeps"""
+    cell = 0
+    for d in range(3):
+        cell = cell * cells_per_side[d] + get_cell_coordinate_1d(position[d], cell_size[d], cells_per_side[d])
+    old_cell = cell_of[i]
+    if cell == old_cell:
+        return
+    if head[old_cell] == i:
+        head[old_cell] = next_[i]
+    else:
+        j = head[old_cell]
+        while next_[j] != i:
+            j = next_[j]
+        next_[j] = next_[i]
+    cell_of[i] = cell
+    next_[i] = head[cell]
+    head[cell] = i
+
+
+@njit(cache=True)
+def rebuild_cell_list(positions, head, next_, cell_of, cells_per_side, cell_size):
+    """the same as build_cell_list, but it fills the arrays we already have"""
+    head[:] = -1
+    for i in range(positions.shape[0]):
+        cell = 0
+        for d in range(3):
+            cell = cell * cells_per_side[d] + get_cell_coordinate_1d(positions[i, d], cell_size[d], cells_per_side[d])
+        cell_of[i] = cell
+        next_[i] = head[cell]
+        head[cell] = i
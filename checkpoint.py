@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoint: This module saves everything we need to continue a simulation later
+
+A long run could be killed (time limit, power cut ...), and then we had to start from the
+cubic lattice and throw away the `before_equilibrium` sweeps again. Now the simulation saves
+a checkpoint every few sweeps, with
+    - the positions, types and box of the particles, and the cell list
+    - the step (it was adjusted by `adjust_step`), the sweep number and the running energy
+    - the g(r) histogram and how far we got in the trajectory file
+    - the state of the random numbers of `random`, `np.random` and the random stream of the sweeps (see random_stream.py)
+With the random numbers saved, a restarted run gives exactly the same numbers as a run that never stopped.
+
+The checkpoint is one small .npz file. We first write it to a temporary file and then rename it,
+renaming is atomic, so if the run is killed while writing we still have the previous checkpoint.
+"""
+import os
+import random as random
+import numpy as np
+from random_stream import get_stream_state, set_stream_state
+from cell_list import resize_cell_list
+
+
+def get_random_state(stream=None):
+    """
+    The state of every random number generator as numpy arrays
+
+    The stuff below are some testing code, don't worry about it
+    >>> from random_stream import create_random_stream
+    >>> stream = create_random_stream(0)
+    >>> random_state = get_random_state(stream)
+    >>> numbers = [random.random(), np.random.normal(), stream['generator'].random()]
+    >>> set_random_state(random_state, stream)
+    >>> numbers == [random.random(), np.random.normal(), stream['generator'].random()]
+    True
+    """
+    version, keys, gauss_next = random.getstate()
+    name, numpy_keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    random_state = {
+        'random_version': np.array(version),
+        'random_keys': np.array(keys, dtype=np.uint32),
+        'random_gauss_next': np.array(np.nan if gauss_next is None else gauss_next),
+        'numpy_keys': numpy_keys,
+        'numpy_position': np.array(position),
+        'numpy_has_gauss': np.array(has_gauss),
+        'numpy_cached_gaussian': np.array(cached_gaussian),
+    }
+    if stream is not None:
+        random_state['stream_state'] = np.array(get_stream_state(stream))
+    return random_state
+
+
+def set_random_state(random_state, stream=None):
+    """put the random number generators (and the stream, if it is given) back to the state from `get_random_state`"""
+    gauss_next = float(random_state['random_gauss_next'])
+    random.setstate((
+        int(random_state['random_version']),
+        tuple(int(key) for key in random_state['random_keys']),
+        None if np.isnan(gauss_next) else gauss_next,
+    ))
+    np.random.set_state((
+        'MT19937', random_state['numpy_keys'], int(random_state['numpy_position']),
+        int(random_state['numpy_has_gauss']), float(random_state['numpy_cached_gaussian'])
+    ))
+    if stream is not None and 'stream_state' in random_state:
+        set_stream_state(stream, random_state['stream_state'])
+
+
+def save_checkpoint(filename, state, cell_list, step, sweep_number, energy, rdf=None, trajectory_position=None,
+                    extra=None, stream=None):
+    """
+    Save the simulation into filename (a .npz file), the old checkpoint is replaced in one go
+    extra is a dictionary of other arrays to keep, they come back as checkpoint['extra']
+    stream is the random stream of the sweeps (see random_stream.py)
+
+    The stuff below are some testing code, don't worry about it
+    >>> import tempfile
+    >>> from particle_state import create_particle_state
+    >>> from cell_list import build_cell_list
+    >>> state = create_particle_state(np.random.uniform(0, 5, (10, 3)), np.zeros(10), [5, 5, 5], ['A'], [1])
+    >>> cell_list = build_cell_list(state['positions'], state['box'], 1)
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'checkpoint.npz')
+    >>> save_checkpoint(filename, state, cell_list, step=0.3, sweep_number=20, energy=-4.0)
+    >>> checkpoint = load_checkpoint(filename)
+    >>> checkpoint['sweep_number'], checkpoint['step'], checkpoint['energy']
+    (20, 0.3, -4.0)
+    >>> bool(np.all(checkpoint['positions'] == state['positions']))
+    True
+    """
+    arrays = {
+        'positions': state['positions'],
+        'types': state['types'],
+        'box': state['box'],
+        'head': cell_list['head'],
+        'next': cell_list['next'],
+        'cell_of': cell_list['cell_of'],
+        'step': np.array(step),
+        'sweep_number': np.array(sweep_number),
+        'energy': np.array(energy),
+    }
+    if rdf is not None:
+        arrays['rdf_counts'] = rdf['counts']
+        arrays['rdf_ideal_pair_density'] = rdf['ideal_pair_density']
+        arrays['rdf_frame_number'] = np.array(rdf['frame_number'])
+    if trajectory_position is not None:
+        for name, value in trajectory_position.items():
+            arrays['trajectory_' + name] = np.array(value)
+    if extra is not None:
+        for name, value in extra.items():
+            arrays['extra_' + name] = np.asarray(value)
+    arrays.update(get_random_state(stream))
+
+    # write to a temporary file first, then rename it to the real name
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_filename, filename)
+
+
+def load_checkpoint(filename):
+    """Read a checkpoint, the numbers come back as python numbers and the arrays as numpy arrays"""
+    with np.load(filename) as data:
+        checkpoint = {name: data[name] for name in data.files}
+    checkpoint['step'] = float(checkpoint['step'])
+    checkpoint['sweep_number'] = int(checkpoint['sweep_number'])
+    checkpoint['energy'] = float(checkpoint['energy'])
+    checkpoint['extra'] = {name[len('extra_'):]: value for name, value in checkpoint.items() if name.startswith('extra_')}
+    if 'trajectory_size' in checkpoint:
+        checkpoint['trajectory_position'] = {
+            'frame_number': int(checkpoint['trajectory_frame_number']),
+            'size': int(checkpoint['trajectory_size']),
+            'index_size': int(checkpoint['trajectory_index_size']),
+        }
+    return checkpoint
+
+
+def restore_simulation(checkpoint, state, cell_list, rdf=None, stream=None):
+    """
+    Copy the particles, the cell list, the g(r) histogram and the random numbers (and the stream) from the checkpoint
+    The state and the cell list should already be created with the same parameters
+    """
+    if checkpoint['positions'].shape != state['positions'].shape:
+        raise ValueError('the checkpoint has {} particles, not {}'.format(
+            len(checkpoint['positions']), len(state['positions'])
+        ))
+    state['positions'][:] = checkpoint['positions']
+    state['types'][:] = checkpoint['types']
+    state['box'][:] = checkpoint['box']
+    resize_cell_list(cell_list, state['box'])  # the box could be changed by volume moves
+    for name in ['head', 'next', 'cell_of']:
+        cell_list[name][:] = checkpoint[name]
+    if rdf is not None and 'rdf_counts' in checkpoint:
+        rdf['counts'][:] = checkpoint['rdf_counts']
+        rdf['ideal_pair_density'][:] = checkpoint['rdf_ideal_pair_density']
+        rdf['frame_number'] = int(checkpoint['rdf_frame_number'])
+    set_random_state(checkpoint, stream)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Cluster moves: This module moves groups of bonded particles together
+
+With deep square wells the particles stick together. If we move one particle of a cluster,
+it almost always breaks a bond, so the move is rejected, and the clusters hardly move at all.
+Real clusters diffuse and stick to each other (this is how the gel forms), so we also want
+to move a whole cluster in one go.
+
+We use the "virtual move Monte Carlo" (VMMC) of Whitelam and Geissler (J. Chem. Phys. 127, 154101, 2007)
+    1. Pick a random particle, and a random displacement d
+    2. Pretend to move the particle by d (a "virtual move"), and look at every neighbour.
+       If the energy between them goes up, the neighbour is pulled into the cluster with the probability
+            p_forward = max(0, 1 - exp(E_before - E_after))
+       We also check the reverse move (moving by -d), if it would not pull the neighbour in
+       the link is "frustrated" and the whole move is rejected
+    3. Repeat 2 for every new particle of the cluster
+    4. Move the whole cluster by d. The energy change between the cluster and the outside is
+       already taken care of by the links, so the acceptance probability only depends on the
+       pairs inside the cluster whose link failed (they were pulled in through another particle)
+            P = min(1, Π (1 - p_reverse) / (1 - p_forward))
+The probabilities are chosen so that the detailed balance still holds.
+The links use the pair energies of potentials.py, so it works for any potential, not only square wells.
+"""
+import numpy as np
+from cell_list import get_neighbours, move_particle
+from pbc import get_squared_distances_in_pbc
+from potentials import get_pair_energies
+from random_stream import create_random_stream, get_default_stream
+
+
+def get_neighbour_energies(i, position, neighbours, state):
+    """the energy between particle i (sitting at position) and each neighbour, an overlap is infinite"""
+    neighbours = np.asarray(neighbours, dtype=np.int64)
+    types = state['types']
+    squared_distances = get_squared_distances_in_pbc(position, state['positions'][neighbours], state['box'])
+    return get_pair_energies(state, types[i], types[neighbours], squared_distances)
+
+
+def wrap_position(position, box):
+    """put a position back into the box"""
+    return np.mod(position, box)
+
+
+def vmmc_move(state, cell_list, step, stream, max_cluster_size=None):
+    """
+    One virtual move, the cluster is moved by a random displacement between -step and step
+    The move is rejected if the cluster has more than max_cluster_size particles
+    The random numbers come from the stream, see random_stream.py
+    Returns (is_accepted, energy change, size of the cluster)
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> from cell_list import build_cell_list
+    >>> state = create_particle_state(
+    ...     [[1, 1, 1], [2.05, 1, 1], [5, 5, 5]], [0, 0, 0], [8, 8, 8], ['A'], [1], depths=[[-100]], widths=[[0.1]]
+    ... )
+    >>> cells = build_cell_list(state['positions'], state['box'], 1.1)
+    >>> stream = create_random_stream(0)
+    >>> sizes = [vmmc_move(state, cells, 0.5, stream)[2] for t in range(20)]
+    >>> sorted(set(sizes))  # the bonded pair always moves together
+    [1, 2]
+    >>> float(np.sqrt(get_squared_distances_in_pbc(state['positions'][0], state['positions'][[1]], state['box'])[0])) <= 1.1
+    True
+    """
+    positions, box = state['positions'], state['box']
+    generator = stream['generator']
+    seed = int(generator.integers(0, len(positions)))
+    displacement = generator.uniform(-step, step, 3)
+
+    cluster = [seed]
+    in_cluster = {seed}
+    failed_links = {}  # (inside particle, other particle) -> (energy change, log of (1 - p_reverse) / (1 - p_forward))
+    k = 0
+    while k < len(cluster):
+        p = cluster[k]
+        k += 1
+        old_position = positions[p]
+        new_position = wrap_position(old_position + displacement, box)
+        reverse_position = wrap_position(old_position - displacement, box)
+        candidates = set(get_neighbours(old_position, cell_list))
+        candidates.update(get_neighbours(new_position, cell_list))
+        candidates.update(get_neighbours(reverse_position, cell_list))
+        candidates = sorted(candidates - in_cluster)
+        if len(candidates) == 0:
+            continue
+
+        old_energies = get_neighbour_energies(p, old_position, candidates, state)
+        new_energies = get_neighbour_energies(p, new_position, candidates, state)
+        reverse_energies = get_neighbour_energies(p, reverse_position, candidates, state)
+        p_forward = np.maximum(0, 1 - np.exp(old_energies - new_energies))
+        p_reverse = np.maximum(0, 1 - np.exp(old_energies - reverse_energies))
+
+        link_randoms = generator.random(len(candidates))
+        for n, q in enumerate(candidates):
+            link_random = link_randoms[n]
+            if link_random < p_forward[n]:
+                # the same random number decides the reverse link
+                if link_random >= p_reverse[n]:
+                    return False, 0.0, len(cluster)  # frustrated link
+                cluster.append(q)
+                in_cluster.add(q)
+                if max_cluster_size is not None and len(cluster) > max_cluster_size:
+                    return False, 0.0, len(cluster)
+            else:
+                with np.errstate(divide='ignore'):
+                    log_ratio = np.log(1 - p_reverse[n]) - np.log(1 - p_forward[n])
+                failed_links[(p, q)] = (new_energies[n] - old_energies[n], log_ratio)
+
+    # only the pairs between the cluster and the outside change their energy
+    # the pairs inside the cluster decide if the move is accepted
+    energy_change = 0.0
+    log_probability = 0.0
+    for (p, q), (pair_energy_change, log_ratio) in failed_links.items():
+        if q in in_cluster:
+            log_probability += log_ratio
+        else:
+            energy_change += pair_energy_change
+    if not generator.random() < np.exp(min(log_probability, 0)):
+        return False, 0.0, len(cluster)
+
+    for p in cluster:
+        positions[p] = wrap_position(positions[p] + displacement, box)
+        move_particle(cell_list, p, positions[p])
+    return True, float(energy_change), len(cluster)
+
+
+def cluster_sweep(state, cell_list, step, moves=None, max_cluster_size=None, stream=None):
+    """
+    Try many virtual moves, one for each particle if moves is None
+    Without a stream the random numbers are seeded from `random`
+    Returns the number of accepted moves, the energy change and the sizes of the clusters we tried to move
+    """
+    stream = get_default_stream(stream)
+    if moves is None:
+        moves = len(state['positions'])
+    accept_count = 0
+    energy_change = 0.0
+    cluster_sizes = []
+    for _ in range(moves):
+        is_accepted, delta, size = vmmc_move(state, cell_list, step, stream, max_cluster_size)
+        accept_count += is_accepted
+        energy_change += delta
+        cluster_sizes.append(size)
+    return accept_count, energy_change, cluster_sizes
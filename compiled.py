@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled: This module gives numba's njit to the other modules, or a stand-in if numba is not installed
+
+    from compiled import njit
+
+    @njit(cache=True)
+    def add(a, b):      # machine code with numba, a plain python function without it
+        return a + b
+
+HAS_NUMBA tells if numba is there, prange is numba's parallel range (or the normal range).
+"""
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """without numba the functions stay as plain python functions"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
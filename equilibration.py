@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Equilibration: This module decides when a run is equilibrated, and when it has enough samples
+
+The binary script used to wait a hand-picked `before_equilibrium` sweeps, then run a fixed `total_steps`,
+and adjust_step changed the step in every sweep, also after the equilibrium. A step that keeps changing
+breaks the detailed balance, and a fixed number of sweeps is either too short or a waste of time.
+A "run controller" looks at the energy of every sweep instead
+
+    1. Is the run equilibrated? We use MSER (the "marginal standard error rule", White 1997): cut the first
+       d sweeps away, so that the mean of the rest is as precise as possible
+
+            MSER(d) = Σ (E_t - mean)² / (T - d)²,   the sum and the mean are over t ≥ d
+
+       At the start the energy drifts, so cutting it away makes MSER smaller. If the best d is in the
+       first half of the run, the drift is over. Then the step is frozen, and the production starts.
+    2. How many samples do we have? Energies of sweeps next to each other are almost the same, so T sweeps
+       are only worth T / g independent samples. g is the "statistical inefficiency"
+
+            g = 1 + 2 Σ (1 - t / T) C(t)
+
+       C(t) is the autocorrelation of the energy after t sweeps (we stop the sum when it becomes negative).
+       The run stops when the production has target_samples independent samples.
+
+    controller = create_run_controller(target_samples=100)
+    for t in range(max_sweeps):
+        ... one sweep ...
+        add_energy(controller, energy)
+        if not controller['is_frozen']:
+            step = adjust_step(...)
+        if controller['is_finished']:
+            break
+"""
+import numpy as np
+
+# MSER looks at the means of blocks of 5 sweeps, the usual "MSER-5"
+MSER_BLOCK = 5
+
+
+def get_mser_truncation(values, block=MSER_BLOCK):
+    """
+    The number of values to cut away at the start (see the top of this file), None if the values are still drifting
+
+    The stuff below are some testing code, don't worry about it
+    >>> values = np.concatenate([np.linspace(10, 0, 100), np.random.default_rng(0).normal(0, 1, 900)])
+    >>> 80 <= get_mser_truncation(values) <= 120
+    True
+    >>> get_mser_truncation(np.linspace(10, 0, 1000)) is None
+    True
+    """
+    block_number = len(values) // block
+    if block_number < 4:
+        return None
+    means = np.mean(np.reshape(values[:block_number * block], (block_number, block)), axis=1)
+    # the sums over the blocks d, d + 1 ... (from the end), so every d is one numpy operation
+    sums = np.cumsum(means[::-1])[::-1]
+    squared_sums = np.cumsum(means[::-1] ** 2)[::-1]
+    numbers = np.arange(block_number, 0, -1)
+    mser = (squared_sums - sums ** 2 / numbers)[:-1] / numbers[:-1] ** 2  # keep at least 2 blocks
+    best = int(np.argmin(mser))
+    if best >= block_number / 2:
+        return None
+    return best * block
+
+
+def get_statistical_inefficiency(values):
+    """
+    How many values are worth one independent sample, at least 1 (see the top of this file)
+
+    The stuff below are some testing code, don't worry about it
+    >>> noise = np.random.default_rng(0).normal(0, 1, 10000)
+    >>> round(get_statistical_inefficiency(noise))
+    1
+    >>> 8 < get_statistical_inefficiency(np.repeat(noise[:1000], 10)) < 12
+    True
+    >>> get_statistical_inefficiency(np.zeros(10))
+    1.0
+    """
+    values = np.asarray(values, dtype=np.float64)
+    number = len(values)
+    deviations = values - np.mean(values)
+    variance = np.mean(deviations ** 2)
+    if number < 2 or variance == 0:
+        return 1.0
+    # the autocorrelation for all t in one go with a FFT (the sum of products is a convolution)
+    transform = np.fft.rfft(deviations, 2 * number)
+    lags = np.arange(1, number)
+    correlations = np.fft.irfft(transform * np.conj(transform))[1:number] / (number - lags) / variance
+    negative = np.flatnonzero(correlations <= 0)
+    end = negative[0] if len(negative) else number - 1
+    inefficiency = 1 + 2 * np.sum((1 - lags[:end] / number) * correlations[:end])
+    return float(max(inefficiency, 1.0))
+
+
+def create_run_controller(target_samples=100, check_interval=50):
+    """
+    target_samples is the number of independent samples we want after the equilibrium
+    The energies are checked every check_interval sweeps, the checks are fast but not free
+
+    The stuff below are some testing code, don't worry about it
+    >>> controller = create_run_controller(target_samples=50, check_interval=10)
+    >>> energies = np.concatenate([np.linspace(0, -50, 100), -50 + np.random.default_rng(1).normal(0, 1, 10000)])
+    >>> for t, energy in enumerate(energies):
+    ...     add_energy(controller, energy)
+    ...     if controller['is_finished']:
+    ...         break
+    >>> controller['is_frozen'], controller['equilibrium_sweep'] <= 120, controller['effective_samples'] >= 50
+    (True, True, True)
+    >>> bool(t < 400)
+    True
+    """
+    return {
+        'target_samples': target_samples,
+        'check_interval': check_interval,
+        'energies': [],  # the energy of every sweep since the start
+        'is_frozen': False,  # True after the equilibrium, then the step should not change any more
+        'equilibrium_sweep': None,  # where the drift of the energy is over (from MSER)
+        'production_sweep': None,  # where the step was frozen, the samples are counted from here
+        'statistical_inefficiency': None,
+        'effective_samples': 0.0,
+        'is_finished': False,
+    }
+
+
+def add_energy(controller, energy):
+    """add the energy of one sweep, every check_interval sweeps we look at the equilibrium and the samples"""
+    energies = controller['energies']
+    energies.append(float(energy))
+    if len(energies) % controller['check_interval'] != 0:
+        return
+    if not controller['is_frozen']:
+        truncation = get_mser_truncation(energies)
+        if truncation is None:
+            return
+        controller['is_frozen'] = True
+        controller['equilibrium_sweep'] = truncation
+        controller['production_sweep'] = len(energies)
+        return
+    production = energies[controller['production_sweep']:]
+    controller['statistical_inefficiency'] = get_statistical_inefficiency(production)
+    controller['effective_samples'] = len(production) / controller['statistical_inefficiency']
+    controller['is_finished'] = controller['effective_samples'] >= controller['target_samples']
+
+
+def restore_controller(controller, energies):
+    """put the controller back after a restart, every decision is made again from the energies of the checkpoint"""
+    controller.update(create_run_controller(controller['target_samples'], controller['check_interval']))
+    for energy in energies:
+        add_energy(controller, energy)
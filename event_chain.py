@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Event chain: This module moves hard spheres without rejecting any move
+
+At a high volume fraction almost every trial move of hard_sphere.py ends in an overlap, so most of
+the CPU time is spent on moves that are thrown away. "Event-chain Monte Carlo" (Bernard, Krauth and
+Wilson, Phys. Rev. E 80, 056704, 2009) never rejects a move:
+
+    1. Pick a random particle and a direction (+x, +y or +z), and a total length ℓ of the chain
+    2. Slide the particle along the direction until it hits another particle (an "event")
+    3. Stop it at the contact, the particle that was hit carries on in the same direction ("lifting")
+    4. Repeat 2 and 3 until the chain has moved ℓ in total
+
+        ○→    ○     ○            ○ →  ○     ○           ○    ○○→   ○
+        i     j     k     ==>         i    j      ==>        ij    k  ...
+
+    Figure 1. The move is passed on from i to j at the collision, then from j to k
+
+The next collision is found with the cell list. While the moving particle stays inside its cell,
+it can only hit particles in the 27 cells around it. When it reaches the wall of its cell,
+it goes into the next cell and we look again.
+
+The chains also give the pressure for free. Every lift jumps forward by the distance between the
+two centres along the direction, and (Michel, Kapfer and Krauth, J. Chem. Phys. 140, 054116, 2014)
+
+    P / (ρ kT) = 1 + <sum of the lift distances of a chain> / ℓ
+
+The particles stop exactly at the contact, so two particles can touch. check_overlap in
+hard_sphere.py counts a contact as an overlap, so don't mix the two kinds of moves in one run.
+"""
+import numpy as np
+from compiled import njit
+from cell_list import get_neighbour_coordinate
+from random_stream import get_default_stream
+
+
+def get_collision_distance(position, others, diameters, direction, box):
+    """
+    How far the particle at position can slide along direction (0, 1 or 2) before it touches each of the others
+    diameters are the contact distances, inf if the particle never meets it
+    This is the easy to read version of the search in compiled_event_chains, one particle against many with numpy
+    The distances use the same periodic boundary condition as check_overlap in hard_sphere.py
+
+    The stuff below are some testing code, don't worry about it
+    >>> get_collision_distance([1, 1, 1], [[3, 1, 1], [2, 2.2, 1], [9.5, 1, 1]], 1, 0, [10, 10, 10]).tolist()
+    [1.0, inf, inf]
+    >>> get_collision_distance([9.5, 1, 1], [[1, 1.5, 1]], 1, 0, [10, 10, 10]).round(3).tolist()
+    [0.634]
+    """
+    others = np.asarray(others, dtype=np.float64).reshape(-1, 3)
+    box = np.asarray(box, dtype=np.float64)
+    separations = others - np.asarray(position, dtype=np.float64)
+    separations = np.where(separations > box / 2, separations - box, separations)
+    separations = np.where(separations < -box / 2, separations + box, separations)
+    ahead = separations[:, direction]  # how far the others are in front of the particle
+    squared_sideways = np.sum(separations ** 2, axis=1) - ahead ** 2
+    squared_contacts = np.broadcast_to(np.asarray(diameters, dtype=np.float64), ahead.shape) ** 2
+    will_hit = (ahead > 0) & (squared_sideways < squared_contacts)
+    distances = ahead - np.sqrt(np.where(will_hit, squared_contacts - squared_sideways, 0))
+    return np.where(will_hit, np.maximum(distances, 0), np.inf)
+
+
+@njit(cache=True)
+def move_to_cell(i, cell, head, next_, cell_of):
+    """take particle i out of its cell and put it into another cell"""
+    old_cell = cell_of[i]
+    if head[old_cell] == i:
+        head[old_cell] = next_[i]
+    else:
+        j = head[old_cell]
+        while next_[j] != i:
+            j = next_[j]
+        next_[j] = next_[i]
+    cell_of[i] = cell
+    next_[i] = head[cell]
+    head[cell] = i
+
+
+@njit(cache=True)
+def compiled_event_chains(positions, diameters, box, head, next_, cell_of, cells_per_side, cell_size,
+                          picks, directions, chain_length):
+    """
+    Run one chain for every pick, diameters has one diameter for every particle
+    Returns (number of lifts, sum of the lift distances)
+    """
+    nx, ny, nz = cells_per_side[0], cells_per_side[1], cells_per_side[2]
+    coordinate = np.empty(3, dtype=np.int64)
+    separation = np.empty(3)
+    lift_count = 0
+    lift_distance = 0.0
+    for chain in range(picks.shape[0]):
+        i = picks[chain]
+        d = directions[chain]
+        remaining = chain_length
+        while remaining > 0:
+            # the cell of i, and how far it is from the wall of the cell in front of it
+            cell = cell_of[i]
+            coordinate[0] = cell // (ny * nz)
+            coordinate[1] = (cell // nz) % ny
+            coordinate[2] = cell % nz
+            to_wall = max((coordinate[d] + 1) * cell_size[d] - positions[i, d], 0.0)
+
+            # the first particle in front of i, only the 27 cells around it are visited
+            first_hit = -1
+            hit_distance = min(remaining, to_wall)
+            hit_ahead = 0.0
+            for offset_x in range(3):
+                cx = get_neighbour_coordinate(coordinate[0], offset_x, nx)
+                for offset_y in range(3):
+                    cy = get_neighbour_coordinate(coordinate[1], offset_y, ny)
+                    for offset_z in range(3):
+                        cz = get_neighbour_coordinate(coordinate[2], offset_z, nz)
+                        j = head[(cx * ny + cy) * nz + cz]
+                        while j != -1:
+                            if j != i:
+                                squared_distance = 0.0
+                                for k in range(3):
+                                    separation[k] = positions[j, k] - positions[i, k]
+                                    if separation[k] > box[k] / 2:
+                                        separation[k] -= box[k]
+                                    elif separation[k] < -box[k] / 2:
+                                        separation[k] += box[k]
+                                    squared_distance += separation[k] * separation[k]
+                                ahead = separation[d]
+                                contact = (diameters[i] + diameters[j]) / 2
+                                squared_sideways = squared_distance - ahead * ahead
+                                if ahead > 0 and squared_sideways < contact * contact:
+                                    distance = max(ahead - np.sqrt(contact * contact - squared_sideways), 0.0)
+                                    if distance < hit_distance:
+                                        first_hit = j
+                                        hit_distance = distance
+                                        hit_ahead = ahead
+                            j = next_[j]
+
+            # slide i forward, then pass the move on, go into the next cell, or stop
+            remaining -= hit_distance
+            if first_hit != -1:
+                positions[i, d] += hit_distance
+                if positions[i, d] >= box[d]:
+                    positions[i, d] -= box[d]
+                lift_count += 1
+                lift_distance += hit_ahead - hit_distance
+                i = first_hit
+            elif hit_distance == to_wall and remaining > 0:
+                coordinate[d] = (coordinate[d] + 1) % cells_per_side[d]
+                positions[i, d] = coordinate[d] * cell_size[d]  # exactly on the wall, so we don't get stuck before it
+                move_to_cell(i, (coordinate[0] * ny + coordinate[1]) * nz + coordinate[2], head, next_, cell_of)
+            else:
+                positions[i, d] += hit_distance
+                if positions[i, d] >= box[d]:
+                    positions[i, d] -= box[d]
+    return lift_count, lift_distance
+
+
+def event_chain_sweep(state, cell_list, chain_length, chain_number, stream=None):
+    """
+    Run chain_number chains of length chain_length, the positions and the cell list are changed in place
+    The cells should be at least as wide as the largest diameter, with at least 3 cells per side
+    The random numbers come from the stream (see random_stream.py)
+    Returns (number of lifts, sum of the lift distances), see get_pressure
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> from cell_list import build_cell_list
+    >>> from random_stream import create_random_stream
+    >>> from pbc import get_pair_squared_distances_in_pbc
+    >>> positions = np.mgrid[0:4, 0:4, 0:4].reshape(3, -1).T * 1.25 + 0.5  # 64 particles on a lattice
+    >>> state = create_particle_state(positions, np.zeros(64), [5, 5, 5], ['H'], [1])
+    >>> cells = build_cell_list(state['positions'], state['box'], 1)
+    >>> lift_count, lift_distance = event_chain_sweep(state, cells, 2.0, 100, create_random_stream(0))
+    >>> lift_count > 0, bool(lift_distance > 0)
+    (True, True)
+    >>> pairs = np.array(np.triu_indices(64, 1)).T
+    >>> bool(np.all(get_pair_squared_distances_in_pbc(state['positions'], pairs, state['box']) > 1 - 1e-9))
+    True
+    """
+    if np.any(cell_list['cells_per_side'] < 3):
+        raise ValueError('the event chains need at least 3 cells per side, not {}'.format(cell_list['cells_per_side']))
+    stream = get_default_stream(stream)
+    generator = stream['generator']
+    positions = state['positions']
+    picks = generator.integers(0, len(positions), chain_number)
+    directions = generator.integers(0, 3, chain_number)
+    lift_count, lift_distance = compiled_event_chains(
+        positions, state['diameters'][state['types']].astype(np.float64), state['box'],
+        cell_list['head'], cell_list['next'], cell_list['cell_of'], cell_list['cells_per_side'],
+        cell_list['cell_size'], picks, directions, float(chain_length)
+    )
+    return int(lift_count), float(lift_distance)
+
+
+def get_pressure(state, lift_distance, chain_length, chain_number):
+    """
+    The pressure P / kT from the lift distances of chain_number chains (see the top of this file)
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> state = create_particle_state(np.zeros((10, 3)), np.zeros(10), [10, 10, 10], ['H'], [1])
+    >>> get_pressure(state, 0, 1, 5)  # no lifts, an ideal gas
+    0.01
+    """
+    number_density = len(state['positions']) / float(np.prod(state['box']))
+    return number_density * (1 + lift_distance / (chain_length * chain_number))
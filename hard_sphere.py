@@ -4,8 +4,18 @@ Hard Sphere: This script creates a lattice of particles that won't overlap
 You can easily tell the difference between random gas and hard spheres from the g(r)
 Most of the code is the same for random gas
 """
-import random as random
+import os
 import numpy as np
+from cell_list import build_cell_list, get_neighbours, move_particle
+from pbc import get_squared_distances_in_pbc
+from particle_state import create_particle_state, get_labels
+from initialization import create_positions, get_particle_number
+from trajectory import open_trajectory, write_frame, close_trajectory
+from background_writer import start_background_writer, stop_background_writer
+from parameter_sweep import seed_random_numbers
+from random_stream import create_random_stream, draw_sweep
+from analysis import create_rdf, accumulate_rdf, save_rdf
+from event_chain import event_chain_sweep, get_pressure
 
 
 def check_overlap(p1, p2, diameter, box):
@@ -23,6 +33,9 @@ def check_overlap(p1, p2, diameter, box):
 
     Figure 1. Example of PBC in 1D
 
+    p2 could also be many particles, then we check if p1 overlaps with any of them
+    The distances are calculated in one go with numpy, see pbc.py
+
     The stuff below are some testing code, don't worry about it
     >>> check_overlap([1, 1], [1.5, 1.5], 2, [5, 5])
     True
@@ -32,108 +45,148 @@ def check_overlap(p1, p2, diameter, box):
     False
     >>> check_overlap([1, 1, 1], [5, 5, 5], 2, [5, 5, 5])
     True
+    >>> check_overlap([1, 1], [[3, 3], [1.5, 1.5]], 2, [5, 5])
+    True
     """
-
-    dimension = len(p1)
-    distance_nd = []
-    for d in range(dimension):
-        distance_1d = abs(p2[d] - p1[d])
-        if distance_1d > (box[d] / 2):
-            distance_nd.append((box[d] - distance_1d) ** 2)
-        else:
-            distance_nd.append(distance_1d ** 2)
-    distance = sum(distance_nd) ** 0.5
-
-    if distance > diameter:
-        return False  # not overlap
-    else:
-        return True
-
-# Initial parameters
-unit_repeat = 5  # number of unit cells per dimension
-lattice_constant = 1
-box_size = lattice_constant * unit_repeat
-particle_number = unit_repeat ** 3  # number of particles
-total_steps = 100
-volume_fraction = 0.1
-diameter = 1
-
-# rewrite file
-output_file = open('positions_hard_sphere.xyz', 'w')
-output_file.close()
-
-# Generate initial co-ordinates
-x, y, z = [], [], []
-for i in range(0, unit_repeat):
-    for j in range(0, unit_repeat):
-        for k in range(0, unit_repeat):
-            x.append(i * lattice_constant)
-            y.append(j * lattice_constant)
-            z.append(k * lattice_constant)
-
-# Rescale the box/coordinates so we achieve the correct volume fraction/density.
-atoms_per_cell = 1
-atom_volume = np.pi * diameter ** 3 / 6
-initial_volume_fraction = atoms_per_cell * atom_volume  # / unit volume (=1)
-rescale = (initial_volume_fraction / volume_fraction) ** (1. / 3)
-box_size *= rescale
-
-for a in range(0, particle_number):
-    x[a] *= rescale
-for a in range(0, particle_number):
-    y[a] *= rescale
-for a in range(0, particle_number):
-    z[a] *= rescale
-
-# Move particles, output their coordinates
-for t in range(0, total_steps):
-    # Write positions to file
-    with open('positions_hard_sphere.xyz', 'a') as f:
-        f.write(str(len(x)) + '\n')
-        f.write('\n')
-        for i in range(len(x)):
+    squared_distances = get_squared_distances_in_pbc(p1, p2, box)
+    return bool(np.any(squared_distances <= diameter ** 2))
+
+
+# Initial parameters, change them and call simulate(parameters), or use parameter_sweep.py
+parameters = {
+    'unit_repeat': 5,  # number of unit cells per dimension, there are unit_repeat³ particles
+    'particle_number': None,  # any number of particles, None means unit_repeat³
+    'initial_configuration': 'sc',  # 'sc', 'bcc', 'fcc', 'random' or 'compress', see initialization.py
+    'total_steps': 100,
+    'analysis_interval': 10,  # calculate g(r) every 10 steps, 0 means never
+    'volume_fraction': 0.1,
+    'diameter': 1,
+    'seed': None,  # a number to get the same random numbers every time
+    'output_queue_size': 8,  # frames waiting to be written by a background thread (see background_writer.py), 0 writes them in the sweep loop
+    'move': 'metropolis',  # 'metropolis' for the trial moves below, or 'event_chain' for chains without rejection (see event_chain.py)
+    'chain_length': None,  # how far one event chain goes, None means half of the box
+}
+
+
+def simulate(parameters, output_directory='.'):
+    """
+    Run the simulation with the parameters above, the output files are saved in output_directory
+    Returns a small summary of the run
+    """
+    particle_number = get_particle_number(parameters)  # number of particles
+    initial_configuration = parameters['initial_configuration']
+    total_steps = parameters['total_steps']
+    analysis_interval = parameters['analysis_interval']
+    volume_fraction = parameters['volume_fraction']
+    diameter = parameters['diameter']
+    move = parameters['move']
+    if move not in ['metropolis', 'event_chain']:
+        raise ValueError("move should be 'metropolis' or 'event_chain', not {}".format(move))
+
+    # Use the same random numbers every time if a seed is given
+    seed_random_numbers(parameters['seed'])
+    stream = create_random_stream(parameters['seed'])  # the random numbers of the moves
+
+    # Generate initial co-ordinates, a lattice (or random positions) with the correct volume fraction
+    types = np.zeros(particle_number, dtype=np.int8)
+    positions, box = create_positions(types, [diameter], volume_fraction, initial_configuration)
+    box_size = box[0]
+
+    # Keep the positions in one numpy array, and remember the type of every particle
+    state = create_particle_state(positions, types, box, species=['H'], diameters=[diameter])
+    positions = state['positions']  # ((x1, y1, z1), (x2, y2, z2) ...)
+
+    # Open the output file once, every frame is added to the end of it
+    # the frames are written by a background thread, so the sweeps don't wait for the disk
+    background = start_background_writer(parameters['output_queue_size'])
+    trajectory = open_trajectory(os.path.join(output_directory, 'positions_hard_sphere.xyz'), get_labels(state), background=background)
+
+    # Calculate g(r) during the simulation, we don't need Ovito for it any more
+    rdf = create_rdf(r_max=box_size / 2, bin_number=100, species=state['species'])
+
+    # Put particles into cells, so that we only check the particles nearby for overlap
+    cell_list = build_cell_list(positions, box, diameter)
+
+    # The event chains move about one diameter per particle in every sweep (in total)
+    chain_length = parameters['chain_length'] or box_size / 2
+    chain_number = int(np.ceil(particle_number * diameter / chain_length))
+    lift_count, lift_distance = 0, 0.0
+
+    try:
+        # Move particles, output their coordinates
+        accept_count = 0
+        for t in range(0, total_steps):
+            # Write positions to file
             # xyz file is a file format to store 3D position
             # the general format is:
             # PARTICLE_TYPE  X  Y  Z
             # here we just call our hard spheres H
-            f.write('H' + '\t' + str(x[i]) + '\t' + str(y[i]) + '\t' + str(z[i]) + '\n')
-
-    for i in range(0, particle_number):
-        # Trial Move
-        trial_x = x[i] + random.gauss(0, 1)
-        trial_y = y[i] + random.gauss(0, 1)
-        trial_z = z[i] + random.gauss(0, 1)
-
-        # Check boundaries
-        # We always move particles a small step, so don't worry if trial_x >> box_size
-        if trial_x <= 0:
-            trial_x += box_size
-        elif trial_x >= box_size:
-            trial_x -= box_size
-
-        if trial_y <= 0:
-            trial_y += box_size
-        elif trial_y >= box_size:
-            trial_y -= box_size
-
-        if trial_z <= 0:
-            trial_z += box_size
-        elif trial_z >= box_size:
-            trial_z -= box_size
-
-        # check if the trial particle is overlaping with other particles
-        is_overlap = False
-
-        for j in range(0, particle_number):
-            if is_overlap:
-                break
-            if i != j:
+            write_frame(trajectory, positions)
+            if analysis_interval and t % analysis_interval == 0:
+                accumulate_rdf(rdf, state)
+
+            # The event chains never reject a move, every collision passes the move on to the particle that was hit
+            if move == 'event_chain':
+                lifts, distance = event_chain_sweep(state, cell_list, chain_length, chain_number, stream)
+                lift_count += lifts
+                lift_distance += distance
+                continue
+
+            # The random numbers of this sweep in one go, the displacements are gaussian (see random_stream.py)
+            numbers = draw_sweep(stream, particle_number)
+            for i in range(0, particle_number):
+                # Trial Move
+                trial_x = positions[i, 0] + numbers['displacements'][i, 0]
+                trial_y = positions[i, 1] + numbers['displacements'][i, 1]
+                trial_z = positions[i, 2] + numbers['displacements'][i, 2]
+
+                # Check boundaries
+                # We always move particles a small step, so don't worry if trial_x >> box_size
+                if trial_x <= 0:
+                    trial_x += box_size
+                elif trial_x >= box_size:
+                    trial_x -= box_size
+
+                if trial_y <= 0:
+                    trial_y += box_size
+                elif trial_y >= box_size:
+                    trial_y -= box_size
+
+                if trial_z <= 0:
+                    trial_z += box_size
+                elif trial_z >= box_size:
+                    trial_z -= box_size
+
+                # check if the trial particle is overlaping with other particles nearby
                 p1 = [trial_x, trial_y, trial_z]
-                p2 = [x[j], y[j], z[j]]
-                box = [box_size, box_size, box_size]
-                is_overlap = check_overlap(p1, p2, diameter, box)
-
-        if not is_overlap:
-            # Confirm movements
-            x[i], y[i], z[i] = trial_x, trial_y, trial_z
-print("Simulation box is ", box)
+                neighbours = [j for j in get_neighbours(p1, cell_list) if j != i]
+                is_overlap = check_overlap(p1, positions[neighbours], diameter, box)
+
+                if not is_overlap:
+                    # Confirm movements
+                    accept_count += 1
+                    positions[i] = p1
+                    move_particle(cell_list, i, p1)
+    finally:
+        # also when a sweep fails, so the frames left in the queue are written and the thread stops
+        try:
+            close_trajectory(trajectory)
+        finally:
+            stop_background_writer(background)
+
+    save_rdf(rdf, os.path.join(output_directory, 'rdf_hard_sphere.npz'))
+    print("Simulation box is ", box)
+
+    summary = {'particle_number': particle_number, 'box_size': box_size}
+    if move == 'event_chain':
+        # the pressure P / kT from all the chains of the run, and how many collisions a chain has
+        # (max(..., 1) so that a run with total_steps = 0 doesn't divide by 0)
+        summary['pressure'] = get_pressure(state, lift_distance, chain_length, chain_number * max(total_steps, 1))
+        summary['lifts_per_chain'] = lift_count / (chain_number * max(total_steps, 1))
+    else:
+        summary['accept_ratio'] = accept_count / particle_number / max(total_steps, 1)
+    return summary
+
+
+if __name__ == "__main__":
+    simulate(parameters)
@@ -5,25 +5,19 @@ The attraction is a square well potential.
 You can easily see the attraction from the g(r)
 Most of the code is the same for hard spheres
 """
-import random as random
+import os
 import numpy as np
-
-
-def get_distance_in_pbc(p1, p2, box):
-    """
-    Here we move the distance calculating part out from `check_overlap`
-    So that we could use it in other functions
-    """
-    dimension = len(p1)
-    distance_nd = []
-    for d in range(dimension):
-        distance_1d = abs(p2[d] - p1[d])
-        if distance_1d > (box[d] / 2):
-            distance_nd.append((box[d] - distance_1d) ** 2)
-        else:
-            distance_nd.append(distance_1d ** 2)
-    distance = sum(distance_nd) ** 0.5
-    return distance
+from cell_list import build_cell_list, get_neighbours, move_particle
+from pbc import get_squared_distances_in_pbc
+from square_well import get_energy_change, get_total_energy
+from particle_state import create_particle_state, get_labels
+from initialization import create_positions, get_particle_number
+from trajectory import open_trajectory, write_frame, close_trajectory
+from background_writer import start_background_writer, stop_background_writer
+from analysis import create_rdf, accumulate_rdf, save_rdf
+from cluster_moves import cluster_sweep
+from parameter_sweep import seed_random_numbers
+from random_stream import create_random_stream, draw_sweep
 
 
 def check_overlap(p1, p2, diameter, box):
@@ -40,6 +34,9 @@ def check_overlap(p1, p2, diameter, box):
 
     Figure 1. Example of PBC in 1D
 
+    p2 could also be many particles, then we check if p1 overlaps with any of them
+    The distances are calculated in one go with numpy, see pbc.py
+
     The stuff below are some testing code, don't worry about it
     >>> check_overlap([1, 1], [1.5, 1.5], 2, [5, 5])
     True
@@ -49,136 +46,188 @@ def check_overlap(p1, p2, diameter, box):
     False
     >>> check_overlap([1, 1, 1], [5, 5, 5], 2, [5, 5, 5])
     True
+    >>> check_overlap([1, 1], [[3, 3], [1.5, 1.5]], 2, [5, 5])
+    True
     """
-    distance = get_distance_in_pbc(p1, p2, box)
-    if distance > diameter:
-        return False  # not overlap
-    else:
-        return True
+    squared_distances = get_squared_distances_in_pbc(p1, p2, box)
+    return bool(np.any(squared_distances <= diameter ** 2))
+
+
+# Parameters, change them and call simulate(parameters), or use parameter_sweep.py
+parameters = {
+    # parameters about the system
+    'unit_repeat': 5,  # number of unit cells per dimension, there are unit_repeat³ particles
+    'particle_number': None,  # any number of particles, None means unit_repeat³
+    'initial_configuration': 'sc',  # 'sc', 'bcc', 'fcc', 'random' or 'compress', see initialization.py
+    'diameter': 1,
+    'volume_fraction': 0.1,
+    # parameter about the square well
+    'depth': -4,
+    'width': 0.1,  # 0.1 * diameter
+    # parameters about the simulation
+    'total_steps': 100,
+    'analysis_interval': 10,  # calculate g(r) every 10 steps, 0 means never
+    'cluster_move_interval': 0,  # move whole clusters every 5 steps if it is 5 (see cluster_moves.py), 0 means never
+    'cluster_step': 0.5,  # the largest displacement of a cluster move
+    'seed': None,  # a number to get the same random numbers every time
+    'output_queue_size': 8,  # frames waiting to be written by a background thread (see background_writer.py), 0 writes them in the sweep loop
+}
+
+
+def create_state(parameters):
+    """
+    Put the particles on a lattice (see initialization.py), the box is chosen to get the volume fraction
+    Returns the particle state, see particle_state.py
+    """
+    particle_number = get_particle_number(parameters)  # number of particles
+    diameter = parameters['diameter']
+    volume_fraction = parameters['volume_fraction']
+    depth = parameters['depth']
+    width = parameters['width']
 
+    # Generate initial co-ordinates, a lattice (or random positions) with the correct volume fraction
+    types = np.zeros(particle_number, dtype=np.int8)
+    positions, box = create_positions(types, [diameter], volume_fraction, parameters['initial_configuration'])
 
-def get_energy(i, system, depth, width, diameter, box):
-    """
-    this function calculating the energy of one particle inside a system
-    with square well potential
+    # From now on we keep all positions in one numpy array, so we never rebuild the system for a move
+    state = create_particle_state(
+        positions, types, box, species=['H'], diameters=[diameter],
+        depths=[[depth]], widths=[[width]]
+    )
+    return state
 
-    The stuff below are some testing code, don't worry about it
-    >>> system = [[0, 0], [1, 1], [2, 2], [3, 3]]
-    >>> get_energy_square_well(system[0], system, -1, 2, [4, 4])
-    -2
+
+def simulate(parameters, output_directory='.'):
+    """
+    Run the simulation with the parameters above, the output files are saved in output_directory
+    Returns a small summary of the run
     """
-    energy = 0
-    p1 = system[i]
-    for j, p2 in enumerate(system):
-        if i != j:
-            distance = get_distance_in_pbc(p1, p2, box)
-            if distance <= width + diameter:
-                energy = energy + depth
-    return energy
-
-
-# parameters about the system
-unit_repeat = 5  # number of unit cells per dimension
-lattice_constant = 1
-box_size = lattice_constant * unit_repeat
-particle_number = unit_repeat ** 3  # number of particles
-diameter = 1
-volume_fraction = 0.1
-
-# parameter about the square well
-depth = -4
-width = 0.1 * diameter
-
-# parameters about the simulation
-total_steps = 100
-
-# rewrite file
-output_file = open('positions_hard_sphere_attracted.xyz', 'w')
-output_file.close()
-
-# Generate initial co-ordinates
-x, y, z = [], [], []
-for i in range(0, unit_repeat):
-    for j in range(0, unit_repeat):
-        for k in range(0, unit_repeat):
-            x.append(i * lattice_constant)
-            y.append(j * lattice_constant)
-            z.append(k * lattice_constant)
-
-# Rescale the box/coordinates for correct volume fraction/density.
-atoms_per_cell = 1
-atom_volume = np.pi * diameter ** 3 / 6
-initial_volume_fraction = atoms_per_cell * atom_volume  # / unit volume (=1)
-rescale = (initial_volume_fraction / volume_fraction) ** (1. / 3)
-box_size *= rescale
-box = [box_size, box_size, box_size]
-
-for a in range(0, particle_number):
-    x[a] *= rescale
-for a in range(0, particle_number):
-    y[a] *= rescale
-for a in range(0, particle_number):
-    z[a] *= rescale
-
-# Move particles, output their coordinates
-for t in range(0, total_steps):
-    # Write positions to file
-    with open('positions_hard_sphere_attracted.xyz', 'a') as f:
-        f.write(str(len(x)) + '\n')
-        f.write('\n')
-        for i in range(len(x)):
+    # parameters about the system
+    diameter = parameters['diameter']
+
+    # parameter about the square well
+    depth = parameters['depth']
+    width = parameters['width']
+
+    # parameters about the simulation
+    total_steps = parameters['total_steps']
+    analysis_interval = parameters['analysis_interval']
+
+    # Use the same random numbers every time if a seed is given
+    seed_random_numbers(parameters['seed'])
+    stream = create_random_stream(parameters['seed'])  # the random numbers of the moves
+
+    # Create the particles and the box
+    state = create_state(parameters)
+    positions = state['positions']  # ((x1, y1, z1), (x2, y2, z2) ...)
+    particle_number = len(positions)
+    box_size = float(state['box'][0])
+    box = [box_size, box_size, box_size]
+
+    # Open the output file once, every frame is added to the end of it
+    # the frames are written by a background thread, so the sweeps don't wait for the disk
+    background = start_background_writer(parameters['output_queue_size'])
+    trajectory = open_trajectory(os.path.join(output_directory, 'positions_hard_sphere_attracted.xyz'), get_labels(state), background=background)
+
+    # Calculate g(r) during the simulation, we don't need Ovito for it any more
+    rdf = create_rdf(r_max=box_size / 2, bin_number=100, species=state['species'])
+
+    # Put particles into cells, so that we only check the particles nearby
+    cell_list = build_cell_list(positions, box, width + diameter)
+
+    # The total energy is calculated once, then we add the energy change of every accepted move
+    # the pairs are found with the cell list, checking all N×N pairs is too slow for many particles
+    system_energy = get_total_energy(state)
+
+    # the accepted cluster moves, the tried cluster moves, and the sum of the sizes of the tried clusters
+    cluster_accept_count, cluster_move_count, cluster_size_sum = 0, 0, 0
+
+    try:
+        # Move particles, output their coordinates
+        accept_count = 0
+        for t in range(0, total_steps):
+            # Write positions to file
             # xyz file is a file format to store 3D position
             # the general format is:
             # PARTICLE_TYPE  X  Y  Z
             # here we just call our hard spheres H
-            f.write('H' + '\t' + str(x[i]) + '\t' + str(y[i]) + '\t' + str(z[i]) + '\n')
-
-    for i in range(0, particle_number):
-        # Trial Move
-        trial_x = x[i] + random.gauss(0, 1)
-        trial_y = y[i] + random.gauss(0, 1)
-        trial_z = z[i] + random.gauss(0, 1)
-
-        # Check boundaries
-        # We always move particles a small step, so don't worry if trial_x >> box_size
-        if trial_x <= 0:
-            trial_x += box_size
-        elif trial_x >= box_size:
-            trial_x -= box_size
-
-        if trial_y <= 0:
-            trial_y += box_size
-        elif trial_y >= box_size:
-            trial_y -= box_size
-
-        if trial_z <= 0:
-            trial_z += box_size
-        elif trial_z >= box_size:
-            trial_z -= box_size
-
-        p1 = [trial_x, trial_y, trial_z]
-        # check if the trial particle is overlaping with other particles
-        is_overlap = False
-        for j in range(0, particle_number):
-            if is_overlap:
-                break
-            if i != j:
-                p2 = [x[j], y[j], z[j]]
-                is_overlap = check_overlap(p1, p2, diameter, box)
-
-        if not is_overlap:
-            # Confirm movements
-            old_system = np.vstack([x, y, z]).T  # ((x1, x2, ..), (y1, y2, ..), (z1, z2, ..)) --> ((x1, y1, z1), (x2, y2, z2) ...)
-
-            new_system = np.copy(old_system)
-            new_system = np.delete(new_system, i, axis=0)
-            new_system = np.insert(new_system, i, np.array(p1), axis=0)  # there are better ways
-
-            old_energy = get_energy(i, old_system, depth, width, diameter, box)
-            new_energy = get_energy(i, new_system, depth, width, diameter, box)
-            delta = new_energy - old_energy
-            accept_probability = np.exp(-1 * delta)
-
-            # if probability is HIGH, a random number is less likely to be higher than it
-            if np.random.random() < accept_probability:
-                x[i], y[i], z[i] = trial_x, trial_y, trial_z
+            write_frame(trajectory, positions)
+            if analysis_interval and t % analysis_interval == 0:
+                accumulate_rdf(rdf, state)
+
+            # The random numbers of this sweep in one go, the displacements are gaussian (see random_stream.py)
+            numbers = draw_sweep(stream, particle_number)
+            for i in range(0, particle_number):
+                # Trial Move
+                trial_x = positions[i, 0] + numbers['displacements'][i, 0]
+                trial_y = positions[i, 1] + numbers['displacements'][i, 1]
+                trial_z = positions[i, 2] + numbers['displacements'][i, 2]
+
+                # Check boundaries
+                # We always move particles a small step, so don't worry if trial_x >> box_size
+                if trial_x <= 0:
+                    trial_x += box_size
+                elif trial_x >= box_size:
+                    trial_x -= box_size
+
+                if trial_y <= 0:
+                    trial_y += box_size
+                elif trial_y >= box_size:
+                    trial_y -= box_size
+
+                if trial_z <= 0:
+                    trial_z += box_size
+                elif trial_z >= box_size:
+                    trial_z -= box_size
+
+                p1 = [trial_x, trial_y, trial_z]
+                # check if the trial particle is overlaping with other particles nearby
+                neighbours = [j for j in get_neighbours(p1, cell_list) if j != i]
+                is_overlap = check_overlap(p1, positions[neighbours], diameter, box)
+
+                if not is_overlap:
+                    # Only the neighbours before and after the move change the energy
+                    delta = get_energy_change(
+                        i, p1, positions, cell_list, depth, width + diameter, box, trial_neighbours=neighbours
+                    )
+                    accept_probability = np.exp(-1 * delta)
+
+                    # if probability is HIGH, a random number is less likely to be higher than it
+                    if numbers['uniforms'][i] < accept_probability:
+                        accept_count += 1
+                        positions[i] = p1
+                        move_particle(cell_list, i, p1)
+                        system_energy += delta
+
+            # Move the bonded clusters together, single particle moves can hardly move them
+            if parameters['cluster_move_interval'] and t % parameters['cluster_move_interval'] == 0:
+                cluster_accept, energy_change, cluster_sizes = cluster_sweep(
+                    state, cell_list, parameters['cluster_step'], stream=stream
+                )
+                system_energy += energy_change
+                cluster_accept_count += cluster_accept
+                cluster_move_count += len(cluster_sizes)
+                cluster_size_sum += sum(cluster_sizes)
+    finally:
+        # also when a sweep fails, so the frames left in the queue are written and the thread stops
+        try:
+            close_trajectory(trajectory)
+        finally:
+            stop_background_writer(background)
+
+    save_rdf(rdf, os.path.join(output_directory, 'rdf_hard_sphere_attracted.npz'))
+
+    summary = {
+        'particle_number': particle_number,
+        'box_size': box_size,
+        'energy_per_particle': system_energy / particle_number,
+        'accept_ratio': accept_count / particle_number / max(total_steps, 1),
+    }
+    if cluster_move_count > 0:
+        summary['cluster_accept_ratio'] = cluster_accept_count / cluster_move_count
+        summary['mean_cluster_size'] = cluster_size_sum / cluster_move_count  # of the clusters we tried to move
+    return summary
+
+
+if __name__ == "__main__":
+    simulate(parameters)
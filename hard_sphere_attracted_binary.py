@@ -2,58 +2,44 @@
 """
 This script creates a lattice of two types of particles that won't overlap and attracting each other
 The attraction is a square well potential, different particles have different interactions.
-You can see the formation of bi-gel after open the .xyz file in Ovito
+You can see the formation of bi-gel after open the .xyz file in Ovito,
+or in clusters_hard_sphere_attracted_binary.csv (a percolating cluster of each species, see analysis.py)
 You can easily see the attraction from the g(r)
 The python version of the code may not be fast enough to see the equilibriumed structure
+Install numba (pip install numba) to run the sweeps as compiled code, see sweep_engine.py
 Please contact Yushi (yushi.yang@bristol.ac.uk) for a faster C++ version (written by Paddy Royall)
 (If you are interested in the system)
 """
+import os
 import random as random
 import numpy as np
-
-
-def get_distance_in_pbc(p1, p2, box):
-    dimension = len(p1)
-    distance_nd = []
-    for d in range(dimension):
-        distance_1d = abs(p2[d] - p1[d])
-        if distance_1d > (box[d] / 2):
-            distance_nd.append((box[d] - distance_1d) ** 2)
-        else:
-            distance_nd.append(distance_1d ** 2)
-    distance = sum(distance_nd) ** 0.5
-    return distance
-
-
-def check_overlap(p1, p2, diameter_1, diameter_2, box):
-    distance = get_distance_in_pbc(p1, p2, box)
-    if distance > (diameter_1 + diameter_2)/2:
-        return False  # not overlap
-    else:
-        return True
-
-
-def get_energy(i, system, depth_table, width_table, diameters, box):
+from cell_list import build_cell_list
+from square_well import get_total_energy
+from pbc import get_squared_distances_in_pbc
+from potentials import get_pair_energies
+from sweep_engine import select_backend, sweep
+from trajectory import open_trajectory, write_frame, close_trajectory, get_trajectory_position, truncate_file
+from background_writer import start_background_writer, stop_background_writer, submit
+from analysis import create_rdf, accumulate_rdf, save_rdf, analyse_clusters, get_cluster_columns, get_cluster_values
+from cluster_moves import cluster_sweep
+from parameter_sweep import seed_random_numbers
+from random_stream import create_random_stream
+from particle_state import create_particle_state, get_labels, get_max_interaction_range
+from initialization import create_positions, get_particle_number
+from checkpoint import save_checkpoint, load_checkpoint, restore_simulation
+from verlet_list import build_verlet_list
+from profiler import create_profiler, start_timer, stop_timer, finish_sweep, format_record, write_record
+from equilibration import create_run_controller, add_energy, restore_controller
+from volume_moves import volume_move, adjust_volume_step, get_volume_fraction, get_number_density, MAX_VOLUME_FRACTION
+
+
+def get_system_energy(state):
+    """calculate the energy for all particles, every pair is counted once"""
+    positions, types = state['positions'], state['types']
     energy = 0
-    p1 = system[i]
-    for j, p2 in enumerate(system):  # j: indices of corresponding particels in the system
-        if i != j:
-            distance = get_distance_in_pbc(p1, p2, box)
-            interaction_range = width_table[i][j] + (diameters[i] + diameters[j]) / 2
-            if distance <= interaction_range:
-                energy = energy + depth_table[i][j]
-    return energy
-
-
-def get_system_energy(system, depth_table, width_table, diameters, box):
-    """calculate the energy for all particles"""
-    energy = 0
-    for i, p1 in enumerate(system):
-        for j, p2 in enumerate(system[i + 1:]):
-            j = j + i + 1
-            distance = get_distance_in_pbc(p1, p2, box)
-            if distance <= width_table[i][j] + (diameters[i] + diameters[j]) / 2:
-                energy = energy + depth_table[i][j]
+    for i, p1 in enumerate(positions):
+        squared_distances = get_squared_distances_in_pbc(p1, positions[i + 1:], state['box'])
+        energy = energy + np.sum(get_pair_energies(state, types[i], types[i + 1:], squared_distances))
     return energy
 
 
@@ -67,170 +53,427 @@ def adjust_step(old_step, accept_ratio, box_size):
     return min([new_step, box_size/10.0])
 
 
-# Parameters about the box
-unit_repeat = 5  # number of unit cells per dimension
-lattice_constant = 1
-box_size = lattice_constant * unit_repeat
-particle_number = unit_repeat ** 3  # number of particles
-volume_fraction = 0.1
-ratio_ab = 0.5   # larger ratio --> more type A particle
-
-# Parameters about two types of particles
-diameter_a = 1
-diameter_b = 1
-
-# Parameters about the square well
-depth_aa = -5
-depth_bb = -5
-depth_ab = 5
-width_aa = 0.1 * diameter_a
-width_bb = 0.1 * diameter_b
-width_ab = 0.5 * (diameter_a + diameter_b) / 2
-
-# Parameters about the simulation
-before_equilibrium = 0   # the frames before this number won't be outputed
-total_steps = 100
-step = box_size / 10  # same value as paddy
-
-# Rewrite file
-output_file = open('positions_hard_sphere_attracted_binary.xyz', 'w')
-output_file.close()
-
-# Since the particles are different now, we need to know "which position belongs to which type".
-# We call the particle-type corresponding as "labels". So, every particles have different labels, A or B.
-# We will need a list to remember the different labels.
-# Also, let's construct a diameter list to use later
-labels, diameters = [], []
-for i in range(particle_number):
-    flipped_coin = random.random()
-    if flipped_coin <= ratio_ab:
-        labels.append('A')
-        diameters.append(diameter_a)
+# Parameters, change them and call simulate(parameters), or use parameter_sweep.py
+parameters = {
+    # Parameters about the box
+    'unit_repeat': 5,  # number of unit cells per dimension, there are unit_repeat³ particles
+    'particle_number': None,  # any number of particles, None means unit_repeat³
+    'initial_configuration': 'sc',  # 'sc', 'bcc', 'fcc', 'random' or 'compress', see initialization.py
+    'lattice_constant': 1,
+    'volume_fraction': 0.1,
+    'ratio_ab': 0.5,  # larger ratio --> more type A particle
+    # Parameters about two types of particles
+    'diameter_a': 1,
+    'diameter_b': 1,
+    # Parameters about the square well
+    'depth_aa': -5,
+    'depth_bb': -5,
+    'depth_ab': 5,
+    'width_aa': 0.1,  # 0.1 * diameter_a
+    'width_bb': 0.1,  # 0.1 * diameter_b
+    'width_ab': 0.5,  # 0.5 * (diameter_a + diameter_b) / 2
+    'potentials': None,  # a 2×2 matrix of any potentials (see potentials.py) instead of the square wells above
+    # Parameters about the simulation
+    'before_equilibrium': 0,  # the frames before this number won't be outputed, not used with auto_equilibrium
+    'total_steps': 100,
+    'auto_equilibrium': False,  # find the equilibrium from the energy and stop with enough samples (see equilibration.py), total_steps is then the longest run
+    'target_samples': 100,  # the number of independent samples after the equilibrium, with auto_equilibrium
+    'analysis_interval': 10,  # calculate g(r) and the clusters every 10 steps after the equilibrium, 0 means never
+    'check_energy': False,  # recalculate the total energy every sweep to check the running energy (slow)
+    'backend': 'auto',  # 'python', 'numba', 'checkerboard' (numba on all CPU cores), 'verlet' (numba with Verlet lists), or 'auto' to use numba if it is installed
+    'verlet_skin': None,  # the skin of the Verlet lists for the 'verlet' backend, None means half of the longest interaction range
+    'trajectory_format': 'xyz',  # 'binary' is smaller and faster, use trajectory.export_xyz to get a .xyz file later
+    'seed': None,  # a number to get the same random numbers every time
+    'output_queue_size': 8,  # frames and summary lines waiting for a background thread (see background_writer.py), 0 writes them in the sweep loop
+    'cluster_move_interval': 0,  # move whole clusters every 5 steps if it is 5 (see cluster_moves.py), 0 means never
+    'max_cluster_size': None,  # don't move clusters larger than this, None means no limit
+    'checkpoint_interval': 0,  # save a checkpoint every 100 steps if it is 100, 0 means no checkpoint
+    'restart': False,  # continue from the checkpoint in the output directory (if there is one)
+    'profile': False,  # time every part of the sweep and count the rejected moves, see profiler.py
+    'pressure': None,  # a pressure (in kT / σ³) lets the box change its size every sweep (NPT, see volume_moves.py), None means a fixed box
+    'volume_step': 0.01,  # the largest change of ln(volume) in one volume move, adjusted during the run
+}
+
+
+def create_state(parameters):
+    """
+    Put the A and B particles on a lattice (see initialization.py), the box is chosen to get the volume fraction
+    Returns the particle state, see particle_state.py
+    """
+    # Parameters about the box
+    particle_number = get_particle_number(parameters)  # number of particles
+    volume_fraction = parameters['volume_fraction']
+    ratio_ab = parameters['ratio_ab']
+
+    # Parameters about two types of particles
+    diameter_a = parameters['diameter_a']
+    diameter_b = parameters['diameter_b']
+
+    # Parameters about the square well
+    depth_aa = parameters['depth_aa']
+    depth_bb = parameters['depth_bb']
+    depth_ab = parameters['depth_ab']
+    width_aa = parameters['width_aa']
+    width_bb = parameters['width_bb']
+    width_ab = parameters['width_ab']
+
+    # Since the particles are different now, we need to know "which position belongs to which type".
+    # We call the particle-type corresponding as "types". So, every particles have different types, A (0) or B (1).
+    # The types are stored as small integers, so we can use them to look up the tables below.
+    types = np.zeros(particle_number, dtype=np.int8)
+    for i in range(particle_number):
+        flipped_coin = random.random()
+        if flipped_coin > ratio_ab:
+            types[i] = 1
+
+    # Let's construct some tables for the interaction, one row and one column for each species
+    # depth_matrix[0][1] is the depth between A and B, so we only need 2×2 numbers instead of N×N
+    depth_matrix = [
+        [depth_aa, depth_ab],
+        [depth_ab, depth_bb],
+    ]
+    width_matrix = [
+        [width_aa, width_ab],
+        [width_ab, width_bb],
+    ]
+
+    # Generate initial co-ordinates, a lattice (or random positions) with the correct volume fraction
+    # the volume fraction counts the volume of both A and B particles
+    positions, box = create_positions(
+        types, [diameter_a, diameter_b], volume_fraction, parameters['initial_configuration']
+    )
+
+    # From now on we keep all positions in one numpy array, so we never rebuild the system for a move
+    state = create_particle_state(
+        positions, types, box, species=['A', 'B'], diameters=[diameter_a, diameter_b],
+        depths=depth_matrix, widths=width_matrix, potentials=parameters['potentials']
+    )
+    return state
+
+
+def simulate(parameters, output_directory='.'):
+    """
+    Run the simulation with the parameters above, the output files are saved in output_directory
+    Returns a small summary of the run
+    """
+    # Parameters about the simulation
+    before_equilibrium = parameters['before_equilibrium']
+    total_steps = parameters['total_steps']
+    analysis_interval = parameters['analysis_interval']
+    step = parameters['lattice_constant'] * parameters['unit_repeat'] / 10  # same value as paddy
+    check_energy = parameters['check_energy']
+    backend = parameters['backend']
+    trajectory_format = parameters['trajectory_format']
+    cluster_move_interval = parameters['cluster_move_interval']
+    checkpoint_interval = parameters['checkpoint_interval']
+    checkpoint_filename = os.path.join(output_directory, 'checkpoint_hard_sphere_attracted_binary.npz')
+    pressure = parameters['pressure']
+    volume_step = parameters['volume_step']
+    profiler = create_profiler(enabled=parameters['profile'])
+
+    # Use the same random numbers every time if a seed is given
+    # `random` and `np.random` set up the particles, all the moves take their random numbers from the stream
+    seed_random_numbers(parameters['seed'])
+    stream = create_random_stream(parameters['seed'])
+
+    # Create the particles, their types and the box
+    state = create_state(parameters)
+    positions = state['positions']  # ((x1, y1, z1), (x2, y2, z2) ...)
+    particle_number = len(positions)
+    box_size = float(state['box'][0])
+    box = [box_size, box_size, box_size]
+
+    # Calculate g(r) and the partial g(r) for AA, AB and BB during the simulation
+    # with a pressure the box can shrink, so r_max is half of the smallest box the particles could fit in
+    r_max = box_size / 2
+    if pressure is not None:
+        r_max = r_max * (get_volume_fraction(state) / MAX_VOLUME_FRACTION) ** (1 / 3)
+    rdf = create_rdf(r_max=r_max, bin_number=100, species=state['species'])
+
+    # cluster_size_counts[n] is the number of clusters with n particles, added up over the frames
+    # species_size_counts[s, n] is the number of clusters with n particles of species s
+    cluster_size_counts = np.zeros(particle_number + 1, dtype=np.int64)
+    species_size_counts = np.zeros((len(state['species']), particle_number + 1), dtype=np.int64)
+    cluster_accept_count, cluster_move_count = 0, 0
+
+    # the volume moves accepted in the last 10 sweeps (to adjust volume_step), and in the whole run
+    volume_accept_count, volume_accept_total = 0, 0
+    # the sums of the volume fraction and the number density over the production sweeps, and the number of sweeps
+    volume_sums = np.zeros(3)
+
+    # Without auto_equilibrium the production starts after before_equilibrium sweeps and the step is always adjusted
+    # with it, the controller finds the equilibrium itself and total_steps is the longest run
+    controller = None
+    last_step = total_steps + before_equilibrium
+    if parameters['auto_equilibrium']:
+        controller = create_run_controller(parameters['target_samples'])
+        last_step = total_steps
+
+    # Put particles into cells, the cells should be larger than the longest interaction range
+    cell_list = build_cell_list(positions, box, get_max_interaction_range(state))
+
+    # Choose how to run the sweeps, see sweep_engine.py
+    backend = select_backend(backend)
+
+    # The total energy is calculated once, then we add the energy change of every accepted move
+    # the pairs are found with the cell list, get_system_energy checks all N×N pairs and is too slow for many particles
+    system_energy = get_total_energy(state)
+    first_step = 0
+    accept_count = 0  # the accepted moves of the last sweep
+    trajectory_position = None
+    box_log_size = None
+    cluster_log_size = None
+    profile_log_size = None
+
+    # Continue from the checkpoint, the particles, the g(r) and the random numbers are put back
+    if parameters['restart'] and os.path.exists(checkpoint_filename):
+        checkpoint = load_checkpoint(checkpoint_filename)
+        restore_simulation(checkpoint, state, cell_list, rdf, stream)
+        cluster_size_counts[:] = checkpoint['extra']['cluster_size_counts']
+        species_size_counts[:] = checkpoint['extra']['species_size_counts']
+        cluster_accept_count, cluster_move_count = checkpoint['extra']['cluster_move_counts'].tolist()
+        accept_count = int(checkpoint['extra']['accept_count'])
+        if analysis_interval:
+            cluster_log_size = int(checkpoint['extra']['cluster_log_size'])
+        if 'profile_log_size' in checkpoint['extra']:  # only if the run before was profiled
+            profile_log_size = int(checkpoint['extra']['profile_log_size'])
+        if pressure is not None:
+            volume_step = float(checkpoint['extra']['volume_step'])
+            volume_accept_count, volume_accept_total = checkpoint['extra']['volume_accept_counts'].tolist()
+            volume_sums[:] = checkpoint['extra']['volume_sums']
+            box_log_size = int(checkpoint['extra']['box_log_size'])
+            box_size = float(state['box'][0])
+            box = [box_size, box_size, box_size]
+        system_energy = checkpoint['energy']
+        step = checkpoint['step']
+        first_step = checkpoint['sweep_number']
+        trajectory_position = checkpoint.get('trajectory_position')
+        if controller is not None:
+            restore_controller(controller, checkpoint['extra']['controller_energies'])
+        print('Restart from the checkpoint at step', first_step)
+
+    # Open the output file once, every frame is added to the end of it
+    # the frames and the summary lines are written by a background thread, so the sweeps don't wait for the disk
+    background = start_background_writer(parameters['output_queue_size'])
+    if trajectory_format == 'xyz':
+        trajectory = open_trajectory(
+            os.path.join(output_directory, 'positions_hard_sphere_attracted_binary.xyz'), get_labels(state),
+            position=trajectory_position, background=background
+        )
     else:
-        labels.append('B')
-        diameters.append(diameter_b)
-
-# Let's construct some tables for the interaction
-depth_table, width_table = [], []
-for i in range(particle_number):
-    depth_table.append([])
-    width_table.append([])
-    for j in range(particle_number):
-        if i == j:
-            depth_table[i].append(None)
-            width_table[i].append(None)
-        else:
-            if labels[i] != labels[j]:
-                depth_table[i].append(depth_ab)
-                width_table[i].append(width_ab)
-            elif labels[i] == 'A':
-                depth_table[i].append(depth_aa)
-                width_table[i].append(width_aa)
-            else:
-                depth_table[i].append(depth_bb)
-                width_table[i].append(width_bb)
-
-# Generate initial co-ordinates
-x, y, z = [], [], []
-for i in range(0, unit_repeat):
-    for j in range(0, unit_repeat):
-        for k in range(0, unit_repeat):
-            x.append(i * lattice_constant)
-            y.append(j * lattice_constant)
-            z.append(k * lattice_constant)
-
-
-# Rescale the box/coordinates for correct volume fraction/density.
-number_a = sum([1 for label in labels if label == 'A'])
-number_b = particle_number - number_a
-volume_a = np.pi * diameter_a ** 3 / 6 * number_a
-volume_b = np.pi * diameter_b ** 3 / 6 * number_b
-initial_volume_fraction =  (volume_a + volume_b) / box_size ** 3
-rescale = (initial_volume_fraction / volume_fraction) ** (1. / 3)
-box_size *= rescale
-box = [box_size, box_size, box_size]
-
-for a in range(0, particle_number):
-    x[a] *= rescale
-for a in range(0, particle_number):
-    y[a] *= rescale
-for a in range(0, particle_number):
-    z[a] *= rescale
-
-# Move particles, output their coordinates
-for t in range(0, total_steps + before_equilibrium):
-    accept_count = 0
-    # Write positions to file
-    if t >= before_equilibrium:
-        with open('positions_hard_sphere_attracted_binary.xyz', 'a') as f:
-            f.write(str(len(x)) + '\n')
-            f.write('box is {}, at frame {}\n'.format(box, t))
-            for i in range(len(x)):
+        trajectory = open_trajectory(
+            os.path.join(output_directory, 'positions_hard_sphere_attracted_binary.traj'), get_labels(state),
+            file_format='binary', position=trajectory_position, background=background
+        )
+
+    # The Verlet lists remember the neighbours of every particle, see verlet_list.py
+    if backend == 'verlet' and parameters['verlet_skin'] is not None:
+        cell_list['verlet_list'] = build_verlet_list(
+            positions, box, get_max_interaction_range(state), parameters['verlet_skin']
+        )
+
+    # The box size and the density of every sweep go to a csv file, so we can see the box finding its size
+    if pressure is not None:
+        box_filename = os.path.join(output_directory, 'box_hard_sphere_attracted_binary.csv')
+        is_new_file = box_log_size is None or not os.path.exists(box_filename)
+        if not is_new_file:
+            truncate_file(box_filename, box_log_size)  # throw away the lines written after the checkpoint
+        box_log = open(box_filename, 'w' if is_new_file else 'a')
+        if is_new_file:
+            box_log.write('sweep,box_size,volume_fraction,number_density\n')
+
+    # A few numbers about the clusters (and if they percolate, i.e. form a gel) of every analysed frame go to a csv file
+    if analysis_interval:
+        cluster_filename = os.path.join(output_directory, 'clusters_hard_sphere_attracted_binary.csv')
+        is_new_file = cluster_log_size is None or not os.path.exists(cluster_filename)
+        if not is_new_file:
+            truncate_file(cluster_filename, cluster_log_size)  # throw away the lines written after the checkpoint
+        cluster_log = open(cluster_filename, 'w' if is_new_file else 'a')
+        if is_new_file:
+            cluster_log.write(','.join(['sweep'] + get_cluster_columns(state['species'])) + '\n')
+
+    # The times and counts of every sweep go to a log file, one line of JSON per sweep
+    if profiler['enabled']:
+        profile_filename = os.path.join(output_directory, 'profile_hard_sphere_attracted_binary.jsonl')
+        is_new_file = profile_log_size is None or not os.path.exists(profile_filename)
+        if not is_new_file:
+            truncate_file(profile_filename, profile_log_size)  # throw away the lines written after the checkpoint
+        profile_log = open(profile_filename, 'w' if is_new_file else 'a')
+
+    try:
+        # Move particles, output their coordinates
+        sweep_number = first_step
+        for t in range(first_step, last_step):
+            # The production (frames, g(r) and averages) starts after the equilibrium
+            production_start = before_equilibrium
+            if controller is not None:
+                production_start = controller['production_sweep'] if controller['is_frozen'] else t + 1
+            is_production = t >= production_start
+
+            # Write positions to file
+            if is_production:
                 # PARTICLE_TYPE  X  Y  Z
-                f.write(labels[i] + '\t' + str(x[i]) + '\t' + str(y[i]) + '\t' + str(z[i]) + '\n')
-
-    for i in range(0, particle_number):
-        i = random.randint(0, particle_number - 1)  # randomly pick up a particle and move
-        trial_x = x[i] + random.uniform(-1, 1) * step
-        trial_y = y[i] + random.uniform(-1, 1) * step
-        trial_z = z[i] + random.uniform(-1, 1) * step
-
-        # Check boundaries
-        # We always move particles a small step, so don't worry if trial_x >> box_size
-        if trial_x <= 0:
-            trial_x += box_size
-        elif trial_x >= box_size:
-            trial_x -= box_size
-
-        if trial_y <= 0:
-            trial_y += box_size
-        elif trial_y >= box_size:
-            trial_y -= box_size
-
-        if trial_z <= 0:
-            trial_z += box_size
-        elif trial_z >= box_size:
-            trial_z -= box_size
-
-        p1 = [trial_x, trial_y, trial_z]
-
-        # Check if the trial particle is overlaping with other particles
-        is_overlap = False
-        for j in range(0, particle_number):
-            if is_overlap:
-                break
-            if i != j:
-                p2 = [x[j], y[j], z[j]]
-                is_overlap = check_overlap(p1, p2, diameters[i], diameters[j], box)
-
-        if not is_overlap:
-            # Confirm movements
-            old_system = np.vstack([x, y, z]).T  # ((x1, x2, ..), (y1, y2, ..), (z1, z2, ..)) --> ((x1, y1, z1), (x2, y2, z2) ...)
-
-            new_system = np.delete(old_system, i, axis=0)  # old one won't change
-            new_system = np.insert(new_system, i, np.array(p1), axis=0)
-
-            old_energy = get_energy(i, old_system, depth_table, width_table, diameters, box)
-            new_energy = get_energy(i, new_system, depth_table, width_table, diameters, box)
-
-            delta = new_energy - old_energy
-            accept_probability = np.exp(-1 * delta)
-
-            # If probability is HIGH, a random number is less likely to be higher than it
-            if random.random() < accept_probability:
-                accept_count += 1
-                x[i], y[i], z[i] = trial_x, trial_y, trial_z
-
-    # Update the movement of atoms so that the accept ratio is around 50%
-    step = adjust_step(step, accept_count / particle_number, box_size)
-
-    # Print summary of the movement
-    new_system = np.vstack([x, y, z]).T  # ((x1, x2, ..), (y1, y2, ..), (z1, z2, ..)) --> ((x1, y1, z1), (x2, y2, z2) ...)
-    system_energy = get_system_energy(new_system, depth_table, width_table, diameters, box) / particle_number
-    print(
-            'Energe per atom is {:^8.2f} Step is {:^8.2f} Accept ratio is {:^8.2f}'.format(
-            system_energy,
-            step,
-            accept_count / particle_number
+                start = start_timer(profiler)
+                write_frame(trajectory, positions, 'box is {}, at frame {}'.format(box, t))
+                stop_timer(profiler, 'write_frame', start)
+                if analysis_interval and (t - production_start) % analysis_interval == 0:
+                    start = start_timer(profiler)
+                    accumulate_rdf(rdf, state)
+                    clusters = analyse_clusters(state)
+                    cluster_size_counts += np.bincount(clusters['sizes'], minlength=particle_number + 1)
+                    for s, sizes in enumerate(clusters['species_sizes'].T):
+                        species_size_counts[s] += np.bincount(sizes[sizes > 0], minlength=particle_number + 1)
+                    cluster_log.write(','.join(str(value) for value in [t] + get_cluster_values(clusters)) + '\n')
+                    stop_timer(profiler, 'analysis', start)
+
+            # Try to move every particle once (on average), the positions and the cell list are updated inside
+            accept_count, energy_change = sweep(state, cell_list, step, backend, profiler, stream)
+            system_energy += energy_change
+
+            # Move the bonded clusters together, single particle moves can hardly move them
+            if cluster_move_interval and t % cluster_move_interval == 0:
+                start = start_timer(profiler)
+                cluster_accept, energy_change, cluster_sizes = cluster_sweep(
+                    state, cell_list, step, max_cluster_size=parameters['max_cluster_size'], stream=stream
+                )
+                stop_timer(profiler, 'cluster_sweep', start)
+                system_energy += energy_change
+                cluster_accept_count += cluster_accept
+                cluster_move_count += len(cluster_sizes)
+
+            # Try to change the box once, all the positions are scaled with it (only with a pressure)
+            if pressure is not None:
+                start = start_timer(profiler)
+                is_accepted, energy_change = volume_move(state, cell_list, pressure, volume_step, stream)
+                stop_timer(profiler, 'volume_move', start)
+                if is_accepted:
+                    system_energy += energy_change
+                    volume_accept_count += 1
+                    volume_accept_total += 1
+                    box_size = float(state['box'][0])
+                    box = [box_size, box_size, box_size]
+                if (t + 1) % 10 == 0:
+                    if controller is None or not controller['is_frozen']:
+                        volume_step = adjust_volume_step(volume_step, volume_accept_count / 10)
+                    volume_accept_count = 0
+                box_log.write('{},{:.6f},{:.6f},{:.6f}\n'.format(
+                    t, box_size, get_volume_fraction(state), get_number_density(state)
+                ))
+                if is_production:
+                    volume_sums += [get_volume_fraction(state), get_number_density(state), 1]
+
+            # Look for the equilibrium and count the samples, once the run is equilibrated the step is frozen
+            if controller is not None:
+                add_energy(controller, system_energy)
+
+            # Update the movement of atoms so that the accept ratio is around 50%
+            if controller is None or not controller['is_frozen']:
+                step = adjust_step(step, accept_count / particle_number, box_size)
+
+            # Check the running energy against the slow calculation for all pairs
+            if check_energy:
+                start = start_timer(profiler)
+                full_energy = get_system_energy(state)
+                stop_timer(profiler, 'check_energy', start)
+                assert np.isclose(full_energy, system_energy), 'running energy {} is not {}'.format(system_energy, full_energy)
+
+            # Print summary of the movement
+            summary_line = 'Energe per atom is {:^8.2f} Step is {:^8.2f} Accept ratio is {:^8.2f}'.format(
+                system_energy / particle_number,
+                step,
+                accept_count / particle_number
             )
-    )
+            if pressure is not None:
+                summary_line += ' Volume fraction is {:^8.3f}'.format(get_volume_fraction(state))
+            record = finish_sweep(profiler)
+            if record is not None:
+                summary_line += ' ' + format_record(record)
+                write_record(profile_log, t, record)
+            submit(background, print, summary_line)
+
+            # Save everything every checkpoint_interval steps, so that we can continue if the run is killed
+            # this is after the profile record of the sweep, so the record is kept after a restart
+            # (the time of the checkpoint goes to the record of the next sweep)
+            if checkpoint_interval and (t + 1) % checkpoint_interval == 0:
+                start = start_timer(profiler)
+                extra = {
+                    'cluster_size_counts': cluster_size_counts,
+                    'species_size_counts': species_size_counts,
+                    'cluster_move_counts': np.array([cluster_accept_count, cluster_move_count]),
+                    'accept_count': accept_count,
+                }
+                if profiler['enabled']:
+                    profile_log.flush()
+                    extra['profile_log_size'] = profile_log.tell()
+                if analysis_interval:
+                    cluster_log.flush()
+                    extra['cluster_log_size'] = cluster_log.tell()
+                if pressure is not None:
+                    box_log.flush()
+                    extra['box_log_size'] = box_log.tell()
+                    extra['volume_step'] = volume_step
+                    extra['volume_accept_counts'] = np.array([volume_accept_count, volume_accept_total])
+                    extra['volume_sums'] = volume_sums
+                if controller is not None:
+                    extra['controller_energies'] = np.array(controller['energies'])
+                save_checkpoint(
+                    checkpoint_filename, state, cell_list, step, t + 1, system_energy, rdf,
+                    get_trajectory_position(trajectory), extra=extra, stream=stream
+                )
+                stop_timer(profiler, 'checkpoint', start)
+
+            # Stop when there are enough independent samples after the equilibrium
+            sweep_number = t + 1
+            if controller is not None and controller['is_finished']:
+                break
+    finally:
+        # also when a sweep fails, so the files are closed, the frames left in the queue are written and the thread stops
+        if profiler['enabled']:
+            profile_log.close()
+        if pressure is not None:
+            box_log.close()
+        if analysis_interval:
+            cluster_log.close()
+        try:
+            close_trajectory(trajectory)
+        finally:
+            stop_background_writer(background)
+
+    save_rdf(rdf, os.path.join(output_directory, 'rdf_hard_sphere_attracted_binary.npz'))
+    np.savez(os.path.join(output_directory, 'clusters_hard_sphere_attracted_binary.npz'), size_counts=cluster_size_counts,
+             species_size_counts=species_size_counts, species=state['species'])
+
+    summary = {
+        'particle_number': particle_number,
+        'box_size': box_size,
+        'energy_per_particle': float(system_energy / particle_number),
+        'step': step,
+        'accept_ratio': accept_count / particle_number,
+    }
+    if background is not None:
+        summary['output_blocked_time'] = background['blocked_time']  # seconds the sweeps waited for the output
+    # the average cluster size, and the size of the largest cluster we have seen
+    sizes = np.arange(particle_number + 1)
+    if np.sum(cluster_size_counts) > 0:
+        summary['mean_cluster_size'] = float(np.sum(sizes * cluster_size_counts) / np.sum(cluster_size_counts))
+        summary['largest_cluster'] = int(np.max(sizes[cluster_size_counts > 0]))
+    if cluster_move_count > 0:
+        summary['cluster_accept_ratio'] = cluster_accept_count / cluster_move_count
+    if pressure is not None:
+        summary['pressure'] = pressure
+        summary['volume_step'] = volume_step
+        summary['volume_accept_ratio'] = volume_accept_total / max(sweep_number, 1)
+        if volume_sums[2] > 0:
+            summary['volume_fraction'] = float(volume_sums[0] / volume_sums[2])
+            summary['number_density'] = float(volume_sums[1] / volume_sums[2])
+    if controller is not None:
+        summary['sweep_number'] = sweep_number
+        for name in ['equilibrium_sweep', 'production_sweep', 'statistical_inefficiency', 'effective_samples']:
+            summary[name] = controller[name]
+    if profiler['enabled']:
+        summary['profile'] = {'times': profiler['total_times'], 'counts': profiler['total_counts']}
+    return summary
+
+
+if __name__ == "__main__":
+    simulate(parameters)
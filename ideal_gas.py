@@ -3,80 +3,103 @@
 Ideal gas: This script creates a lattice of non-interacting particles
 to introduce the students to periodic boundary conditions.
 """
-import random as random
+import os
 import numpy as np
+from particle_state import create_particle_state, get_labels
+from initialization import create_positions, get_particle_number
+from trajectory import open_trajectory, write_frame, close_trajectory
+from background_writer import start_background_writer, stop_background_writer
+from parameter_sweep import seed_random_numbers
+from random_stream import create_random_stream, draw_sweep
 
-# Initial parameters
-unit_repeat = 5  # number of unit cells per dimension
-lattice_constant = 1
-box_size = lattice_constant * unit_repeat
-particle_number = unit_repeat ** 3  # number of particles
-total_steps = 100
-diameter = 1
-volume_fraction = 0.1
-
-# rewrite file
-output_file = open('positions_random_gas.xyz', 'w')
-output_file.close()
-
-# Generate initial co-ordinates
-x, y, z = [], [], []
-for i in range(0, unit_repeat):
-    for j in range(0, unit_repeat):
-        for k in range(0, unit_repeat):
-            x.append(i * lattice_constant)
-            y.append(j * lattice_constant)
-            z.append(k * lattice_constant)
-
-# Rescale the box/coordinates so we achieve the correct volume fraction/density.
-atoms_per_cell = 1
-atom_volume = np.pi * diameter ** 3 / 6
-initial_volume_fraction = atoms_per_cell * atom_volume  # / unit volume (=1)
-rescale = (initial_volume_fraction / volume_fraction) ** (1. / 3)
-box_size *= rescale
-
-for a in range(0, particle_number):
-    x[a] *= rescale
-for a in range(0, particle_number):
-    y[a] *= rescale
-for a in range(0, particle_number):
-    z[a] *= rescale
-
-# Move particles, output their coordinates
-for t in range(0, total_steps):
-    # Write positions to file
-    with open('positions_random_gas.xyz', 'a') as f:
-        f.write(str(len(x)) + '\n')
-        f.write('\n')
-        for i in range(len(x)):
+# Initial parameters, change them and call simulate(parameters), or use parameter_sweep.py
+parameters = {
+    'unit_repeat': 5,  # number of unit cells per dimension, there are unit_repeat³ particles
+    'particle_number': None,  # any number of particles, None means unit_repeat³
+    'initial_configuration': 'sc',  # 'sc', 'bcc', 'fcc', 'random' or 'compress', see initialization.py
+    'total_steps': 100,
+    'diameter': 1,
+    'volume_fraction': 0.1,
+    'seed': None,  # a number to get the same random numbers every time
+    'output_queue_size': 8,  # frames waiting to be written by a background thread (see background_writer.py), 0 writes them in the sweep loop
+}
+
+
+def simulate(parameters, output_directory='.'):
+    """
+    Run the simulation with the parameters above, the output files are saved in output_directory
+    Returns a small summary of the run
+    """
+    particle_number = get_particle_number(parameters)  # number of particles
+    initial_configuration = parameters['initial_configuration']
+    total_steps = parameters['total_steps']
+    diameter = parameters['diameter']
+    volume_fraction = parameters['volume_fraction']
+
+    # Use the same random numbers every time if a seed is given
+    seed_random_numbers(parameters['seed'])
+    stream = create_random_stream(parameters['seed'])  # the random numbers of the moves
+
+    # Generate initial co-ordinates, a lattice (or random positions) with the correct volume fraction
+    types = np.zeros(particle_number, dtype=np.int8)
+    positions, box = create_positions(types, [diameter], volume_fraction, initial_configuration)
+    box_size = box[0]
+
+    # Keep the positions in one numpy array, and remember the type of every particle
+    state = create_particle_state(positions, types, box, species=['G'], diameters=[diameter])
+    positions = state['positions']  # ((x1, y1, z1), (x2, y2, z2) ...)
+
+    # Open the output file once, every frame is added to the end of it
+    # the frames are written by a background thread, so the sweeps don't wait for the disk
+    background = start_background_writer(parameters['output_queue_size'])
+    trajectory = open_trajectory(os.path.join(output_directory, 'positions_random_gas.xyz'), get_labels(state), background=background)
+
+    try:
+        # Move particles, output their coordinates
+        for t in range(0, total_steps):
+            # Write positions to file
             # xyz file is a file format to store 3D position
             # the general format is:
             # PARTICLE_TYPE  X  Y  Z
             # here we just call our random gas particles "G"
-            f.write('G' + '\t' + str(x[i]) + '\t' + str(y[i]) + '\t' + str(z[i]) + '\n')
-
-    for i in range(0, particle_number):
-        # Trial Move
-        trial_x = x[i] + random.gauss(0, 1)
-        trial_y = y[i] + random.gauss(0, 1)
-        trial_z = z[i] + random.gauss(0, 1)
-
-        # Check boundaries
-        # We always move particles a small step, so don't worry if trial_x >> box_size
-        if trial_x <= 0:
-            trial_x += box_size
-        elif trial_x >= box_size:
-            trial_x -= box_size
-
-        if trial_y <= 0:
-            trial_y += box_size
-        elif trial_y >= box_size:
-            trial_y -= box_size
-
-        if trial_z <= 0:
-            trial_z += box_size
-        elif trial_z >= box_size:
-            trial_z -= box_size
-
-        # Confirm movements
-        x[i], y[i], z[i] = trial_x, trial_y, trial_z
+            write_frame(trajectory, positions)
+
+            # The random numbers of this sweep in one go, the displacements are gaussian (see random_stream.py)
+            numbers = draw_sweep(stream, particle_number)
+            for i in range(0, particle_number):
+                # Trial Move
+                trial_x = positions[i, 0] + numbers['displacements'][i, 0]
+                trial_y = positions[i, 1] + numbers['displacements'][i, 1]
+                trial_z = positions[i, 2] + numbers['displacements'][i, 2]
+
+                # Check boundaries
+                # We always move particles a small step, so don't worry if trial_x >> box_size
+                if trial_x <= 0:
+                    trial_x += box_size
+                elif trial_x >= box_size:
+                    trial_x -= box_size
+
+                if trial_y <= 0:
+                    trial_y += box_size
+                elif trial_y >= box_size:
+                    trial_y -= box_size
+
+                if trial_z <= 0:
+                    trial_z += box_size
+                elif trial_z >= box_size:
+                    trial_z -= box_size
+
+                # Confirm movements
+                positions[i] = trial_x, trial_y, trial_z
+    finally:
+        # also when a sweep fails, so the frames left in the queue are written and the thread stops
+        try:
+            close_trajectory(trajectory)
+        finally:
+            stop_background_writer(background)
+
+    return {'particle_number': particle_number, 'box_size': box_size}
+
+
+if __name__ == "__main__":
+    simulate(parameters)
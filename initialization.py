@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Initialization: This module creates the starting positions of the particles
+
+Before, every script put the particles on a simple cubic lattice with three loops,
+so the number of particles had to be unit_repeat³ (125, 1000 ...). With a high volume fraction
+the lattice also takes a long time to "melt". Now there are a few ways to start
+    'sc', 'bcc', 'fcc' -- a lattice for any number of particles, if the number is not perfect
+                          for the lattice, some lattice sites are left empty (spread evenly)
+    'random'           -- random sequential addition (RSA): put the particles into the box one by one
+                          at random positions, try again if the new particle overlaps.
+                          It gets very slow above a volume fraction of about 0.3
+    'compress'         -- start from RSA in a big box, then shrink the box step by step.
+                          Between the steps we move the particles as hard spheres, so they
+                          make space for the next shrink. Use this for dense systems.
+
+    positions, box = create_positions(types, diameters=[1, 1], volume_fraction=0.3, method='compress')
+
+The types are the species of the particles (0, 1 ...), and diameters are the diameters of the species.
+"""
+import numpy as np
+from cell_list import build_cell_list, add_particle, get_neighbours, get_pairs
+from pbc import get_pair_squared_distances_in_pbc
+from particle_state import create_particle_state
+from sweep_engine import check_overlap, select_backend, sweep
+from random_stream import create_random_stream
+
+INITIAL_CONFIGURATIONS = ['sc', 'bcc', 'fcc', 'random', 'compress']
+
+# the positions of the particles inside one cubic unit cell
+LATTICE_BASES = {
+    'sc': [[0, 0, 0]],
+    'bcc': [[0, 0, 0], [0.5, 0.5, 0.5]],
+    'fcc': [[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]],
+}
+
+# the distance between nearest neighbours on each lattice, when the unit cell is 1
+NEAREST_DISTANCES = {'sc': 1, 'bcc': np.sqrt(3) / 2, 'fcc': 1 / np.sqrt(2)}
+
+
+def get_particle_number(parameters):
+    """the number of particles in the parameters of a script, the default is unit_repeat³"""
+    if parameters.get('particle_number') is None:
+        return parameters['unit_repeat'] ** 3
+    return parameters['particle_number']
+
+
+def create_positions(types, diameters, volume_fraction, method='sc', backend='auto'):
+    """
+    Create the positions of the particles and a cubic box with the volume fraction
+    Returns the positions (N×3 numpy array) and the box [L, L, L]
+
+    The stuff below are some testing code, don't worry about it
+    >>> positions, box = create_positions(np.zeros(100, dtype=np.int8), [1], 0.3, method='fcc')
+    >>> positions.shape
+    (100, 3)
+    >>> round(100 * np.pi / 6 / box[0] ** 3, 6)
+    0.3
+    """
+    if method not in INITIAL_CONFIGURATIONS:
+        raise ValueError('method should be one of {}, not {}'.format(INITIAL_CONFIGURATIONS, method))
+    types = np.asarray(types)
+    particle_diameters = np.asarray(diameters, dtype=np.float64)[types]
+    particle_volume = np.pi * np.sum(particle_diameters ** 3) / 6
+    box_size = float((particle_volume / volume_fraction) ** (1. / 3))
+
+    if method in LATTICE_BASES:
+        sites, cells = make_lattice(len(types), method)
+        lattice_constant = box_size / cells
+        if NEAREST_DISTANCES[method] * lattice_constant < np.max(particle_diameters):
+            raise ValueError("the particles overlap on the {} lattice at volume fraction {}, try 'compress'".format(
+                method, volume_fraction
+            ))
+        return sites * lattice_constant, [box_size] * 3
+    if method == 'random':
+        return random_sequential_addition(types, diameters, [box_size] * 3), [box_size] * 3
+
+    # start from RSA at a low volume fraction, then shrink the box
+    start_size = (particle_volume / min(volume_fraction, 0.2)) ** (1. / 3)
+    positions = random_sequential_addition(types, diameters, [start_size] * 3)
+    return compress(positions, types, diameters, [start_size] * 3, box_size, backend=backend)
+
+
+def make_lattice(particle_number, lattice='sc'):
+    """
+    The lattice sites for the particles, in the unit of the unit cell
+    Returns the sites and the number of unit cells per side
+
+    The stuff below are some testing code, don't worry about it
+    >>> sites, cells = make_lattice(8, 'sc')
+    >>> cells, sites[:3].tolist()
+    (2, [[0.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 0.0]])
+    >>> sites, cells = make_lattice(30, 'fcc')
+    >>> cells, len(sites), len(np.unique(sites, axis=0))
+    (2, 30, 30)
+    """
+    basis = np.array(LATTICE_BASES[lattice], dtype=np.float64)
+    cells = 1
+    while len(basis) * cells ** 3 < particle_number:
+        cells += 1
+    corners = np.indices((cells, cells, cells), dtype=np.float64).reshape(3, -1).T
+    sites = (corners[:, np.newaxis, :] + basis[np.newaxis, :, :]).reshape(-1, 3)
+    # leave some sites empty, spread over the whole box
+    chosen = np.floor(np.arange(particle_number) * len(sites) / particle_number).astype(np.int64)
+    return sites[chosen], cells
+
+
+def random_sequential_addition(types, diameters, box, max_attempts=10000):
+    """
+    Put the particles into the box one by one at random positions without overlap
+    The big particles go first, because they are the hardest to fit in
+    The particles already in the box are kept in a cell list, so we only check the nearby ones
+    """
+    types = np.asarray(types)
+    diameters = np.asarray(diameters, dtype=np.float64)
+    particle_diameters = diameters[types]
+    box = np.array(box, dtype=np.float64)
+    particle_number = len(types)
+    positions = np.zeros((particle_number, 3))
+
+    # an empty cell list, the particles are added when they are placed
+    cell_list = build_cell_list(np.empty((0, 3)), box, np.max(diameters))
+    cell_list['next'] = np.full(particle_number, -1, dtype=np.int64)
+    cell_list['cell_of'] = np.zeros(particle_number, dtype=np.int64)
+
+    for i in np.argsort(-particle_diameters, kind='stable'):
+        for attempt in range(max_attempts):
+            trial = np.random.uniform(0, box)
+            neighbours = get_neighbours(trial, cell_list)
+            if not check_overlap(trial, positions[neighbours], particle_diameters[i], particle_diameters[neighbours], box):
+                positions[i] = trial
+                add_particle(cell_list, i, trial)
+                break
+        else:
+            raise RuntimeError("can't find space for particle {} after {} attempts, try method='compress'".format(
+                i, max_attempts
+            ))
+    return positions
+
+
+def count_overlaps(state):
+    """the number of overlapping pairs, found with numpy in one go (a contact is an overlap, like in the sweeps)"""
+    positions, box = state['positions'], state['box']
+    particle_diameters = state['diameters'][state['types']]
+    i, j = get_pairs(positions, box, np.max(state['diameters']))
+    squared_distances = get_pair_squared_distances_in_pbc(positions, np.stack([i, j], axis=1), box)
+    contacts = (particle_diameters[i] + particle_diameters[j]) / 2
+    return int(np.sum(squared_distances <= contacts ** 2))
+
+
+def compress(positions, types, diameters, box, target_size, backend='auto', shrink_rate=0.01, max_relax_sweeps=50,
+             sweeps_per_check=5):
+    """
+    Shrink a cubic box of hard spheres until its size is target_size
+    Every shrink scales the box and the positions by the same factor (1% at first), so a few
+    particles overlap. Then we move the particles as hard spheres: a move is only accepted if
+    the particle does not overlap with anyone at its new position, so the overlaps can only go away.
+    If the overlaps are gone quickly we shrink faster, if they don't go away we go back and shrink slower.
+    Returns the new positions and the box [target_size] * 3
+
+    The stuff below are some testing code, don't worry about it
+    >>> positions, box = create_positions(np.zeros(200, dtype=np.int8), [1], 0.45, method='compress')
+    >>> i, j = get_pairs(positions, box, 1)
+    >>> bool(np.min(get_pair_squared_distances_in_pbc(positions, np.stack([i, j], axis=1), box)) > 1)
+    True
+    """
+    species = [str(a) for a in range(len(diameters))]
+    state = create_particle_state(positions, types, box, species, diameters)
+    backend = select_backend(backend)
+    stream = create_random_stream(np.random.randint(2 ** 31))  # the positions above come from np.random too
+    step = np.mean(state['diameters'][state['types']]) / 10
+
+    while state['box'][0] > target_size:
+        if shrink_rate < 1e-6:
+            raise RuntimeError('the particles are jammed, the box is {} and can not reach {}'.format(
+                state['box'][0], target_size
+            ))
+        old_positions, old_box = state['positions'].copy(), state['box'].copy()
+        factor = max(target_size / state['box'][0], 1 - shrink_rate)
+        state['positions'] *= factor
+        state['box'] *= factor
+        if factor == target_size / old_box[0]:
+            state['box'][:] = target_size
+
+        # move the particles until there is no overlap
+        cell_list = build_cell_list(state['positions'], state['box'], np.max(state['diameters']))
+        # counting the overlaps is slower than a sweep, so we only count them every few sweeps
+        relax_sweeps = 0
+        overlap_number = count_overlaps(state)
+        while overlap_number > 0 and relax_sweeps < max_relax_sweeps:
+            for _ in range(sweeps_per_check):
+                accept_count, energy_change = sweep(state, cell_list, step, backend, stream=stream)
+                # keep the accept ratio around 50%, like adjust_step in hard_sphere_attracted_binary.py
+                if accept_count / len(state['types']) > 0.5:
+                    step = min(step * 1.1, state['box'][0] / 10)
+                else:
+                    step = step * 0.9
+            relax_sweeps += sweeps_per_check
+            overlap_number = count_overlaps(state)  # also after the last sweeps, they could have removed the overlaps
+        if overlap_number > 0:
+            # the overlaps didn't go away, try again with a smaller shrink
+            state['positions'][:], state['box'][:] = old_positions, old_box
+            shrink_rate /= 2
+            continue
+        if relax_sweeps <= sweeps_per_check:
+            shrink_rate = min(shrink_rate * 1.5, 0.05)
+    return state['positions'], state['box'].tolist()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweep: This script runs a simulation for many different parameters at the same time
+
+Step 4 in the README is "change the parameters and observe different behaviours".
+Instead of editing the script and running it again and again, we make a grid of parameters
+and give every state point to a different CPU core.
+
+    grid = make_grid(hard_sphere_attracted_binary.parameters, volume_fraction=[0.1, 0.2], depth_ab=[1, 5])
+    run_sweep('hard_sphere_attracted_binary', grid, 'sweep_output')
+
+Every state point (we call it a "job") gets
+    - its own folder, like sweep_output/job_0003, with the .xyz file, the g(r) and the printed output
+    - its own random seed, the seeds come from one master seed, so the whole sweep is reproducible
+At the end a table of the results is saved as sweep_output/summary.csv
+"""
+import os
+import csv
+import time
+import random as random
+import itertools
+import importlib
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from random_stream import spawn_seeds
+
+
+def seed_random_numbers(seed):
+    """
+    seed both `random` and `np.random`, nothing happens if the seed is None
+    The seed can be a number, or a SeedSequence from spawn_seeds (then all of its bits are used)
+
+    The stuff below are some testing code, don't worry about it
+    >>> seed_random_numbers(np.random.SeedSequence(5, spawn_key=(1,))); first = random.random(), np.random.random()
+    >>> seed_random_numbers(np.random.SeedSequence(5, spawn_key=(1,))); first == (random.random(), np.random.random())
+    True
+    >>> seed_random_numbers(np.random.SeedSequence(5, spawn_key=(2,))); first == (random.random(), np.random.random())
+    False
+    """
+    if seed is None:
+        return
+    if isinstance(seed, np.random.SeedSequence):
+        words = seed.generate_state(8)  # 256 bits
+        random.seed(int.from_bytes(words.tobytes(), 'little'))
+        np.random.seed(words)
+        return
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+
+
+def make_grid(base_parameters, **values):
+    """
+    Every combination of the values, the other parameters are copied from base_parameters
+
+    The stuff below are some testing code, don't worry about it
+    >>> grid = make_grid({'depth': -1, 'volume_fraction': 0.1}, volume_fraction=[0.1, 0.2], depth=[-1, -2])
+    >>> [(p['volume_fraction'], p['depth']) for p in grid]
+    [(0.1, -1), (0.1, -2), (0.2, -1), (0.2, -2)]
+    """
+    for name in values:
+        if name not in base_parameters:
+            raise KeyError('{} is not one of the parameters {}'.format(name, sorted(base_parameters)))
+    names = list(values)
+    grid = []
+    for combination in itertools.product(*[values[name] for name in names]):
+        parameters = dict(base_parameters)
+        parameters.update(zip(names, combination))
+        grid.append(parameters)
+    return grid
+
+
+def run_job(script, parameters, output_directory):
+    """run one state point, this happens inside a worker process"""
+    os.makedirs(output_directory, exist_ok=True)
+    simulate = importlib.import_module(script).simulate
+    start = time.perf_counter()
+    with open(os.path.join(output_directory, 'output.log'), 'w') as log, contextlib.redirect_stdout(log):
+        summary = simulate(parameters, output_directory)
+    summary['wall_time'] = time.perf_counter() - start
+    return summary
+
+
+def run_sweep(script, grid, output_directory, max_workers=None, seed=0):
+    """
+    Run the simulate function of the script (like 'hard_sphere_attracted_binary') for every
+    parameters in the grid, with max_workers processes (None means all the CPU cores).
+    Returns the rows of the summary table.
+    """
+    # every job gets an independent random seed from the master seed
+    seeds = spawn_seeds(seed, len(grid))
+    changed = [name for name in grid[0] if any(parameters[name] != grid[0][name] for parameters in grid)]
+
+    os.makedirs(output_directory, exist_ok=True)
+    jobs = []
+    for number, (parameters, job_seed) in enumerate(zip(grid, seeds)):
+        jobs.append((dict(parameters, seed=job_seed), os.path.join(output_directory, 'job_{:04d}'.format(number))))
+
+    rows = []
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(run_job, script, parameters, job_directory) for parameters, job_directory in jobs]
+        for (parameters, job_directory), future in zip(jobs, futures):
+            # the seed of the job is np.random.SeedSequence(seed, spawn_key=(spawn_key,))
+            job_seed = parameters['seed']
+            row = {'job': os.path.basename(job_directory), 'seed': job_seed.entropy, 'spawn_key': job_seed.spawn_key[-1]}
+            row.update({name: parameters[name] for name in changed})
+            row.update(future.result())
+            rows.append(row)
+            print(', '.join('{} = {}'.format(key, value) for key, value in row.items()))
+    write_summary(rows, os.path.join(output_directory, 'summary.csv'))
+    return rows
+
+
+def write_summary(rows, filename):
+    """save the results as a table, one row for each job"""
+    columns = []
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    import hard_sphere_attracted_binary
+
+    base_parameters = dict(hard_sphere_attracted_binary.parameters, total_steps=20)
+    grid = make_grid(base_parameters, volume_fraction=[0.1, 0.2], depth_ab=[1, 5], ratio_ab=[0.5, 0.8])
+    run_sweep('hard_sphere_attracted_binary', grid, 'sweep_output', seed=2024)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Particle state: This module keeps everything about the particles in a few numpy arrays
+
+Before, the binary script had a label and a diameter for every particle, and two N×N tables
+for the interactions. With 10,000 particles the tables have 100,000,000 numbers!
+But there are only two types of particles, so we only need a 2×2 table.
+
+    positions    -- (N, 3) float64 array, one row for each particle
+    types        -- (N,) int8 array, 0 for the first species, 1 for the second ...
+    box          -- the box size in x, y, z
+    species      -- the names of the species, used in the .xyz file, like ['A', 'B']
+    diameters    -- the diameter of each species
+    depth_matrix -- depth_matrix[a][b] is the well depth between species a and b
+    width_matrix -- width_matrix[a][b] is the well width between species a and b
+    range_matrix -- the interaction range width + (diameter_a + diameter_b) / 2
+    step_radii, step_energies -- the potential between every pair of species as steps, see potentials.py
+
+To get the depth between particle i and j, we look up their types first
+    depth_matrix[types[i], types[j]]
+
+The sweeps only use the step tables, so any potential from potentials.py works, not only square wells.
+"""
+import numpy as np
+from potentials import create_step_tables
+
+
+def create_particle_state(positions, types, box, species, diameters, depths=None, widths=None, potentials=None):
+    """
+    Pack the particles into a dictionary
+    Without depths and widths the particles do not attract each other
+    Instead of square wells you can give any potentials (an n_species × n_species matrix, see potentials.py),
+    then the depth_matrix is the energy right after the contact, and the width_matrix is range - contact
+
+    The stuff below are some testing code, don't worry about it
+    >>> state = create_particle_state(
+    ...     [[0, 0, 0], [1, 0, 0]], [0, 1], [5, 5, 5], ['A', 'B'], [1, 2],
+    ...     depths=[[-1, 1], [1, -1]], widths=[[0.1, 0.5], [0.5, 0.2]]
+    ... )
+    >>> state['positions'].shape, state['types'].dtype
+    ((2, 3), dtype('int8'))
+    >>> state['range_matrix'].tolist()
+    [[1.1, 2.0], [2.0, 2.2]]
+    >>> get_labels(state)
+    ['A', 'B']
+    >>> state['step_radii'][0, 1].tolist(), state['step_energies'][0, 1].tolist()
+    ([2.0], [1.0])
+    """
+    species_number = len(species)
+    if depths is None:
+        depths = np.zeros((species_number, species_number))
+    if widths is None:
+        widths = np.zeros((species_number, species_number))
+    diameters = np.array(diameters, dtype=np.float64)
+    if potentials is None:
+        potentials = [
+            [{'type': 'square_well', 'depth': depths[a][b], 'width': widths[a][b]} for b in range(species_number)]
+            for a in range(species_number)
+        ]
+    step_radii, step_energies, range_matrix = create_step_tables(diameters, potentials)
+    contacts = (diameters[:, np.newaxis] + diameters[np.newaxis, :]) / 2
+    state = {
+        'positions': np.ascontiguousarray(positions, dtype=np.float64).reshape(-1, 3),
+        'types': np.array(types, dtype=np.int8),
+        'box': np.array(box, dtype=np.float64),
+        'species': list(species),
+        'diameters': diameters,
+        'depth_matrix': np.sum(step_energies, axis=2),
+        'width_matrix': range_matrix - contacts,
+        'range_matrix': range_matrix,
+        'step_radii': step_radii,
+        'step_energies': step_energies,
+    }
+    return state
+
+
+def get_particle_diameters(state):
+    """the diameter of every particle, looked up from its type"""
+    return state['diameters'][state['types']]
+
+
+def get_labels(state):
+    """the name of every particle, like ['A', 'B', 'B', 'A' ...]"""
+    return [state['species'][t] for t in state['types']]
+
+
+def count_species(state):
+    """how many particles are there for each species"""
+    return np.bincount(state['types'], minlength=len(state['species']))
+
+
+def get_max_interaction_range(state):
+    """the longest distance two particles could feel each other, use it to build the cell list"""
+    return float(np.max(state['range_matrix']))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+PBC distances: This module calculates the distances between particles in a periodic box
+
+`get_distance_in_pbc` is the simple version we wrote for the course, it handles one pair of
+particles each time. We keep it as a reference to check the faster version.
+
+`get_squared_distances_in_pbc` does the same thing for many particles in one numpy call.
+It returns the *squared* distances, because comparing d² with (diameter)² gives the same
+answer as comparing d with diameter, and we skip the slow square root.
+
+Run this file to see how much faster the numpy version is
+    python pbc.py
+"""
+import time
+import random as random
+import numpy as np
+
+
+def get_distance_in_pbc(p1, p2, box):
+    """
+    The distance between p1 and p2 in PBC, one pair each time (the reference version)
+
+    The stuff below are some testing code, don't worry about it
+    >>> get_distance_in_pbc([1, 1], [4, 1], [5, 5])
+    2.0
+    """
+    dimension = len(p1)
+    distance_nd = []
+    for d in range(dimension):
+        distance_1d = abs(p2[d] - p1[d])
+        if distance_1d > (box[d] / 2):
+            distance_nd.append((box[d] - distance_1d) ** 2)
+        else:
+            distance_nd.append(distance_1d ** 2)
+    distance = sum(distance_nd) ** 0.5
+    return distance
+
+
+def get_squared_distances_in_pbc(p1, positions, box):
+    """
+    The squared distances between p1 and all particles in positions
+    positions could be one particle [x, y, z] or many particles [[x1, y1, z1], [x2, y2, z2], ...]
+
+    The stuff below are some testing code, don't worry about it
+    >>> get_squared_distances_in_pbc([1, 1], [[4, 1], [1, 2], [3, 3]], [5, 5]).tolist()
+    [4.0, 1.0, 8.0]
+    >>> system = [[random.uniform(0, 5) for d in range(3)] for i in range(50)]
+    >>> reference = [get_distance_in_pbc(system[0], p2, [5, 5, 5]) ** 2 for p2 in system]
+    >>> np.allclose(get_squared_distances_in_pbc(system[0], system, [5, 5, 5]), reference)
+    True
+    """
+    p1 = np.asarray(p1, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, len(p1))
+    box = np.asarray(box, dtype=np.float64)
+    distance_nd = np.abs(positions - p1)
+    distance_nd = np.where(distance_nd > box / 2, box - distance_nd, distance_nd)
+    return np.sum(distance_nd ** 2, axis=1)
+
+
+def get_pair_squared_distances_in_pbc(positions, pairs, box):
+    """
+    The squared distances for many pairs of particles, pairs looks like [[i1, j1], [i2, j2], ...]
+
+    The stuff below are some testing code, don't worry about it
+    >>> system = [[0, 0], [1, 0], [4, 4]]
+    >>> get_pair_squared_distances_in_pbc(system, [[0, 1], [0, 2], [1, 2]], [5, 5]).tolist()
+    [1.0, 2.0, 5.0]
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    box = np.asarray(box, dtype=np.float64)
+    distance_nd = np.abs(positions[pairs[:, 1]] - positions[pairs[:, 0]])
+    distance_nd = np.where(distance_nd > box / 2, box - distance_nd, distance_nd)
+    return np.sum(distance_nd ** 2, axis=1)
+
+
+if __name__ == "__main__":
+    # Time one sweep worth of distance calculations (every particle against all particles)
+    for particle_number in [125, 1000]:
+        box = [10.0, 10.0, 10.0]
+        system = np.random.uniform(0, 10, (particle_number, 3))
+        system_list = system.tolist()
+
+        start = time.perf_counter()
+        for p1 in system_list:
+            for p2 in system_list:
+                get_distance_in_pbc(p1, p2, box)
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for p1 in system:
+            get_squared_distances_in_pbc(p1, system, box)
+        numpy_time = time.perf_counter() - start
+
+        print('N = {:<6} one sweep takes {:.4f} s (reference) and {:.4f} s (numpy), {:.1f}x faster'.format(
+            particle_number, scalar_time, numpy_time, scalar_time / numpy_time
+        ))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Potentials: This module describes how two particles interact
+
+Every potential we use is "piecewise constant": it is infinite when the particles overlap,
+then it has a few flat steps, and it is 0 far away. For example
+
+    'hard_sphere'   u = ∞ for r ≤ contact, 0 otherwise
+    'square_well'   u = depth for contact < r ≤ contact + width (depth < 0 attracts)
+    'shoulder'      u = height for contact < r ≤ contact + width (height > 0 repels)
+    'tabulated'     u = energies[k] for radii[k - 1] < r ≤ radii[k], you give the radii and the energies
+
+        u(r)
+         │ ∞
+         │ │
+         │ │   ┌───┐ 1 (shoulder)
+         0 ┼───┘   └──────────── r
+         │ │ ┌┐
+         │ └─┘└ -1 (well)
+
+    Figure 1. A tabulated potential with a well and a shoulder
+
+Here contact = (diameter_a + diameter_b) / 2. With more than one species, we give one potential for
+every pair of species, as an n_species × n_species matrix of dictionaries like
+
+    potentials = [
+        [{'type': 'square_well', 'depth': -5, 'width': 0.1}, {'type': 'shoulder', 'height': 5, 'width': 0.5}],
+        [{'type': 'shoulder', 'height': 5, 'width': 0.5}, {'type': 'square_well', 'depth': -5, 'width': 0.1}],
+    ]
+
+All potentials become the same kind of table, so the sweeps don't care what the potential is.
+For species a and b there are K steps, and the energy of a pair at distance r is
+
+    u(r) = Σ step_energies[a, b, k] for all k with r ≤ step_radii[a, b, k]
+
+A square well is one step (the radius is contact + width, the energy is the depth).
+The table has as many steps as the longest potential, the unused steps have radius 0 and energy 0.
+"""
+import numpy as np
+from pbc import get_squared_distances_in_pbc
+
+
+def get_hard_sphere_steps(contact):
+    """no steps at all, only the overlap"""
+    return []
+
+
+def get_square_well_steps(contact, depth, width):
+    return [(contact + width, depth)]
+
+
+def get_shoulder_steps(contact, height, width):
+    return [(contact + width, height)]
+
+
+def get_tabulated_steps(contact, radii, energies):
+    """
+    energies[k] is the energy between radii[k - 1] and radii[k] (the first one starts at the contact)
+
+    The stuff below are some testing code, don't worry about it
+    >>> get_tabulated_steps(1, [1.1, 1.5], [-1, 1])
+    [(1.1, -1), (1.5, 1)]
+    >>> get_tabulated_steps(1, [0.9, 1.5], [-1, 1])
+    Traceback (most recent call last):
+    ...
+    ValueError: the radii should grow and start after the contact 1, not [0.9, 1.5]
+    """
+    if len(radii) != len(energies):
+        raise ValueError('there should be one energy for every radius')
+    if np.any(np.diff(np.concatenate([[contact], radii])) <= 0):
+        raise ValueError('the radii should grow and start after the contact {}, not {}'.format(contact, list(radii)))
+    return list(zip(radii, energies))
+
+
+# the name of every potential and the function that gives its steps as (outer radius, energy) pairs
+POTENTIALS = {
+    'hard_sphere': get_hard_sphere_steps,
+    'square_well': get_square_well_steps,
+    'shoulder': get_shoulder_steps,
+    'tabulated': get_tabulated_steps,
+}
+
+
+def create_step_tables(diameters, potentials):
+    """
+    Turn an n_species × n_species matrix of potentials into the step tables (see the top of this file)
+    Returns step_radii, step_energies (both n_species × n_species × K) and the range_matrix,
+    the distance where the pair stops feeling each other (at least the contact)
+
+    The stuff below are some testing code, don't worry about it
+    >>> well = {'type': 'square_well', 'depth': -1, 'width': 0.1}
+    >>> table = {'type': 'tabulated', 'radii': [1.2, 1.5], 'energies': [-2, 1]}
+    >>> radii, energies, range_matrix = create_step_tables([1, 1], [[well, table], [table, None]])
+    >>> radii.shape, range_matrix.tolist()
+    ((2, 2, 2), [[1.1, 1.5], [1.5, 1.0]])
+    >>> energies[0, 1].tolist(), energies[0, 0].tolist()
+    ([-3.0, 1.0], [-1.0, 0.0])
+    """
+    diameters = np.asarray(diameters, dtype=np.float64)
+    species_number = len(diameters)
+    if np.shape(potentials)[:2] != (species_number, species_number):
+        raise ValueError('there should be {0} × {0} potentials'.format(species_number))
+
+    steps = [[None] * species_number for a in range(species_number)]
+    for a in range(species_number):
+        for b in range(species_number):
+            potential = dict(potentials[a][b] or {'type': 'hard_sphere'})
+            name = potential.pop('type')
+            if name not in POTENTIALS:
+                raise ValueError('the potential should be one of {}, not {}'.format(list(POTENTIALS), name))
+            steps[a][b] = POTENTIALS[name]((diameters[a] + diameters[b]) / 2, **potential)
+        for b in range(a):
+            if steps[a][b] != steps[b][a]:
+                raise ValueError('the potential between species {} and {} is not symmetric'.format(a, b))
+
+    step_number = max(1, max(len(steps[a][b]) for a in range(species_number) for b in range(species_number)))
+    step_radii = np.zeros((species_number, species_number, step_number))
+    step_energies = np.zeros((species_number, species_number, step_number))
+    range_matrix = (diameters[:, np.newaxis] + diameters[np.newaxis, :]) / 2
+    for a in range(species_number):
+        for b in range(species_number):
+            values = [energy for radius, energy in steps[a][b]] + [0]
+            for k, (radius, energy) in enumerate(steps[a][b]):
+                step_radii[a, b, k] = radius
+                step_energies[a, b, k] = values[k] - values[k + 1]  # the jump at this radius
+                range_matrix[a, b] = max(range_matrix[a, b], radius)
+    return step_radii, step_energies, range_matrix
+
+
+def get_pair_energies(state, types_i, types_j, squared_distances, with_overlap=True):
+    """
+    The energy of many pairs at once, an overlap is infinite (or only the steps without with_overlap)
+    types_i could be one type, or one type for every pair
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> table = {'type': 'tabulated', 'radii': [1.2, 1.5], 'energies': [-2, 1]}
+    >>> state = create_particle_state(np.zeros((1, 3)), [0], [5, 5, 5], ['A'], [1], potentials=[[table]])
+    >>> get_pair_energies(state, 0, np.zeros(4, dtype=np.int8), np.array([0.9, 1.1, 1.4, 1.6]) ** 2).tolist()
+    [inf, -2.0, 1.0, 0.0]
+    """
+    radii = state['step_radii'][types_i, types_j]
+    is_inside = squared_distances[..., np.newaxis] <= radii ** 2
+    energies = np.sum(np.where(is_inside, state['step_energies'][types_i, types_j], 0.0), axis=-1)
+    if not with_overlap:
+        return energies
+    contacts = (state['diameters'][types_i] + state['diameters'][types_j]) / 2
+    return np.where(squared_distances <= contacts ** 2, np.inf, energies)
+
+
+def get_energy_change(state, i, trial_position, old_neighbours, new_neighbours):
+    """
+    The energy change ΔE if particle i moves to the trial position, in one go with numpy
+    old_neighbours and new_neighbours are the particles near the old and the trial position (without i)
+    The overlap should already be checked, here the overlaps are not counted (like get_local_energy in sweep_engine.py)
+    """
+    positions, types, box = state['positions'], state['types'], state['box']
+    old_neighbours = np.asarray(old_neighbours, dtype=np.int64)
+    new_neighbours = np.asarray(new_neighbours, dtype=np.int64)
+    old_distances = get_squared_distances_in_pbc(positions[i], positions[old_neighbours], box)
+    new_distances = get_squared_distances_in_pbc(trial_position, positions[new_neighbours], box)
+    old_energies = get_pair_energies(state, types[i], types[old_neighbours], old_distances, with_overlap=False)
+    new_energies = get_pair_energies(state, types[i], types[new_neighbours], new_distances, with_overlap=False)
+    return float(np.sum(new_energies) - np.sum(old_energies))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Profiler: This module counts and times the parts (we call them "phases") of a simulation
+
+When a run is slow, we want to know where the time goes: the trial moves, the overlap check,
+the energy change, writing the frames, g(r) ... The profiler is a dictionary with
+    - times:  the seconds spent in each phase during the current sweep
+    - counts: how many times something happened during the current sweep, like
+              'overlap_rejections' (the trial position overlaps) and
+              'metropolis_rejections' (no overlap, but the energy went up too much)
+    - total_times and total_counts: everything added up since the start
+
+Use it like this
+
+    profiler = create_profiler()
+    start = start_timer(profiler)
+    ... do something ...
+    stop_timer(profiler, 'something', start)
+    add_count(profiler, 'apples', 3)
+    record = finish_sweep(profiler)  # the times and counts of this sweep, then start a new sweep
+
+If the profiler is None or switched off (create_profiler(enabled=False)), every function
+returns at once without looking at the clock, so it costs (almost) nothing.
+"""
+import json
+import time
+
+
+def create_profiler(enabled=True):
+    """
+    The stuff below are some testing code, don't worry about it
+    >>> profiler = create_profiler()
+    >>> start = start_timer(profiler)
+    >>> stop_timer(profiler, 'sleep', start)
+    >>> add_count(profiler, 'apples', 3)
+    >>> add_count(profiler, 'apples')
+    >>> record = finish_sweep(profiler)
+    >>> record['counts'], list(record['times'])
+    ({'apples': 4}, ['sleep'])
+    >>> profiler['counts'], profiler['total_counts']
+    ({}, {'apples': 4})
+    >>> off = create_profiler(enabled=False)
+    >>> add_count(off, 'apples')
+    >>> start_timer(off), finish_sweep(off)
+    (0.0, None)
+    """
+    return {'enabled': enabled, 'times': {}, 'counts': {}, 'total_times': {}, 'total_counts': {}}
+
+
+def is_enabled(profiler):
+    return profiler is not None and profiler['enabled']
+
+
+def start_timer(profiler):
+    """the time now, or 0 if the profiler is off (then we don't look at the clock at all)"""
+    if profiler is None or not profiler['enabled']:
+        return 0.0
+    return time.perf_counter()
+
+
+def stop_timer(profiler, phase, start):
+    """add the time since start to the phase"""
+    if profiler is None or not profiler['enabled']:
+        return
+    times = profiler['times']
+    times[phase] = times.get(phase, 0.0) + time.perf_counter() - start
+
+
+def add_count(profiler, name, value=1):
+    if profiler is None or not profiler['enabled']:
+        return
+    counts = profiler['counts']
+    counts[name] = counts.get(name, 0) + int(value)
+
+
+def finish_sweep(profiler):
+    """
+    Add the times and counts of the current sweep to the totals, and start counting again from zero
+    Returns the times and counts of the sweep that just finished (None if the profiler is off)
+    """
+    if profiler is None or not profiler['enabled']:
+        return None
+    record = {'times': profiler['times'], 'counts': profiler['counts']}
+    for name, value in record['times'].items():
+        profiler['total_times'][name] = profiler['total_times'].get(name, 0.0) + value
+    for name, value in record['counts'].items():
+        profiler['total_counts'][name] = profiler['total_counts'].get(name, 0) + value
+    profiler['times'], profiler['counts'] = {}, {}
+    return record
+
+
+def format_record(record):
+    """
+    A short text for the summary line of a sweep, the times are in milliseconds
+
+    The stuff below are some testing code, don't worry about it
+    >>> format_record({'times': {'sweep': 0.0123}, 'counts': {'attempted_moves': 100, 'overlap_rejections': 20}})
+    'overlap rejected 0.20 metropolis rejected 0.00 | sweep 12.3 ms'
+    """
+    counts = record['counts']
+    attempts = max(counts.get('attempted_moves', 0), 1)
+    text = 'overlap rejected {:.2f} metropolis rejected {:.2f}'.format(
+        counts.get('overlap_rejections', 0) / attempts, counts.get('metropolis_rejections', 0) / attempts
+    )
+    if counts.get('domain_rejections', 0):
+        text += ' left domain {:.2f}'.format(counts['domain_rejections'] / attempts)
+    phases = ' '.join('{} {:.1f} ms'.format(phase, 1000 * seconds) for phase, seconds in record['times'].items())
+    return text + ' | ' + phases
+
+
+def write_record(log_file, sweep_number, record):
+    """add one line of JSON to the log file (an open text file), it can be read back with json.loads line by line"""
+    log_file.write(json.dumps({'sweep': sweep_number, 'times': record['times'], 'counts': record['counts']}) + '\n')
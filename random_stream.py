@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Random stream: This module gives all the random numbers of the trial moves, one sweep at a time
+
+A trial move needs a few random numbers: which particle to move, the displacement (3 numbers)
+and one number to accept or reject the move. Asking `random` for them one by one is slow in python,
+and mixing `random` with `np.random` makes it hard to get the same run twice. So a run has one
+"stream", a numpy Generator (https://numpy.org/doc/stable/reference/random/generator.html),
+and we draw the numbers for a whole sweep in one go
+
+    numbers = draw_sweep(stream, particle_number, step)
+    numbers['picks'][k]          the particle of move k
+    numbers['displacements'][k]  its displacement, between -step and step (or gaussian if step is None)
+    numbers['uniforms'][k]       the number between 0 and 1 that decides if move k is accepted
+
+The numba backends get exactly the same numbers, so they give the same trajectory as the python backend.
+For parallel runs (parameter_sweep.py, replica_exchange.py), every worker gets its own seed
+from spawn_seeds, the seeds come from one SeedSequence, so the streams never overlap.
+"""
+import json
+import random as random
+import numpy as np
+
+
+def create_random_stream(seed=None):
+    """
+    A new stream, the same seed gives the same numbers. Without a seed the numbers are different every time
+
+    The stuff below are some testing code, don't worry about it
+    >>> numbers = draw_sweep(create_random_stream(1), 5, 0.1)
+    >>> numbers['picks'].shape, numbers['displacements'].shape, numbers['uniforms'].shape
+    ((5,), (5, 3), (5,))
+    >>> bool(np.all(numbers['picks'] == draw_sweep(create_random_stream(1), 5, 0.1)['picks']))
+    True
+    >>> bool(np.all(np.abs(numbers['displacements']) <= 0.1))
+    True
+    """
+    return {'generator': np.random.default_rng(seed)}
+
+
+def get_default_stream(stream):
+    """the stream itself, or a new stream seeded from `random` if it is None (so random.seed(...) still works)"""
+    if stream is None:
+        return create_random_stream(random.randrange(2 ** 32))
+    return stream
+
+
+def draw_sweep(stream, particle_number, step=None, moves=None):
+    """
+    The random numbers of `moves` trial moves (particle_number if moves is None), see the top of this file
+    The displacements are uniform between -step and step, or gaussian with a width of 1 if step is None
+    """
+    if moves is None:
+        moves = particle_number
+    generator = stream['generator']
+    picks = generator.integers(0, particle_number, moves)
+    if step is None:
+        displacements = generator.standard_normal((moves, 3))
+    else:
+        displacements = generator.uniform(-step, step, (moves, 3))
+    uniforms = generator.random(moves)
+    return {'picks': picks, 'displacements': displacements, 'uniforms': uniforms}
+
+
+def spawn_seeds(seed, number):
+    """
+    Independent seeds for `number` workers, all of them come from one master seed
+    The seeds are the children of the SeedSequence of the master seed, numpy makes sure that their
+    streams never overlap. Give them to create_random_stream (or seed_random_numbers) as they are,
+    turning them into a small number would throw this away.
+    The seed of worker k is the same as np.random.SeedSequence(seed, spawn_key=(k,))
+
+    The stuff below are some testing code, don't worry about it
+    >>> seeds = spawn_seeds(0, 3)
+    >>> [child.spawn_key for child in seeds]
+    [(0,), (1,), (2,)]
+    >>> first = draw_sweep(create_random_stream(seeds[1]), 5)['uniforms']
+    >>> bool(np.all(first == draw_sweep(create_random_stream(spawn_seeds(0, 3)[1]), 5)['uniforms']))
+    True
+    >>> bool(np.all(first == draw_sweep(create_random_stream(seeds[2]), 5)['uniforms']))
+    False
+    """
+    return np.random.SeedSequence(seed).spawn(number)
+
+
+def get_stream_state(stream):
+    """
+    The state of the stream as a short text, to keep it in a checkpoint
+
+    The stuff below are some testing code, don't worry about it
+    >>> stream = create_random_stream(3)
+    >>> text = get_stream_state(stream)
+    >>> first = draw_sweep(stream, 10)['uniforms']
+    >>> set_stream_state(stream, text)
+    >>> bool(np.all(first == draw_sweep(stream, 10)['uniforms']))
+    True
+    """
+    return json.dumps(stream['generator'].bit_generator.state)
+
+
+def set_stream_state(stream, text):
+    """put the stream back to the state from get_stream_state"""
+    stream['generator'].bit_generator.state = json.loads(str(text))
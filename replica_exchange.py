@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Replica exchange (parallel tempering): This script runs many copies of the square well system at once
+
+With deep wells (like depth = -5) the particles stick together and the system gets "trapped",
+most of the sweeps don't change the structure any more. The idea of replica exchange is to run
+M copies (replicas) of the system at different temperatures at the same time, one per CPU core.
+The hot replicas move around easily. Every few sweeps we try to swap the configurations of two
+neighbouring temperatures, so a configuration can get "unstuck" at a high temperature and come back.
+
+In our units the temperature is hidden in the depth: running at inverse temperature β with depth ε
+is the same as running at β = 1 with depth β × ε. So every replica uses step_energies × scale (any potential),
+and a scale of 1 is the system we want. The swap between temperature k and k + 1 is accepted with
+
+    P = min(1, exp((scale_k - scale_k+1) × (U_a - U_b)))
+
+where U_a and U_b are the (unscaled) energies of the two configurations.
+
+    python replica_exchange.py
+"""
+import os
+import random
+import importlib
+import multiprocessing
+import numpy as np
+from cell_list import build_cell_list
+from particle_state import get_labels, get_max_interaction_range
+from square_well import get_total_energy
+from sweep_engine import select_backend, sweep
+from trajectory import open_trajectory, write_frame, close_trajectory
+from parameter_sweep import seed_random_numbers
+from random_stream import create_random_stream, spawn_seeds
+from hard_sphere_attracted_binary import adjust_step
+from initialization import get_particle_number
+
+
+def run_replica(connection, script, parameters, scale, state_seed, seed, backend):
+    """
+    One replica, this runs inside a worker process and waits for commands from the main process
+    state_seed is the same for all the replicas, so they start with the same particles (and the same
+    number of A and B), otherwise a swap would exchange configurations of different systems.
+    seed is the own seed of the replica, for its moves
+        ('run', sweeps)         -- do some sweeps, send back the unscaled energy, the accept ratio and the step
+        ('set_scale', scale, step)  -- change the temperature of the replica (after a swap)
+        ('positions',)          -- send back the positions
+        ('stop',)               -- finish
+    """
+    seed_random_numbers(state_seed)
+    stream = create_random_stream(seed)
+    state = importlib.import_module(script).create_state(parameters)
+    depth_matrix, step_energies = state['depth_matrix'].copy(), state['step_energies'].copy()
+    state['depth_matrix'], state['step_energies'] = depth_matrix * scale, step_energies * scale
+    cell_list = build_cell_list(state['positions'], state['box'], get_max_interaction_range(state))
+    backend = select_backend(backend)
+    particle_number = len(state['positions'])
+    box_size = float(state['box'][0])
+    step = box_size / 10
+    energy = get_total_energy(state) / scale  # the running energy without the scale
+
+    while True:
+        command = connection.recv()
+        if command[0] == 'run':
+            accept_count = 0
+            for t in range(command[1]):
+                accepted, energy_change = sweep(state, cell_list, step, backend, stream=stream)
+                energy += energy_change / scale
+                accept_count += accepted
+                step = adjust_step(step, accepted / particle_number, box_size)
+            connection.send((energy, accept_count / particle_number / command[1], step))
+        elif command[0] == 'set_scale':
+            scale, step = command[1], command[2]
+            state['depth_matrix'], state['step_energies'] = depth_matrix * scale, step_energies * scale
+            connection.send(True)
+        elif command[0] == 'positions':
+            connection.send((state['positions'].copy(), get_labels(state), state['box'].tolist()))
+        else:
+            break
+    connection.close()
+
+
+def run_replica_exchange(script, parameters, scales, total_exchanges, sweeps_per_exchange,
+                         output_directory='.', output_interval=10, seed=0, backend='auto'):
+    """
+    Run len(scales) replicas of the script (like 'hard_sphere_attracted_binary') in parallel
+    scales are the depth scales (inverse temperatures), sorted from the coldest (1) to the hottest
+    The configuration at every temperature is written to positions_replica_{k}.xyz every output_interval exchanges
+    Returns the swap acceptance of every neighbouring pair and the mean energy per particle at every temperature
+    """
+    scales = [float(scale) for scale in scales]
+    if min(scales) <= 0:
+        raise ValueError('the scales should be positive, not {}'.format(scales))
+    replica_number = len(scales)
+    if seed is None:
+        seed = random.randrange(2 ** 32)  # the replicas still need one common seed for their starting state
+    seeds = spawn_seeds(seed, replica_number + 1)
+    swap_random = np.random.default_rng(seeds[-1])  # the random numbers for the swaps
+
+    # replica r starts at temperature r, replica_at[k] is the replica at temperature k
+    connections, processes = [], []
+    for r in range(replica_number):
+        connection, worker_connection = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=run_replica, args=(worker_connection, script, parameters, scales[r], seed, seeds[r], backend)
+        )
+        process.start()
+        connections.append(connection)
+        processes.append(process)
+    replica_at = list(range(replica_number))
+    steps = [None] * replica_number  # the step belongs to the temperature, it moves with the swap
+
+    os.makedirs(output_directory, exist_ok=True)
+    trajectories = [None] * replica_number
+    swap_attempts = np.zeros(replica_number - 1, dtype=np.int64)
+    swap_accepts = np.zeros(replica_number - 1, dtype=np.int64)
+    energies = np.zeros((total_exchanges, replica_number))  # the energy at every temperature
+    try:
+        for exchange in range(total_exchanges):
+            for connection in connections:
+                connection.send(('run', sweeps_per_exchange))
+            results = [connection.recv() for connection in connections]
+            energy_of_replica = [result[0] for result in results]
+            for k, r in enumerate(replica_at):
+                steps[k] = results[r][2]
+
+            # try to swap the neighbouring temperatures, (0, 1), (2, 3) ... and (1, 2), (3, 4) ... in turns
+            for k in range(exchange % 2, replica_number - 1, 2):
+                a, b = replica_at[k], replica_at[k + 1]
+                swap_attempts[k] += 1
+                log_probability = (scales[k] - scales[k + 1]) * (energy_of_replica[a] - energy_of_replica[b])
+                if swap_random.random() < np.exp(min(log_probability, 0)):
+                    swap_accepts[k] += 1
+                    replica_at[k], replica_at[k + 1] = b, a
+                    for temperature, replica in [(k, b), (k + 1, a)]:
+                        connections[replica].send(('set_scale', scales[temperature], steps[temperature]))
+                        connections[replica].recv()
+            energies[exchange] = [energy_of_replica[r] for r in replica_at]
+
+            if exchange % output_interval == 0:
+                for k, r in enumerate(replica_at):
+                    connections[r].send(('positions',))
+                    positions, labels, box = connections[r].recv()
+                    if trajectories[k] is None:
+                        filename = os.path.join(output_directory, 'positions_replica_{}.xyz'.format(k))
+                        trajectories[k] = open_trajectory(filename, labels)
+                    write_frame(trajectories[k], positions, 'box is {}, at frame {}, scale {}'.format(
+                        box, exchange * sweeps_per_exchange, scales[k]
+                    ))
+    finally:
+        # a worker that has died can't get the message, this should not hide the error that stopped the run
+        for connection in connections:
+            try:
+                connection.send(('stop',))
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for trajectory in trajectories:
+            if trajectory is not None:
+                close_trajectory(trajectory)
+
+    particle_number = get_particle_number(parameters)
+    swap_acceptance = swap_accepts / np.maximum(swap_attempts, 1)
+    np.savez(
+        os.path.join(output_directory, 'replica_exchange.npz'),
+        scales=scales, energies=energies, swap_acceptance=swap_acceptance
+    )
+    for k in range(replica_number - 1):
+        print('Swap between scale {:.3f} and {:.3f}: accept ratio is {:.2f}'.format(
+            scales[k], scales[k + 1], swap_acceptance[k]
+        ))
+    return {
+        'swap_acceptance': swap_acceptance.tolist(),
+        'energy_per_particle': (energies.mean(axis=0) / particle_number).tolist(),
+    }
+
+
+if __name__ == "__main__":
+    import hard_sphere_attracted_binary
+
+    scales = np.geomspace(1, 0.4, 6)  # from depth -5 down to depth -2
+    run_replica_exchange(
+        'hard_sphere_attracted_binary', hard_sphere_attracted_binary.parameters, scales,
+        total_exchanges=50, sweeps_per_exchange=10, output_directory='replica_exchange_output'
+    )
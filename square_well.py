@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Square well: This module calculates the energy change when ONE particle moves
+
+A particle only feels the particles inside its square well, and they are all in the cells
+around it. So instead of copying the whole system and adding up the energy of all N particles
+twice, we only look at the neighbours before and after the move.
+
+    ΔE = E(particle i at the trial position) - E(particle i at the old position)
+
+The depth and the interaction range (width + diameter) could be one number for all particles,
+or one row of the species matrix in particle_state.py (for the binary system). Then we also
+pass the types, and the value for particle j is row[types[j]].
+"""
+import numpy as np
+from cell_list import get_neighbours, get_pairs
+from pbc import get_squared_distances_in_pbc, get_pair_squared_distances_in_pbc
+from potentials import get_pair_energies
+
+
+def get_row(table_row, neighbours, types=None):
+    """pick the values for the neighbours, a single number is shared by all neighbours"""
+    if np.ndim(table_row) == 0:
+        return table_row
+    if types is not None:
+        return table_row[types[neighbours]]
+    return table_row[neighbours]
+
+
+def get_local_energy(position, neighbours, positions, depths, interaction_ranges, box):
+    """
+    The energy between a particle at `position` and the particles in `neighbours`
+    depths and interaction_ranges could be single numbers, or one value for every neighbour
+
+    The stuff below are some testing code, don't worry about it
+    >>> positions = np.array([[0, 0, 0], [1, 0, 0], [2.5, 0, 0], [0, 0, 4.5]])
+    >>> get_local_energy(positions[0], [1, 2, 3], positions, -1, 1.1, [5, 5, 5])
+    -2.0
+    """
+    squared_distances = get_squared_distances_in_pbc(position, positions[neighbours], box)
+    is_in_well = squared_distances <= np.asarray(interaction_ranges) ** 2
+    return float(np.sum(np.broadcast_to(depths, is_in_well.shape)[is_in_well]))
+
+
+def get_energy_change(i, trial_position, positions, cell_list, depths, interaction_ranges, box,
+                      trial_neighbours=None, types=None):
+    """
+    The energy change ΔE if particle i moves to the trial position
+    The cell list should be built with a cutoff not smaller than the largest interaction range
+    Pass trial_neighbours if you already got them from the overlap check
+    Pass types if depths and interaction_ranges are rows of the species matrices
+
+    The stuff below are some testing code, don't worry about it
+    >>> from cell_list import build_cell_list
+    >>> positions = np.array([[1, 1, 1], [2, 1, 1], [5, 5, 5]], dtype=np.float64)
+    >>> cells = build_cell_list(positions, [8, 8, 8], 1.2)
+    >>> get_energy_change(0, [4, 5, 5], positions, cells, -1, 1.2, [8, 8, 8])
+    0.0
+    >>> get_energy_change(0, [6, 5, 5], positions, cells, -1, 1.2, [8, 8, 8])
+    0.0
+    >>> get_energy_change(0, [7, 7, 7], positions, cells, -1, 1.2, [8, 8, 8])
+    1.0
+    >>> types = np.array([0, 1, 0], dtype=np.int8)
+    >>> depth_matrix = np.array([[-1.0, 2.0], [2.0, -1.0]])
+    >>> get_energy_change(0, [7, 7, 7], positions, cells, depth_matrix[0], 1.2, [8, 8, 8], types=types)
+    -2.0
+    """
+    old_neighbours = [j for j in get_neighbours(positions[i], cell_list) if j != i]
+    if trial_neighbours is None:
+        trial_neighbours = [j for j in get_neighbours(trial_position, cell_list) if j != i]
+    old_energy = get_local_energy(
+        positions[i], old_neighbours, positions,
+        get_row(depths, old_neighbours, types), get_row(interaction_ranges, old_neighbours, types), box
+    )
+    new_energy = get_local_energy(
+        trial_position, trial_neighbours, positions,
+        get_row(depths, trial_neighbours, types), get_row(interaction_ranges, trial_neighbours, types), box
+    )
+    return new_energy - old_energy
+
+
+def get_total_energy(state):
+    """
+    The energy of the whole system, every pair is counted once, with any potential from potentials.py
+    The pairs are found with the cell list, so this is much faster than checking all N×N pairs
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> state = create_particle_state(
+    ...     [[1, 1, 1], [2.05, 1, 1], [3.1, 1, 1], [6, 6, 6]], [0, 0, 1, 1], [8, 8, 8], ['A', 'B'], [1, 1],
+    ...     depths=[[-1, 3], [3, -1]], widths=[[0.1, 0.1], [0.1, 0.1]]
+    ... )
+    >>> get_total_energy(state)
+    2.0
+    """
+    positions, types, box = state['positions'], state['types'], state['box']
+    i, j = get_pairs(positions, box, np.max(state['range_matrix']))
+    squared_distances = get_pair_squared_distances_in_pbc(positions, np.stack([i, j], axis=1), box)
+    return float(np.sum(get_pair_energies(state, types[i], types[j], squared_distances)))
@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""
+Sweep engine: This module runs one Monte-Carlo sweep (N trial moves) of the square well system
+
+There are two versions (we call them "backends") that do exactly the same thing
+    'python' -- the loop we wrote in hard_sphere_attracted_binary.py, easy to read
+    'numba'  -- the same loop compiled to machine code with numba (https://numba.pydata.org)
+                it is much faster, but you need to `pip install numba`
+    'checkerboard' -- the compiled sweep on many CPU cores at the same time, see `checkerboard_sweep`
+    'verlet' -- the compiled sweep, but the neighbours come from Verlet lists (see verlet_list.py)
+                instead of the 27 cells, this is faster for short wells at low volume fractions
+
+If numba is not installed, the 'python' backend is used instead.
+The random numbers of a sweep are drawn in one go from a stream (see random_stream.py), and every
+backend uses them in the same order, so 'python', 'numba' and 'verlet' give the same trajectory
+for a given seed. 'checkerboard' rejects the moves that leave a domain, so its trajectory is different,
+but it samples the same thing (the energy and the accept ratio should agree on average).
+
+Run benchmark.py to see how many sweeps per second each backend can do.
+Pass a profiler (see profiler.py) to `sweep` to count why the moves are rejected, and with the
+'python' backend also to time the parts of a trial move.
+"""
+import warnings
+import numpy as np
+from cell_list import (get_neighbours, move_particle, get_cell_coordinate_1d, get_neighbour_coordinate,
+                       move_in_cell_list, rebuild_cell_list)
+from pbc import get_squared_distances_in_pbc
+from potentials import get_energy_change
+from profiler import is_enabled, start_timer, stop_timer, add_count
+from verlet_list import build_verlet_list, is_same_system, update_verlet_list
+from random_stream import get_default_stream, draw_sweep
+from compiled import njit, prange, HAS_NUMBA
+
+BACKENDS = ['python', 'numba', 'checkerboard', 'verlet']
+
+# the default skin of the Verlet lists, as a fraction of the longest interaction range
+VERLET_SKIN = 0.5
+
+
+def check_overlap(p1, p2, diameter_1, diameter_2, box):
+    """p2 and diameter_2 could be many particles, then we check if p1 overlaps with any of them"""
+    squared_distances = get_squared_distances_in_pbc(p1, p2, box)
+    contact = (diameter_1 + np.asarray(diameter_2)) / 2
+    return bool(np.any(squared_distances <= contact ** 2))
+
+
+def select_backend(backend='auto'):
+    """
+    Choose 'numba' if it is installed, otherwise 'python'
+    """
+    if backend not in ['auto'] + BACKENDS:
+        raise ValueError('backend should be one of {}, not {}'.format(['auto'] + BACKENDS, backend))
+    if backend in ['numba', 'checkerboard', 'verlet'] and not HAS_NUMBA:
+        warnings.warn('numba is not installed, using the python backend instead')
+        backend = 'python'
+    if backend == 'auto':
+        backend = 'numba' if HAS_NUMBA else 'python'
+    return backend
+
+
+def sweep(state, cell_list, step, backend='python', profiler=None, stream=None):
+    """
+    Try to move N randomly picked particles once, the positions and the cell list are updated in place
+    Returns the number of accepted moves and the energy change of the whole system
+    The rejected moves are counted in the profiler (if there is one), see profiler.py
+    The random numbers come from the stream (see random_stream.py), without a stream they are seeded from `random`
+    """
+    stream = get_default_stream(stream)
+    if not is_enabled(profiler):
+        rejections = None
+    else:
+        rejections = np.zeros(3, dtype=np.int64)  # overlap, metropolis, left the domain (checkerboard)
+        add_count(profiler, 'attempted_moves', len(state['positions']))
+
+    start = start_timer(profiler)
+    if backend == 'numba':
+        accept_count, energy_change = numba_sweep(state, cell_list, step, stream, rejections)
+    elif backend == 'checkerboard':
+        accept_count, energy_change = checkerboard_sweep(state, cell_list, step, stream, rejections)
+    elif backend == 'verlet':
+        accept_count, energy_change = verlet_sweep(state, cell_list, step, stream, rejections)
+    else:
+        accept_count, energy_change = python_sweep(state, cell_list, step, stream, rejections, profiler)
+    stop_timer(profiler, 'sweep', start)
+
+    if rejections is not None:
+        add_count(profiler, 'overlap_rejections', rejections[0])
+        add_count(profiler, 'metropolis_rejections', rejections[1])
+        if backend == 'checkerboard':
+            add_count(profiler, 'domain_rejections', rejections[2])
+    return accept_count, energy_change
+
+
+def python_sweep(state, cell_list, step, stream, rejections=None, profiler=None):
+    """
+    the pure python sweep, one trial move each time
+    rejections (if given) counts the [overlap, metropolis, 0] rejections, the profiler times the parts of a move
+    """
+    positions, types, diameters, box = state['positions'], state['types'], state['diameters'], state['box']
+    particle_number = len(positions)
+    accept_count = 0
+    energy_change = 0
+
+    # all the random numbers of the sweep at once
+    start = start_timer(profiler)
+    numbers = draw_sweep(stream, particle_number, step)
+    picks, displacements, uniforms = numbers['picks'], numbers['displacements'], numbers['uniforms']
+    stop_timer(profiler, 'random_numbers', start)
+
+    for k in range(0, particle_number):
+        start = start_timer(profiler)
+        i = picks[k]  # randomly pick up a particle and move
+        trial_x = positions[i, 0] + displacements[k, 0]
+        trial_y = positions[i, 1] + displacements[k, 1]
+        trial_z = positions[i, 2] + displacements[k, 2]
+
+        # Check boundaries
+        # We always move particles a small step, so don't worry if trial_x >> box_size
+        if trial_x <= 0:
+            trial_x += box[0]
+        elif trial_x >= box[0]:
+            trial_x -= box[0]
+
+        if trial_y <= 0:
+            trial_y += box[1]
+        elif trial_y >= box[1]:
+            trial_y -= box[1]
+
+        if trial_z <= 0:
+            trial_z += box[2]
+        elif trial_z >= box[2]:
+            trial_z -= box[2]
+
+        p1 = [trial_x, trial_y, trial_z]
+        stop_timer(profiler, 'trial_move', start)
+
+        # Check if the trial particle is overlaping with other particles nearby
+        start = start_timer(profiler)
+        neighbours = [j for j in get_neighbours(p1, cell_list) if j != i]
+        is_overlap = check_overlap(p1, positions[neighbours], diameters[types[i]], diameters[types[neighbours]], box)
+        stop_timer(profiler, 'overlap_check', start)
+
+        if is_overlap:
+            if rejections is not None:
+                rejections[0] += 1
+        else:
+            # Only the neighbours before and after the move change the energy
+            start = start_timer(profiler)
+            old_neighbours = [j for j in get_neighbours(positions[i], cell_list) if j != i]
+            delta = get_energy_change(state, i, p1, old_neighbours, neighbours)
+            accept_probability = np.exp(-1 * delta)
+            stop_timer(profiler, 'energy_change', start)
+
+            # If probability is HIGH, a random number is less likely to be higher than it
+            start = start_timer(profiler)
+            if uniforms[k] < accept_probability:
+                accept_count += 1
+                positions[i] = p1
+                move_particle(cell_list, i, p1)
+                energy_change += delta
+            elif rejections is not None:
+                rejections[1] += 1
+            stop_timer(profiler, 'accept_move', start)
+    return accept_count, energy_change
+
+
+def numba_sweep(state, cell_list, step, stream, rejections=None):
+    """the compiled sweep, it works on the numpy arrays inside the state and the cell list"""
+    if rejections is None:
+        rejections = np.zeros(3, dtype=np.int64)
+    numbers = draw_sweep(stream, len(state['positions']), step)
+    accept_count, energy_change = compiled_sweep(
+        state['positions'], state['types'], state['diameters'], state['step_radii'], state['step_energies'],
+        state['range_matrix'], state['box'], cell_list['head'], cell_list['next'], cell_list['cell_of'],
+        cell_list['cells_per_side'], cell_list['cell_size'],
+        numbers['picks'], numbers['displacements'], numbers['uniforms'], rejections
+    )
+    return int(accept_count), float(energy_change)
+
+
+@njit(cache=True)
+def get_pair_energy(squared_distance, type_i, type_j, step_radii, step_energies):
+    """
+    The energy of one pair from the step tables (see potentials.py)
+    The overlap is checked before, and the pair should be closer than range_matrix[type_i, type_j]
+    """
+    if step_radii.shape[2] == 1:
+        return step_energies[type_i, type_j, 0]  # one step, and the pair is inside the range
+    energy = 0.0
+    for k in range(step_radii.shape[2]):
+        radius = step_radii[type_i, type_j, k]
+        if squared_distance <= radius * radius:
+            energy += step_energies[type_i, type_j, k]
+    return energy
+
+
+@njit(cache=True)
+def get_local_energy(i, position, positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                     head, next_, cells_per_side, cell_size, stop_at_overlap):
+    """
+    The energy of particle i if it sits at `position`, only the 27 cells around it are visited
+    Returns (is_overlap, energy), with stop_at_overlap we give up as soon as we find an overlap
+    """
+    nx, ny, nz = cells_per_side[0], cells_per_side[1], cells_per_side[2]
+    centre_x = get_cell_coordinate_1d(position[0], cell_size[0], nx)
+    centre_y = get_cell_coordinate_1d(position[1], cell_size[1], ny)
+    centre_z = get_cell_coordinate_1d(position[2], cell_size[2], nz)
+    type_i = types[i]
+    energy = 0.0
+    for offset_x in range(min(nx, 3)):
+        cx = get_neighbour_coordinate(centre_x, offset_x, nx)
+        for offset_y in range(min(ny, 3)):
+            cy = get_neighbour_coordinate(centre_y, offset_y, ny)
+            for offset_z in range(min(nz, 3)):
+                cz = get_neighbour_coordinate(centre_z, offset_z, nz)
+                j = head[(cx * ny + cy) * nz + cz]
+                while j != -1:
+                    if j != i:
+                        squared_distance = 0.0
+                        for d in range(3):
+                            distance_1d = abs(positions[j, d] - position[d])
+                            if distance_1d > box[d] / 2:
+                                distance_1d = box[d] - distance_1d
+                            squared_distance += distance_1d * distance_1d
+                        type_j = types[j]
+                        contact = (diameters[type_i] + diameters[type_j]) / 2
+                        if stop_at_overlap and squared_distance <= contact * contact:
+                            return True, energy
+                        interaction_range = range_matrix[type_i, type_j]
+                        if squared_distance <= interaction_range * interaction_range:
+                            energy += get_pair_energy(squared_distance, type_i, type_j, step_radii, step_energies)
+                    j = next_[j]
+    return False, energy
+
+
+@njit(cache=True)
+def compiled_sweep(positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                   head, next_, cell_of, cells_per_side, cell_size, picks, displacements, uniforms, rejections):
+    accept_count = 0
+    energy_change = 0.0
+    trial = np.empty(3)
+    for move in range(picks.shape[0]):
+        i = picks[move]
+        for d in range(3):
+            trial[d] = positions[i, d] + displacements[move, d]
+            if trial[d] <= 0:
+                trial[d] += box[d]
+            elif trial[d] >= box[d]:
+                trial[d] -= box[d]
+
+        is_overlap, new_energy = get_local_energy(
+            i, trial, positions, types, diameters, step_radii, step_energies, range_matrix, box,
+            head, next_, cells_per_side, cell_size, True
+        )
+        if is_overlap:
+            rejections[0] += 1
+            continue
+        is_overlap, old_energy = get_local_energy(
+            i, positions[i], positions, types, diameters, step_radii, step_energies, range_matrix, box,
+            head, next_, cells_per_side, cell_size, False
+        )
+        delta = new_energy - old_energy
+        if uniforms[move] < np.exp(-delta):
+            accept_count += 1
+            energy_change += delta
+            for d in range(3):
+                positions[i, d] = trial[d]
+            move_in_cell_list(i, trial, head, next_, cell_of, cells_per_side, cell_size)
+        else:
+            rejections[1] += 1
+    return accept_count, energy_change
+
+
+def verlet_sweep(state, cell_list, step, stream, rejections=None):
+    """
+    The compiled sweep with Verlet lists, the list is kept in cell_list['verlet_list']
+    If there is no list yet, it is built with a skin of VERLET_SKIN × the longest interaction range
+
+    A trial position further than skin / 2 from the reference position of the particle is not covered
+    by its row, then the cell list is used for this move (the cell list is always kept up to date).
+    If such a move is accepted, the row of the particle is found again, see verlet_list.py.
+    The random numbers are the same as in the 'numba' backend, so we get the same trajectory.
+    """
+    positions, box = state['positions'], state['box']
+    cutoff = float(np.max(state['range_matrix']))
+    if 'verlet_list' not in cell_list:
+        cell_list['verlet_list'] = build_verlet_list(positions, box, cutoff, VERLET_SKIN * cutoff)
+    verlet_list = cell_list['verlet_list']
+    if not is_same_system(verlet_list, positions, box, cutoff):
+        update_verlet_list(verlet_list, positions, box, cutoff)
+    if rejections is None:
+        rejections = np.zeros(3, dtype=np.int64)
+
+    numbers = draw_sweep(stream, len(positions), step)
+    first_move = 0
+    accept_count, energy_change = 0, 0.0
+    while True:
+        reference_cells = verlet_list['reference_cells']
+        accepted, delta, first_move, is_full = compiled_verlet_sweep(
+            positions, state['types'], state['diameters'], state['step_radii'], state['step_energies'],
+            state['range_matrix'], box,
+            cell_list['head'], cell_list['next'], cell_list['cell_of'], cell_list['cells_per_side'],
+            cell_list['cell_size'], numbers['picks'], numbers['displacements'], numbers['uniforms'], first_move,
+            verlet_list['offsets'], verlet_list['counts'], verlet_list['indices'], verlet_list['reference_positions'],
+            reference_cells['head'], reference_cells['next'], reference_cells['cell_of'],
+            reference_cells['cells_per_side'], reference_cells['cell_size'],
+            cutoff + verlet_list['skin'], verlet_list['skin'] / 2, rejections
+        )
+        accept_count += accepted
+        energy_change += delta
+        if not is_full:
+            return int(accept_count), float(energy_change)
+        # a row is full, build the whole list again with more free space
+        build_count = verlet_list['build_count']
+        verlet_list.update(build_verlet_list(positions, box, cutoff, verlet_list['skin']))
+        verlet_list['build_count'] = build_count + 1
+
+
+@njit(cache=True)
+def get_displacement_squared(position, reference, box):
+    squared_distance = 0.0
+    for d in range(3):
+        distance_1d = abs(position[d] - reference[d])
+        if distance_1d > box[d] / 2:
+            distance_1d = box[d] - distance_1d
+        squared_distance += distance_1d * distance_1d
+    return squared_distance
+
+
+@njit(cache=True)
+def get_verlet_energy(i, position, positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                      offsets, counts, indices, stop_at_overlap):
+    """the same as get_local_energy, but only the particles in the row of i are visited"""
+    type_i = types[i]
+    energy = 0.0
+    for k in range(offsets[i], offsets[i] + counts[i]):
+        j = indices[k]
+        squared_distance = get_displacement_squared(position, positions[j], box)
+        type_j = types[j]
+        contact = (diameters[type_i] + diameters[type_j]) / 2
+        if stop_at_overlap and squared_distance <= contact * contact:
+            return True, energy
+        interaction_range = range_matrix[type_i, type_j]
+        if squared_distance <= interaction_range * interaction_range:
+            energy += get_pair_energy(squared_distance, type_i, type_j, step_radii, step_energies)
+    return False, energy
+
+
+@njit(cache=True)
+def update_verlet_row(i, positions, box, offsets, counts, indices, reference_positions,
+                      reference_head, reference_next, reference_cell_of, reference_cells_per_side, reference_cell_size,
+                      list_range):
+    """
+    Particle i went too far from its reference position, so we find its neighbours again
+    Returns False if a row is full (then the whole list must be built again)
+    """
+    # take i out of the rows of its old neighbours
+    for k in range(offsets[i], offsets[i] + counts[i]):
+        j = indices[k]
+        for m in range(offsets[j], offsets[j] + counts[j]):
+            if indices[m] == i:
+                counts[j] -= 1
+                indices[m] = indices[offsets[j] + counts[j]]
+                break
+    counts[i] = 0
+
+    # the new reference position
+    for d in range(3):
+        reference_positions[i, d] = positions[i, d]
+    move_in_cell_list(i, reference_positions[i], reference_head, reference_next, reference_cell_of,
+                      reference_cells_per_side, reference_cell_size)
+
+    # the new neighbours are in the 27 reference cells around it
+    nx, ny, nz = reference_cells_per_side[0], reference_cells_per_side[1], reference_cells_per_side[2]
+    centre = reference_cell_of[i]
+    centre_x, centre_y, centre_z = centre // (ny * nz), (centre // nz) % ny, centre % nz
+    for offset_x in range(min(nx, 3)):
+        cx = get_neighbour_coordinate(centre_x, offset_x, nx)
+        for offset_y in range(min(ny, 3)):
+            cy = get_neighbour_coordinate(centre_y, offset_y, ny)
+            for offset_z in range(min(nz, 3)):
+                cz = get_neighbour_coordinate(centre_z, offset_z, nz)
+                j = reference_head[(cx * ny + cy) * nz + cz]
+                while j != -1:
+                    if j != i and get_displacement_squared(reference_positions[i], reference_positions[j], box) <= list_range * list_range:
+                        if offsets[i] + counts[i] == offsets[i + 1] or offsets[j] + counts[j] == offsets[j + 1]:
+                            return False
+                        indices[offsets[i] + counts[i]] = j
+                        counts[i] += 1
+                        indices[offsets[j] + counts[j]] = i
+                        counts[j] += 1
+                    j = reference_next[j]
+    return True
+
+
+@njit(cache=True)
+def compiled_verlet_sweep(positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                          head, next_, cell_of, cells_per_side, cell_size, picks, displacements, uniforms, first_move,
+                          offsets, counts, indices, reference_positions,
+                          reference_head, reference_next, reference_cell_of, reference_cells_per_side,
+                          reference_cell_size, list_range, half_skin, rejections):
+    """
+    The same trial moves as compiled_sweep from first_move on, the neighbours come from the Verlet list
+    Returns (accept count, energy change, the next move to do, is a row full)
+    If a row is full we stop, the list must be built again before the other moves
+    """
+    particle_number = positions.shape[0]
+    accept_count = 0
+    energy_change = 0.0
+    trial = np.empty(3)
+
+    # the particles could be moved by someone else since the last sweep (cluster moves, a restart ...)
+    for i in range(particle_number):
+        if get_displacement_squared(positions[i], reference_positions[i], box) > half_skin * half_skin:
+            if not update_verlet_row(i, positions, box, offsets, counts, indices, reference_positions,
+                                     reference_head, reference_next, reference_cell_of, reference_cells_per_side,
+                                     reference_cell_size, list_range):
+                return accept_count, energy_change, first_move, True
+
+    for move in range(first_move, picks.shape[0]):
+        i = picks[move]
+        for d in range(3):
+            trial[d] = positions[i, d] + displacements[move, d]
+            if trial[d] <= 0:
+                trial[d] += box[d]
+            elif trial[d] >= box[d]:
+                trial[d] -= box[d]
+
+        is_covered = get_displacement_squared(trial, reference_positions[i], box) <= half_skin * half_skin
+        if is_covered:
+            is_overlap, new_energy = get_verlet_energy(
+                i, trial, positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                offsets, counts, indices, True
+            )
+        else:
+            is_overlap, new_energy = get_local_energy(
+                i, trial, positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                head, next_, cells_per_side, cell_size, True
+            )
+        if is_overlap:
+            rejections[0] += 1
+            continue
+        is_overlap, old_energy = get_verlet_energy(
+            i, positions[i], positions, types, diameters, step_radii, step_energies, range_matrix, box,
+            offsets, counts, indices, False
+        )
+        delta = new_energy - old_energy
+        if uniforms[move] < np.exp(-delta):
+            accept_count += 1
+            energy_change += delta
+            for d in range(3):
+                positions[i, d] = trial[d]
+            move_in_cell_list(i, trial, head, next_, cell_of, cells_per_side, cell_size)
+            if not is_covered:
+                if not update_verlet_row(i, positions, box, offsets, counts, indices, reference_positions,
+                                         reference_head, reference_next, reference_cell_of, reference_cells_per_side,
+                                         reference_cell_size, list_range):
+                    return accept_count, energy_change, move + 1, True
+        else:
+            rejections[1] += 1
+    return accept_count, energy_change, picks.shape[0], False
+
+
+def checkerboard_sweep(state, cell_list, step, stream, rejections=None):
+    """
+    One sweep on many CPU cores, the number of cores is set by numba.set_num_threads(...)
+
+    The box is cut into cubic domains, every domain is wider than the longest interaction range,
+    and there is an even number of domains per side. Like a 3D chess board, the domains get
+    one of 8 colours, and two domains of the same colour never touch each other:
+
+        ┌───┬───┬───┬───┐
+        │ 0 │ 1 │ 0 │ 1 │    (one layer, in 3D there are 8 colours)
+        ├───┼───┼───┼───┤
+        │ 2 │ 3 │ 2 │ 3 │
+        └───┴───┴───┴───┘
+
+    We go through the 8 colours in a random order. For one colour, every domain of that colour
+    is given to a different core, and each core moves the particles inside its domain.
+    A particle can only feel particles in its own domain and the domains around it, which
+    don't move at the moment, so the cores never change something another core is reading.
+
+    To keep the detailed balance, a move that leaves the domain is rejected (the reverse move
+    would be impossible otherwise). The domains are shifted by a random amount every sweep,
+    so the particles can still go everywhere.
+    The random numbers are drawn from the stream before the cores start, so the result does not depend on the number of cores.
+    If the box is too small for 2 domains per side, the normal compiled sweep is used.
+    rejections counts the [overlap, metropolis, left the domain] rejections
+    """
+    box = state['box']
+    domains_per_side = (np.floor(box / float(np.max(state['range_matrix']))) // 2 * 2).astype(np.int64)
+    if np.any(domains_per_side < 2):
+        return numba_sweep(state, cell_list, step, stream, rejections)
+    if rejections is None:
+        rejections = np.zeros(3, dtype=np.int64)
+
+    # the shift of the domains, the order of the colours, and 5 numbers for every trial move
+    generator = stream['generator']
+    shift = generator.random(3) * box / domains_per_side
+    colours = generator.permutation(8)
+    random_numbers = generator.random((len(state['positions']), 5))
+    accept_count, energy_change = compiled_checkerboard_sweep(
+        state['positions'], state['types'], state['diameters'], state['step_radii'], state['step_energies'],
+        state['range_matrix'], box, domains_per_side, float(step), shift, colours, random_numbers, rejections
+    )
+    # the particles moved inside their domains, now put them into the right cells again
+    rebuild_cell_list(state['positions'], cell_list['head'], cell_list['next'], cell_list['cell_of'],
+                      cell_list['cells_per_side'], cell_list['cell_size'])
+    return int(accept_count), float(energy_change)
+
+
+@njit(cache=True)
+def get_domain_energy(i, position, positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                      domain, order, starts, counts, domains_per_side, stop_at_overlap):
+    """
+    The same as get_local_energy, but the neighbours are found in the 27 domains around `domain`
+    The particles of domain k are order[starts[k]:starts[k] + counts[k]]
+    """
+    nx, ny, nz = domains_per_side[0], domains_per_side[1], domains_per_side[2]
+    centre_x = domain // (ny * nz)
+    centre_y = (domain // nz) % ny
+    centre_z = domain % nz
+    type_i = types[i]
+    energy = 0.0
+    for offset_x in range(min(nx, 3)):
+        cx = get_neighbour_coordinate(centre_x, offset_x, nx)
+        for offset_y in range(min(ny, 3)):
+            cy = get_neighbour_coordinate(centre_y, offset_y, ny)
+            for offset_z in range(min(nz, 3)):
+                cz = get_neighbour_coordinate(centre_z, offset_z, nz)
+                neighbour_domain = (cx * ny + cy) * nz + cz
+                for k in range(starts[neighbour_domain], starts[neighbour_domain] + counts[neighbour_domain]):
+                    j = order[k]
+                    if j == i:
+                        continue
+                    squared_distance = 0.0
+                    for d in range(3):
+                        distance_1d = abs(positions[j, d] - position[d])
+                        if distance_1d > box[d] / 2:
+                            distance_1d = box[d] - distance_1d
+                        squared_distance += distance_1d * distance_1d
+                    type_j = types[j]
+                    contact = (diameters[type_i] + diameters[type_j]) / 2
+                    if stop_at_overlap and squared_distance <= contact * contact:
+                        return True, energy
+                    interaction_range = range_matrix[type_i, type_j]
+                    if squared_distance <= interaction_range * interaction_range:
+                        energy += get_pair_energy(squared_distance, type_i, type_j, step_radii, step_energies)
+    return False, energy
+
+
+@njit(cache=True)
+def get_domain(position, shift, domain_size, domains_per_side, box):
+    """the domain that contains the position, the domains start at `shift` instead of 0"""
+    domain = 0
+    for d in range(3):
+        shifted = (position[d] - shift[d]) % box[d]
+        coordinate = min(int(shifted / domain_size[d]), domains_per_side[d] - 1)
+        domain = domain * domains_per_side[d] + coordinate
+    return domain
+
+
+@njit(parallel=True, cache=True)
+def compiled_checkerboard_sweep(positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                                domains_per_side, step, shift, colours, random_numbers, rejections):
+    """
+    The domains start at shift, the colours are done in the order of `colours`
+    Every trial move uses one row of random_numbers: the particle, the 3 displacements and the acceptance
+    """
+    particle_number = positions.shape[0]
+    nx, ny, nz = domains_per_side[0], domains_per_side[1], domains_per_side[2]
+    domain_number = nx * ny * nz
+    domain_size = box / domains_per_side
+
+    # sort the particles by their (shifted) domains
+    domain_of = np.empty(particle_number, dtype=np.int64)
+    for i in range(particle_number):
+        domain_of[i] = get_domain(positions[i], shift, domain_size, domains_per_side, box)
+    order = np.argsort(domain_of, kind='mergesort')
+    counts = np.bincount(domain_of, minlength=domain_number)
+    starts = np.cumsum(counts) - counts
+
+    accept_count = 0
+    energy_change = 0.0
+    colour_start = 0  # the first row of random_numbers for this colour
+    for colour in colours:
+        # the domains of this colour, the parity of (cx, cy, cz) is the colour
+        active = []
+        for domain in range(domain_number):
+            cx, cy, cz = domain // (ny * nz), (domain // nz) % ny, domain % nz
+            if (cx % 2) * 4 + (cy % 2) * 2 + (cz % 2) == colour:
+                active.append(domain)
+        active = np.array(active, dtype=np.int64)
+
+        # every domain gets its own rows of random numbers, one row for each move
+        first_move = colour_start + np.cumsum(counts[active]) - counts[active]
+        colour_start += np.sum(counts[active])
+
+        accepted = np.zeros(len(active), dtype=np.int64)
+        changes = np.zeros(len(active))
+        rejected = np.zeros((len(active), 3), dtype=np.int64)  # every core counts in its own row
+        for a in prange(len(active)):
+            domain = active[a]
+            trial = np.empty(3)
+            for move in range(counts[domain]):
+                numbers = random_numbers[first_move[a] + move]
+                i = order[starts[domain] + min(int(numbers[0] * counts[domain]), counts[domain] - 1)]
+                for d in range(3):
+                    trial[d] = positions[i, d] + (2 * numbers[d + 1] - 1) * step
+                    if trial[d] <= 0:
+                        trial[d] += box[d]
+                    elif trial[d] >= box[d]:
+                        trial[d] -= box[d]
+                if get_domain(trial, shift, domain_size, domains_per_side, box) != domain:
+                    rejected[a, 2] += 1
+                    continue
+                is_overlap, new_energy = get_domain_energy(
+                    i, trial, positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                    domain, order, starts, counts, domains_per_side, True
+                )
+                if is_overlap:
+                    rejected[a, 0] += 1
+                    continue
+                is_overlap, old_energy = get_domain_energy(
+                    i, positions[i], positions, types, diameters, step_radii, step_energies, range_matrix, box,
+                    domain, order, starts, counts, domains_per_side, False
+                )
+                delta = new_energy - old_energy
+                if numbers[4] < np.exp(-delta):
+                    accepted[a] += 1
+                    changes[a] += delta
+                    for d in range(3):
+                        positions[i, d] = trial[d]
+                else:
+                    rejected[a, 1] += 1
+        accept_count += np.sum(accepted)
+        energy_change += np.sum(changes)
+        for r in range(3):
+            rejections[r] += np.sum(rejected[:, r])
+    return accept_count, energy_change
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Trajectory: This module writes the positions of every frame into a file, and reads them back
+
+We open the file once and keep it open, instead of opening it again for every frame.
+There are two formats
+    'xyz'    -- the text file we always used, open it in Ovito
+    'binary' -- the positions are saved as float32 numbers, the file is about 4 times smaller
+                and much faster to write. Use `export_xyz` to turn it into a .xyz file later.
+
+A binary trajectory is made of three files
+    positions.traj        -- frame after frame, every frame is N×3 float32 numbers
+    positions.traj.json   -- the number of particles and the type of every particle
+    positions.traj.index  -- one line for every frame: the byte offset and the comment line
+
+To read a long trajectory we don't want to go through the whole file to get the last frame.
+`open_reader` finds where every frame starts in the file (only once, the result is saved
+next to the file as positions.xyz.index.npz), then `read_frame` jumps to the frame directly.
+The file is memory-mapped, so the operating system only loads the parts we read.
+
+    reader = open_reader('positions_hard_sphere_attracted_binary.xyz')
+    positions, labels, comment = read_frame(reader, 100)
+    for positions, labels, comment in read_frames(reader, start=0, step=10):
+        ...
+"""
+import os
+import re
+import json
+import mmap
+import numpy as np
+from background_writer import submit, wait_for_writer
+
+BUFFER_SIZE = 1024 * 1024  # collect 1 MB of text before writing it to the disk
+CHUNK_SIZE = 64 * 1024 * 1024  # look for the line breaks in 64 MB of the file each time
+
+
+def open_trajectory(filename, labels, file_format='xyz', precision=None, position=None, background=None):
+    """
+    Create (or rewrite) a trajectory file, labels are the names of the particles like ['A', 'B', 'B' ...]
+    With precision=None the xyz file has all the digits, precision=6 means 6 digits after the point
+    position comes from `get_trajectory_position`, then the file is cut back to that frame and we
+    continue writing after it (this is used to restart a simulation from a checkpoint)
+    With a background writer (see background_writer.py) the frames are formatted and written in its thread
+
+    The stuff below are some testing code, don't worry about it
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'test.xyz')
+    >>> writer = open_trajectory(filename, ['A', 'B'], precision=2)
+    >>> write_frame(writer, [[0, 1, 2], [3, 4, 5]], 'frame 0')
+    >>> close_trajectory(writer)
+    >>> open(filename).read().splitlines()
+    ['2', 'frame 0', 'A\\t0.00\\t1.00\\t2.00', 'B\\t3.00\\t4.00\\t5.00']
+    """
+    if file_format not in ['xyz', 'binary']:
+        raise ValueError("file_format should be 'xyz' or 'binary', not {}".format(file_format))
+    writer = {
+        'filename': filename,
+        'format': file_format,
+        'labels': list(labels),
+        'frame_number': 0,
+    }
+    mode = 'w'
+    if position is not None:
+        # throw away the frames written after the checkpoint, then add the new frames to the end
+        writer['frame_number'] = position['frame_number']
+        truncate_file(filename, position['size'])
+        if file_format == 'binary':
+            truncate_file(filename + '.index', position['index_size'])
+        mode = 'a'
+    if file_format == 'xyz':
+        number_format = '%r' if precision is None else '%.{}f'.format(precision)
+        writer['line_format'] = '%s' + ('\t' + number_format) * 3 + '\n'
+        writer['file'] = open(filename, mode, buffering=BUFFER_SIZE)
+    else:
+        species, types = np.unique(writer['labels'], return_inverse=True)
+        with open(filename + '.json', 'w') as f:
+            json.dump({'particle_number': len(types), 'species': species.tolist(), 'types': types.tolist()}, f)
+        writer['file'] = open(filename, mode + 'b', buffering=BUFFER_SIZE)
+        writer['index_file'] = open(filename + '.index', mode)
+    if background is not None:
+        writer['background'] = background
+        writer['flush_files'] = lambda: flush_files(writer)
+        background['idle_tasks'].append(writer['flush_files'])
+    return writer
+
+
+def truncate_file(filename, size):
+    """cut the file back to size bytes"""
+    if os.path.getsize(filename) < size:
+        raise ValueError('{} is shorter than the checkpoint, it has {} bytes, not {}'.format(
+            filename, os.path.getsize(filename), size
+        ))
+    with open(filename, 'r+b') as f:
+        f.truncate(size)
+
+
+def write_frame(writer, positions, comment=''):
+    """
+    append one frame, the comment is the second line of a .xyz frame
+    With a background writer, a copy of the positions goes into its queue and we return at once
+
+    The stuff below are some testing code, don't worry about it
+    >>> import os, tempfile
+    >>> from background_writer import start_background_writer, stop_background_writer
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'test.xyz')
+    >>> background = start_background_writer(2)
+    >>> writer = open_trajectory(filename, ['A'], precision=1, background=background)
+    >>> positions = np.zeros((1, 3))
+    >>> for t in range(3):
+    ...     write_frame(writer, positions, 'frame {}'.format(t))
+    ...     positions += 1  # the frames in the queue don't change
+    >>> close_trajectory(writer)
+    >>> stop_background_writer(background)
+    >>> open(filename).read().splitlines()[-6:]
+    ['1', 'frame 1', 'A\\t1.0\\t1.0\\t1.0', '1', 'frame 2', 'A\\t2.0\\t2.0\\t2.0']
+    """
+    if 'background' in writer:
+        submit(writer['background'], write_frame_now, writer, np.array(positions, dtype=np.float64), comment)
+    else:
+        write_frame_now(writer, positions, comment)
+
+
+def write_frame_now(writer, positions, comment=''):
+    """format the frame and write it to the file"""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    if writer['format'] == 'xyz':
+        # format all the numbers in one go, instead of adding strings particle by particle
+        table = np.empty((len(positions), 4), dtype=object)
+        table[:, 0] = writer['labels']
+        table[:, 1:] = positions
+        writer['file'].write('{}\n{}\n'.format(len(positions), comment))
+        writer['file'].write(writer['line_format'] * len(positions) % tuple(table.ravel()))
+    else:
+        writer['index_file'].write('{}\t{}\n'.format(writer['file'].tell(), comment))
+        writer['file'].write(positions.astype('<f4').tobytes())
+    writer['frame_number'] += 1
+
+
+def flush_trajectory(writer):
+    """make sure everything written so far is on the disk, the frames in the queue are written first"""
+    if 'background' in writer:
+        wait_for_writer(writer['background'])
+    flush_files(writer)
+
+
+def flush_files(writer):
+    writer['file'].flush()
+    if 'index_file' in writer:
+        writer['index_file'].flush()
+
+
+def get_trajectory_position(writer):
+    """
+    Where we are in the trajectory, save it in a checkpoint and give it to `open_trajectory` to continue
+
+    The stuff below are some testing code, don't worry about it
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'test.traj')
+    >>> writer = open_trajectory(filename, ['A'], file_format='binary')
+    >>> write_frame(writer, [[0, 1, 2]], 'frame 0')
+    >>> position = get_trajectory_position(writer)
+    >>> write_frame(writer, [[9, 9, 9]], 'this frame is lost')
+    >>> close_trajectory(writer)
+    >>> writer = open_trajectory(filename, ['A'], file_format='binary', position=position)
+    >>> write_frame(writer, [[3, 4, 5]], 'frame 1')
+    >>> close_trajectory(writer)
+    >>> read_binary_index(filename)
+    ([0, 12], ['frame 0', 'frame 1'])
+    """
+    flush_trajectory(writer)
+    position = {'frame_number': writer['frame_number'], 'size': writer['file'].tell(), 'index_size': 0}
+    if 'index_file' in writer:
+        position['index_size'] = writer['index_file'].tell()
+    return position
+
+
+def close_trajectory(writer):
+    """write the frames left in the queue (if there is a background writer), then close the files"""
+    try:
+        if 'background' in writer:
+            wait_for_writer(writer['background'])
+    finally:
+        # the files are closed even if the writer failed
+        if 'background' in writer and writer['flush_files'] in writer['background']['idle_tasks']:
+            writer['background']['idle_tasks'].remove(writer['flush_files'])
+        writer['file'].close()
+        if 'index_file' in writer:
+            writer['index_file'].close()
+
+
+def read_binary_header(filename):
+    """the particle number, species and types of a binary trajectory"""
+    with open(filename + '.json') as f:
+        return json.load(f)
+
+
+def read_binary_index(filename):
+    """the byte offset and the comment of every frame in a binary trajectory"""
+    offsets, comments = [], []
+    with open(filename + '.index') as f:
+        for line in f:
+            offset, comment = line.rstrip('\n').split('\t', 1)
+            offsets.append(int(offset))
+            comments.append(comment)
+    return offsets, comments
+
+
+def export_xyz(filename, xyz_filename, precision=6):
+    """
+    Turn a binary trajectory into a .xyz file that Ovito can open
+
+    The stuff below are some testing code, don't worry about it
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'test.traj')
+    >>> writer = open_trajectory(filename, ['A', 'B'], file_format='binary')
+    >>> write_frame(writer, [[0, 1, 2], [3, 4, 5]], 'frame 0')
+    >>> write_frame(writer, [[0.5, 1, 2], [3, 4, 5]], 'frame 1')
+    >>> close_trajectory(writer)
+    >>> export_xyz(filename, filename + '.xyz', precision=1)
+    >>> print(open(filename + '.xyz').read().splitlines()[4:])
+    ['2', 'frame 1', 'A\\t0.5\\t1.0\\t2.0', 'B\\t3.0\\t4.0\\t5.0']
+    """
+    header = read_binary_header(filename)
+    labels = [header['species'][t] for t in header['types']]
+    comments = read_binary_index(filename)[1]
+    frames = np.memmap(filename, dtype='<f4', mode='r').reshape(-1, header['particle_number'], 3)
+    writer = open_trajectory(xyz_filename, labels, precision=precision)
+    for frame, comment in zip(frames[:len(comments)], comments):
+        write_frame(writer, frame, comment)
+    close_trajectory(writer)
+
+
+def build_xyz_index(data):
+    """
+    Find the byte offset of every frame in the (memory-mapped) content of a .xyz file
+    We only look at the first line of each frame (the particle number), then jump over
+    the comment line and the particle lines. The line breaks are found with numpy, chunk by chunk.
+    Returns the offsets and the particle number of every frame.
+    """
+    offsets, particle_numbers = [], []
+    next_frame_line = 0  # the line number where the next frame starts
+    line_number = 0  # the line number of the first line in the chunk
+    line_start = 0  # the byte offset of the first line in the chunk
+    for chunk_start in range(0, len(data), CHUNK_SIZE):
+        chunk = np.frombuffer(data, dtype=np.uint8, count=min(CHUNK_SIZE, len(data) - chunk_start), offset=chunk_start)
+        line_ends = chunk_start + np.flatnonzero(chunk == ord('\n'))
+        while next_frame_line < line_number + len(line_ends):
+            if next_frame_line > line_number:
+                offset = int(line_ends[next_frame_line - line_number - 1]) + 1
+            else:
+                offset = line_start
+            if offset >= len(data) or not data[offset:data.find(b'\n', offset)].strip():
+                # an empty line at the end of the file
+                return np.array(offsets, dtype=np.int64), np.array(particle_numbers, dtype=np.int64)
+            particle_number = int(data[offset:data.find(b'\n', offset)])
+            offsets.append(offset)
+            particle_numbers.append(particle_number)
+            next_frame_line += particle_number + 2
+        if len(line_ends) > 0:
+            line_start = int(line_ends[-1]) + 1
+        line_number += len(line_ends)
+    return np.array(offsets, dtype=np.int64), np.array(particle_numbers, dtype=np.int64)
+
+
+def load_xyz_index(filename, data):
+    """use the index saved next to the file, or build it if the file was changed since then"""
+    index_filename = filename + '.index.npz'
+    file_size, modified_time = os.path.getsize(filename), os.stat(filename).st_mtime_ns
+    if os.path.exists(index_filename):
+        with np.load(index_filename) as cached:  # close the file, the arrays are read into memory
+            if cached['file_size'] == file_size and cached['modified_time'] == modified_time:
+                return cached['offsets'], cached['particle_numbers']
+    offsets, particle_numbers = build_xyz_index(data)
+    np.savez(
+        index_filename, offsets=offsets, particle_numbers=particle_numbers,
+        file_size=file_size, modified_time=modified_time
+    )
+    return offsets, particle_numbers
+
+
+def open_reader(filename):
+    """
+    Open a trajectory for reading, it could be a .xyz file or a binary trajectory
+
+    The stuff below are some testing code, don't worry about it
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'test.xyz')
+    >>> writer = open_trajectory(filename, ['A', 'B'])
+    >>> for t in range(5):
+    ...     write_frame(writer, [[t, 1, 2], [3, 4, 5]], 'box is [6, 6, 6], at frame {}'.format(t))
+    >>> close_trajectory(writer)
+    >>> reader = open_reader(filename)
+    >>> count_frames(reader)
+    5
+    >>> positions, labels, comment = read_frame(reader, 3)
+    >>> positions.tolist(), labels, parse_comment(comment)
+    ([[3.0, 1.0, 2.0], [3.0, 4.0, 5.0]], ['A', 'B'], {'box': [6.0, 6.0, 6.0], 'frame': 3})
+    >>> load_frames(reader, 0, 5, 2)[:, 0, 0].tolist()
+    [0.0, 2.0, 4.0]
+    >>> close_reader(reader)
+    """
+    reader = {'filename': filename}
+    if os.path.exists(filename + '.json'):
+        header = read_binary_header(filename)
+        reader['format'] = 'binary'
+        reader['labels'] = [header['species'][t] for t in header['types']]
+        reader['comments'] = read_binary_index(filename)[1]
+        reader['frames'] = np.memmap(filename, dtype='<f4', mode='r').reshape(-1, header['particle_number'], 3)
+        return reader
+    reader['format'] = 'xyz'
+    reader['file'] = open(filename, 'rb')
+    if os.path.getsize(filename) == 0:
+        reader['data'] = b''
+    else:
+        reader['data'] = mmap.mmap(reader['file'].fileno(), 0, access=mmap.ACCESS_READ)
+    reader['offsets'], reader['particle_numbers'] = load_xyz_index(filename, reader['data'])
+    return reader
+
+
+def close_reader(reader):
+    if reader['format'] == 'xyz':
+        if isinstance(reader['data'], mmap.mmap):
+            reader['data'].close()
+        reader['file'].close()
+
+
+def count_frames(reader):
+    if reader['format'] == 'xyz':
+        return len(reader['offsets'])
+    return len(reader['comments'])
+
+
+def read_frame(reader, k):
+    """get the positions as a (N, 3) array, the labels and the comment line of frame k"""
+    if reader['format'] == 'binary':
+        return np.array(reader['frames'][k], dtype=np.float64), reader['labels'], reader['comments'][k]
+    data, offset, particle_number = reader['data'], reader['offsets'][k], reader['particle_numbers'][k]
+    comment_start = data.find(b'\n', offset) + 1
+    comment_end = data.find(b'\n', comment_start)
+    comment = data[comment_start:comment_end].decode()
+    if k + 1 < len(reader['offsets']):
+        frame_end = reader['offsets'][k + 1]
+    else:
+        frame_end = len(data)
+    table = np.array(data[comment_end + 1:frame_end].split(), dtype=object).reshape(particle_number, 4)
+    labels = [label.decode() for label in table[:, 0]]
+    return table[:, 1:].astype(np.float64), labels, comment
+
+
+def read_frames(reader, start=0, stop=None, step=1):
+    """go through the frames one by one, like range(start, stop, step)"""
+    for k in range(*slice(start, stop, step).indices(count_frames(reader))):
+        yield read_frame(reader, k)
+
+
+def load_frames(reader, start=0, stop=None, step=1):
+    """load many frames into one (frame number, N, 3) array, every frame must have the same N"""
+    return np.array([positions for positions, labels, comment in read_frames(reader, start, stop, step)])
+
+
+def parse_comment(comment):
+    """
+    Get the box and the frame number from a comment like 'box is [8.6, 8.6, 8.6], at frame 12'
+    This is the comment written by hard_sphere_attracted_binary.py, other comments give {}
+    """
+    match = re.match(r'box is \[([^\]]*)\], at frame (\d+)', comment)
+    if match is None:
+        return {}
+    return {'box': [float(value) for value in match.group(1).split(',')], 'frame': int(match.group(2))}
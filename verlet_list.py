@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Verlet list: This module keeps a list of the neighbours of every particle
+
+The cell list (cell_list.py) visits 27 cells for every trial move. With a short square well
+and a low volume fraction most of these cells are empty, or the particles in them are too far away.
+A Verlet list remembers, for every particle, the particles closer than cutoff + skin:
+
+    neighbours of particle i = indices[offsets[i]:offsets[i] + counts[i]]
+
+    offsets: 0           4                 10          (where the row of each particle starts)
+    counts:  2           3                  ...        (how many neighbours are in the row)
+    indices: 3  1  -  -  0  2  4  -  -  -  ...         (- is free space)
+
+    Figure 1. The flat arrays of a Verlet list, particle 0 has the neighbours 3 and 1
+
+Every row has some free space at the end, so we can add a neighbour without moving the whole array.
+
+The list is built at the "reference positions" and used again for many moves. As long as a particle
+stays within skin / 2 of its reference position, it can't meet a particle that was further than
+cutoff + skin away. When a particle goes further, only its own row is found again (see the 'verlet'
+backend in sweep_engine.py): it is taken out of the rows of its old neighbours, its reference position
+is moved, and it is put into the rows of its new neighbours. To find the new neighbours quickly,
+the reference positions are also kept in a cell list with cells of cutoff + skin.
+The whole list is only built again if a row is full.
+A bigger skin means fewer updates, but longer rows.
+"""
+import numpy as np
+from cell_list import build_cell_list, get_pairs
+from pbc import get_pair_squared_distances_in_pbc
+
+
+def build_verlet_list(positions, box, cutoff, skin):
+    """
+    Find the neighbours of every particle closer than cutoff + skin, the pairs are found with get_pairs
+
+    The stuff below are some testing code, don't worry about it
+    >>> verlet_list = build_verlet_list([[1, 1, 1], [2, 1, 1], [3.4, 1, 1], [9.5, 1, 1]], [10, 10, 10], 1, 0.5)
+    >>> [sorted(get_verlet_neighbours(verlet_list, i).tolist()) for i in range(4)]
+    [[1, 3], [0, 2], [1], [0]]
+    >>> verlet_list['counts'].tolist(), verlet_list['offsets'].tolist()
+    ([2, 2, 1, 1], [0, 11, 22, 31, 40])
+    """
+    positions = np.array(positions, dtype=np.float64).reshape(-1, 3)
+    box = np.array(box, dtype=np.float64)
+    particle_number = len(positions)
+    list_range = cutoff + skin
+    i, j = get_pairs(positions, box, list_range)
+    squared_distances = get_pair_squared_distances_in_pbc(positions, np.stack([i, j], axis=1), box)
+    is_close = squared_distances <= list_range ** 2
+    i, j = i[is_close], j[is_close]
+
+    # every pair goes into the row of both particles, then sort them by the first particle
+    first = np.concatenate([i, j])
+    second = np.concatenate([j, i])
+    order = np.argsort(first, kind='stable')
+    first, second = first[order], second[order]
+    counts = np.bincount(first, minlength=particle_number).astype(np.int64)
+
+    # leave some free space in every row, half of the neighbours and 8 more
+    capacities = counts + counts // 2 + 8
+    offsets = np.zeros(particle_number + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(capacities)
+    indices = np.full(offsets[-1], -1, dtype=np.int64)
+    rank = np.arange(len(first)) - (np.cumsum(counts) - counts)[first]  # the place of every pair in its row
+    indices[offsets[first] + rank] = second
+    return {
+        'cutoff': float(cutoff),
+        'skin': float(skin),
+        'offsets': offsets,
+        'counts': counts,
+        'indices': indices,
+        'reference_positions': positions,
+        'reference_cells': build_cell_list(positions, box, list_range),
+        'box': box,
+        'build_count': 1,
+    }
+
+
+def get_verlet_neighbours(verlet_list, i):
+    """the particles that might be closer than the cutoff to particle i"""
+    start = verlet_list['offsets'][i]
+    return verlet_list['indices'][start:start + verlet_list['counts'][i]]
+
+
+def get_max_displacement(verlet_list, positions):
+    """how far the particles went from the reference positions, the largest one"""
+    box = verlet_list['box']
+    displacements = np.abs(np.asarray(positions) - verlet_list['reference_positions'])
+    displacements = np.where(displacements > box / 2, box - displacements, displacements)
+    return float(np.sqrt(np.max(np.sum(displacements ** 2, axis=1), initial=0)))
+
+
+def is_same_system(verlet_list, positions, box, cutoff):
+    """False if the number of particles, the box or the cutoff changed since the list was built"""
+    return bool(
+        len(positions) == len(verlet_list['reference_positions'])
+        and np.all(np.asarray(box) == verlet_list['box'])
+        and cutoff == verlet_list['cutoff']
+    )
+
+
+def update_verlet_list(verlet_list, positions, box, cutoff):
+    """
+    Build the whole list again if a particle went further than skin / 2, or if the box or the cutoff changed
+    Returns True if the list was built again
+
+    The stuff below are some testing code, don't worry about it
+    >>> positions = np.array([[1, 1, 1], [2, 1, 1], [5, 5, 5]], dtype=np.float64)
+    >>> verlet_list = build_verlet_list(positions, [10, 10, 10], 1, 0.5)
+    >>> positions[2, 0] += 0.2
+    >>> update_verlet_list(verlet_list, positions, [10, 10, 10], 1)
+    False
+    >>> positions[2, 0] += 0.2
+    >>> update_verlet_list(verlet_list, positions, [10, 10, 10], 1), verlet_list['build_count']
+    (True, 2)
+    """
+    box = np.asarray(box, dtype=np.float64)
+    if is_same_system(verlet_list, positions, box, cutoff) and get_max_displacement(verlet_list, positions) <= verlet_list['skin'] / 2:
+        return False
+    build_count = verlet_list['build_count']
+    verlet_list.update(build_verlet_list(positions, box, cutoff, verlet_list['skin']))
+    verlet_list['build_count'] = build_count + 1
+    return True
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Volume moves: This module lets the box change its size, so we can run at a fixed pressure (NPT)
+
+With a fixed box (NVT) we choose the volume fraction and get the pressure. To find the volume fraction
+of a given pressure we had to try many boxes. In the NPT ensemble the box finds it by itself:
+every sweep we also try a "volume move"
+
+    1. Pick a new volume with ln(V_new) = ln(V) + a random number between -volume_step and volume_step
+    2. Multiply the box and all the positions by s = (V_new / V)^(1/3), the particles keep their places
+       relative to the box ("affine" scaling)
+    3. Accept the move with the probability
+            P = min(1, exp(-ΔU - pressure × (V_new - V) + (N + 1) × ln(V_new / V)))
+
+The pressure is in units of kT / σ³ (like the depths, which are in units of kT).
+
+To check the overlaps and ΔU we don't need all the N×N pairs. Only the pairs that are closer than
+the longest interaction range (after the move) change their energy, and they are found with the cell list.
+For pure hard spheres it is even simpler: a bigger box can't make an overlap, and for a smaller box
+only the pairs closer than diameter / s can overlap.
+After an accepted move, the cells are scaled with the box, and the particles are put into them again.
+"""
+import numpy as np
+from cell_list import get_pairs, resize_cell_list, rebuild_cell_list
+from pbc import get_pair_squared_distances_in_pbc
+from potentials import get_pair_energies
+
+# the densest packing of spheres, the box can never be smaller than this
+MAX_VOLUME_FRACTION = np.pi / (3 * np.sqrt(2))
+
+
+def get_volume_fraction(state):
+    """the volume of all the particles divided by the volume of the box"""
+    diameters = state['diameters'][state['types']]
+    return float(np.pi / 6 * np.sum(diameters ** 3) / np.prod(state['box']))
+
+
+def get_number_density(state):
+    return len(state['positions']) / float(np.prod(state['box']))
+
+
+def get_volume_energy_change(state, scale):
+    """
+    The energy change if the box and all the positions are multiplied by scale, inf if two particles would overlap
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> state = create_particle_state(
+    ...     [[1, 1, 1], [2.2, 1, 1], [5, 5, 5]], [0, 0, 0], [8, 8, 8], ['A'], [1], depths=[[-1]], widths=[[0.1]]
+    ... )
+    >>> get_volume_energy_change(state, 1.01), get_volume_energy_change(state, 0.9), get_volume_energy_change(state, 0.8)
+    (0.0, -1.0, inf)
+    """
+    positions, types, box = state['positions'], state['types'], state['box']
+    has_steps = bool(np.any(state['step_energies']))
+    if scale >= 1 and not has_steps:
+        return 0.0  # hard spheres only get further apart
+    if has_steps:
+        cutoff = float(np.max(state['range_matrix']))
+    else:
+        cutoff = float(np.max(state['diameters']))
+    if cutoff == 0:
+        return 0.0  # an ideal gas
+    cutoff = cutoff / min(scale, 1)  # the pairs that will be closer than the cutoff after the move
+    i, j = get_pairs(positions, box, cutoff)
+    squared_distances = get_pair_squared_distances_in_pbc(positions, np.stack([i, j], axis=1), box)
+    is_close = squared_distances <= cutoff ** 2
+    i, j, squared_distances = i[is_close], j[is_close], squared_distances[is_close]
+    new_energies = get_pair_energies(state, types[i], types[j], squared_distances * scale ** 2)
+    if np.any(np.isinf(new_energies)):
+        return np.inf
+    old_energies = get_pair_energies(state, types[i], types[j], squared_distances, with_overlap=False)
+    return float(np.sum(new_energies) - np.sum(old_energies))
+
+
+def volume_move(state, cell_list, pressure, volume_step, stream):
+    """
+    Try one volume move at the pressure, the random numbers come from the stream (see random_stream.py)
+    The positions, the box and the cell list are changed in place if the move is accepted
+    Returns (is_accepted, energy change)
+
+    The stuff below are some testing code, don't worry about it
+    >>> from particle_state import create_particle_state
+    >>> from cell_list import build_cell_list
+    >>> from random_stream import create_random_stream
+    >>> state = create_particle_state(np.random.uniform(0, 10, (50, 3)), np.zeros(50), [10, 10, 10], ['G'], [0])
+    >>> cells = build_cell_list(state['positions'], state['box'], 1)
+    >>> stream = create_random_stream(0)
+    >>> volumes = []
+    >>> for t in range(4000):
+    ...     is_accepted, delta = volume_move(state, cells, 1.0, 0.3, stream)
+    ...     volumes.append(np.prod(state['box']))
+    >>> bool(abs(np.mean(volumes[1000:]) - 51) < 5)  # an ideal gas has <V> = (N + 1) / pressure
+    True
+    """
+    generator = stream['generator']
+    volume = float(np.prod(state['box']))
+    new_volume = volume * np.exp(generator.uniform(-volume_step, volume_step))
+    scale = (new_volume / volume) ** (1 / 3)
+    energy_change = get_volume_energy_change(state, scale)
+    particle_number = len(state['positions'])
+    log_probability = -energy_change - pressure * (new_volume - volume) + (particle_number + 1) * np.log(new_volume / volume)
+    if not generator.random() < np.exp(min(log_probability, 0)):
+        return False, 0.0
+
+    state['positions'] *= scale
+    state['box'] *= scale
+    resize_cell_list(cell_list, state['box'])
+    rebuild_cell_list(state['positions'], cell_list['head'], cell_list['next'], cell_list['cell_of'],
+                      cell_list['cells_per_side'], cell_list['cell_size'])
+    return True, energy_change
+
+
+def adjust_volume_step(old_step, accept_ratio):
+    """like adjust_step in hard_sphere_attracted_binary.py, keep about 40% of the volume moves"""
+    if accept_ratio > 0.5:
+        new_step = 1.1 * old_step
+    elif accept_ratio < 0.3:
+        new_step = 0.9 * old_step
+    else:
+        new_step = old_step
+    return min(new_step, 0.5)